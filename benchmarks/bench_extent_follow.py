@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Replay a host pan burst and report the lag between host and follower.
+
+The follower is modelled as a single GUI thread which needs render_ms for
+every canvas render. The old code path renders twice per extent message
+(setCenter + zoomScale) and forces all layers to be fetched again
+(refreshAllLayers), the new path renders once and only applies the newest
+extent. The host side is replayed with and without the ExtentThrottle.
+
+Usage: python benchmarks/bench_extent_follow.py [--trace burst.json] [--json]
+
+A trace is a JSON list of [t_seconds, cx, cy, scale, map_units_per_pixel]
+as recorded from the extentsChanged signal of the host canvas.
+"""
+import argparse
+import heapq
+import json
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.extent import ExtentThrottle, LatestExtentSlot
+
+
+def synthetic_burst(duration=2.0, hz=60.0):
+    #smooth pan to the east followed by four wheel zoom steps
+    trace = []
+    n = int(duration * hz)
+    for i in range(n):
+        trace.append([i / hz, 500000.0 + i * 40.0, 5300000.0 + i * 5.0, 25000.0, 7.0])
+    t0 = duration
+    cx, cy = trace[-1][1], trace[-1][2]
+    scale, mupp = 25000.0, 7.0
+    for step in range(4):
+        for k in range(6):
+            scale *= 0.97
+            mupp *= 0.97
+            trace.append([t0 + step * 0.15 + k / hz, cx, cy, scale, mupp])
+    return trace
+
+
+def host_messages(trace, throttled):
+    """Return the (send_time, trace_index) pairs leaving the host."""
+    if not throttled:
+        return [(rec[0], ix) for ix, rec in enumerate(trace)]
+
+    now = [0.0]
+    sent = []
+    current = [0]
+    throttle = ExtentThrottle(lambda msg: sent.append((now[0], current[0])), clock=lambda: now[0])
+
+    next_poll = None
+    for ix, rec in enumerate(trace):
+        #run polls due before this signal
+        while next_poll is not None and next_poll <= rec[0]:
+            now[0] = next_poll
+            delay = throttle.poll()
+            next_poll = None if delay is None else now[0] + delay
+        now[0] = rec[0]
+        current[0] = ix
+        delay = throttle.offer(rec[1], rec[2], rec[3], rec[4])
+        next_poll = None if delay is None else now[0] + delay
+
+    while next_poll is not None:
+        now[0] = next_poll
+        delay = throttle.poll()
+        next_poll = None if delay is None else now[0] + delay
+
+    return sent
+
+
+def follower(messages, latency, render, refetch, latest_wins):
+    """Simulate the follower GUI thread; returns (done_time, trace_index) per applied extent."""
+    arrivals = [(t + latency, ix) for t, ix in messages]
+    heapq.heapify(arrivals)
+
+    slot = LatestExtentSlot()
+    applied = []
+    busy_until = 0.0
+    queue = []
+
+    def deliver(t, ix):
+        if not latest_wins:
+            queue.append((t, ix))
+        elif slot.put((t, ix)):
+            queue.append((t, None))
+
+    while arrivals or queue:
+        if not queue:
+            deliver(*heapq.heappop(arrivals))
+            continue
+
+        #everything arriving until the gui thread is free again is delivered first
+        start = max(busy_until, queue[0][0])
+        while arrivals and arrivals[0][0] <= start:
+            deliver(*heapq.heappop(arrivals))
+
+        _, ix = queue.pop(0)
+        if latest_wins:
+            _, ix = slot.take()
+            cost = render
+        else:
+            cost = 2 * render + refetch
+        busy_until = start + cost
+        applied.append((busy_until, ix))
+
+    return applied, slot.dropped
+
+
+def lag_stats(trace, applied):
+    #lag of host state i: first time the follower shows state i or a newer one
+    lags = []
+    j = 0
+    applied = sorted(applied)
+    best = -1
+    shown = []
+    for done, ix in applied:
+        best = max(best, ix)
+        shown.append((done, best))
+    for ix, rec in enumerate(trace):
+        while j < len(shown) and shown[j][1] < ix:
+            j += 1
+        if j < len(shown):
+            lags.append(shown[j][0] - rec[0])
+    lags.sort()
+    if not lags:
+        return {}
+    final = shown[-1][0] - trace[-1][0] if shown and shown[-1][1] == len(trace) - 1 else None
+    return {"mean_ms": 1000 * sum(lags) / len(lags),
+            "p95_ms": 1000 * lags[int(0.95 * (len(lags) - 1))],
+            "max_ms": 1000 * lags[-1],
+            "final_ms": None if final is None else 1000 * final}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trace", help="recorded burst as JSON list")
+    parser.add_argument("--latency-ms", type=float, default=40.0)
+    parser.add_argument("--render-ms", type=float, default=35.0)
+    parser.add_argument("--refetch-ms", type=float, default=80.0, help="extra cost of invalidated layer caches")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    if args.trace:
+        with open(args.trace, "r") as trace_file:
+            trace = json.load(trace_file)
+    else:
+        trace = synthetic_burst()
+
+    results = {}
+    for throttled in (False, True):
+        for latest_wins in (False, True):
+            msgs = host_messages(trace, throttled)
+            applied, dropped = follower(msgs, args.latency_ms / 1000.0, args.render_ms / 1000.0,
+                                        args.refetch_ms / 1000.0, latest_wins)
+            key = "%s host / %s follower" % ("throttled" if throttled else "raw", "latest-wins" if latest_wins else "per-message")
+            res = {"signals": len(trace), "messages": len(msgs), "renders": len(applied), "dropped": dropped}
+            res.update(lag_stats(trace, applied))
+            results[key] = res
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    for key, res in results.items():
+        print("%-40s msgs %4d  renders %4d  lag mean %8.1f ms  p95 %8.1f ms  max %8.1f ms  final %8.1f ms" %
+              (key, res["messages"], res["renders"], res["mean_ms"], res["p95_ms"], res["max_ms"], res["final_ms"] or float("nan")))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,172 @@
+# -*- coding: utf-8 -*-
+"""Time from an extent message to a fully drawn map on a follower.
+
+A local stand-in tile server (XYZ, like most WMS/WMTS basemaps) answers
+every tile request after --latency-ms. A headless QGIS canvas follows a
+host that pans and zooms at constant speed, sending EXTENT_MAX_HZ extent
+messages per second. Each message is applied like set_extent_from_remote
+does and the time until the canvas finished drawing is measured, once
+without and once with the WmsPrefetcher. The network cache is cleared
+before each run. It needs the python environment of a QGIS installation.
+
+Usage:
+    python benchmarks/bench_prefetch.py [--latency-ms 150] [--messages 40] [--json]
+"""
+import argparse
+import http.server
+import json
+import os
+import statistics
+import struct
+import sys
+import threading
+import time
+import zlib
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def png_tile(size=256, rgb=(200, 220, 240)):
+    def chunk(tag, data):
+        return struct.pack(">I", len(data)) + tag + data + struct.pack(">I", zlib.crc32(tag + data))
+    row = b"\x00" + bytes(rgb) * size
+    return (b"\x89PNG\r\n\x1a\n" + chunk(b"IHDR", struct.pack(">IIBBBBB", size, size, 8, 2, 0, 0, 0))
+            + chunk(b"IDAT", zlib.compress(row * size)) + chunk(b"IEND", b""))
+
+
+class TileServer(http.server.ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, latency):
+        self.latency = latency
+        self.tile = png_tile()
+        self.requests = 0
+        self._lock = threading.Lock()
+        super().__init__(("127.0.0.1", 0), TileHandler)
+
+
+class TileHandler(http.server.BaseHTTPRequestHandler):
+    def do_GET(self):
+        with self.server._lock:
+            self.server.requests += 1
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header("Content-Type", "image/png")
+        self.send_header("Content-Length", str(len(self.server.tile)))
+        self.send_header("Cache-Control", "max-age=3600")
+        self.end_headers()
+        self.wfile.write(self.server.tile)
+
+    def log_message(self, *args):
+        pass
+
+
+def trajectory(messages, hz, speed_px, zoom_rate):
+    #host pans east with speed_px screen pixels per message and zooms by zoom_rate per message
+    cx, cy, zoom = 1800000.0, 6100000.0, 50000.0
+    for _ in range(messages):
+        mupp = zoom * 0.00028
+        cx += speed_px * mupp
+        zoom *= zoom_rate
+        yield 1.0 / hz, {"cx": cx, "cy": cy, "zoom": zoom, "settled": False}
+
+
+def run(args, max_jobs):
+    from qgis.core import QgsCoordinateReferenceSystem, QgsNetworkAccessManager, QgsPointXY, QgsRasterLayer, QgsRectangle
+    from qgis.gui import QgsMapCanvas
+    from qgis.PyQt.QtCore import QEventLoop, QTimer
+    from qgis.PyQt.QtWidgets import QApplication
+
+    sys.path.insert(0, os.path.dirname(PLUGIN_DIR))
+    prefetch = __import__(os.path.basename(PLUGIN_DIR) + ".prefetch", fromlist=["WmsPrefetcher"])
+
+    server = TileServer(args.latency_ms / 1000.0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    cache = QgsNetworkAccessManager.instance().cache()
+    if cache is not None:
+        cache.clear()
+
+    url = "type=xyz&zmin=0&zmax=19&url=http://127.0.0.1:%d/%%7Bz%%7D/%%7Bx%%7D/%%7By%%7D.png" % server.server_address[1]
+    lyr = QgsRasterLayer(url, "stand-in", "wms")
+    canvas = QgsMapCanvas()
+    canvas.resize(args.width, args.height)
+    canvas.setDestinationCrs(QgsCoordinateReferenceSystem("EPSG:3857"))
+    canvas.setLayers([lyr])
+    canvas.setCenter(QgsPointXY(1800000.0, 6100000.0))
+    canvas.zoomScale(50000.0)
+
+    def wait_drawn(timeout=30.0):
+        loop = QEventLoop()
+        canvas.mapCanvasRefreshed.connect(loop.quit)
+        QTimer.singleShot(int(timeout * 1000), loop.quit)
+        loop.exec_()
+        canvas.mapCanvasRefreshed.disconnect(loop.quit)
+
+    canvas.refresh()
+    wait_drawn()
+
+    prefetcher = prefetch.WmsPrefetcher(canvas, max_jobs=max_jobs, steps=args.steps, horizon_ms=args.horizon_ms)
+    prefetcher.start()
+    server.requests = 0
+
+    draw_ms = []
+    for period, data in trajectory(args.messages, args.hz, args.speed_px, args.zoom_rate):
+        t_msg = time.perf_counter()
+        mupp = canvas.mapUnitsPerPixel() * data["zoom"] / canvas.scale()
+        half_w, half_h = canvas.width() * mupp / 2.0, canvas.height() * mupp / 2.0
+        canvas.stopRendering()
+        canvas.setExtent(QgsRectangle(data["cx"] - half_w, data["cy"] - half_h, data["cx"] + half_w, data["cy"] + half_h))
+        canvas.refresh()
+        prefetcher.extent_received(data)
+        wait_drawn()
+        draw_ms.append(1000 * (time.perf_counter() - t_msg))
+
+        #the host sends the next extent one period after this one
+        rest = period - (time.perf_counter() - t_msg)
+        deadline = time.perf_counter() + max(0.0, rest)
+        while time.perf_counter() < deadline:
+            QApplication.processEvents(QEventLoop.AllEvents, 10)
+
+    prefetcher.stop()
+    server.shutdown()
+    draw_ms.sort()
+    return {"max_jobs": max_jobs,
+            "draw_p50_ms": statistics.median(draw_ms),
+            "draw_p95_ms": draw_ms[int(0.95 * (len(draw_ms) - 1))],
+            "draw_max_ms": draw_ms[-1],
+            "tile_requests": server.requests}
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=150)
+    parser.add_argument("--messages", type=int, default=40)
+    parser.add_argument("--hz", type=float, default=10, help="extent messages per second (EXTENT_MAX_HZ)")
+    parser.add_argument("--speed-px", type=float, default=60, help="host pan per message in screen pixels")
+    parser.add_argument("--zoom-rate", type=float, default=1.0, help="scale factor per message")
+    parser.add_argument("--max-jobs", type=int, default=2)
+    parser.add_argument("--steps", type=int, default=2)
+    parser.add_argument("--horizon-ms", type=float, default=1000)
+    parser.add_argument("--width", type=int, default=1000)
+    parser.add_argument("--height", type=int, default=700)
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qgis.testing import start_app
+    start_app()
+
+    results = [run(args, 0), run(args, args.max_jobs)]
+    if args.json:
+        print(json.dumps({"latency_ms": args.latency_ms, "messages": args.messages, "results": results}, indent=2))
+        return
+
+    print("stand-in tile server latency %.0f ms, %d extent messages at %.0f Hz" % (args.latency_ms, args.messages, args.hz))
+    print("%-12s %10s %10s %10s %14s" % ("prefetch", "p50 ms", "p95 ms", "max ms", "tile requests"))
+    for res in results:
+        label = "off" if res["max_jobs"] == 0 else "%d jobs" % res["max_jobs"]
+        print("%-12s %10.1f %10.1f %10.1f %14d" % (label, res["draw_p50_ms"], res["draw_p95_ms"], res["draw_max_ms"], res["tile_requests"]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Measure what the plugin costs at QGIS start.
+
+QGIS imports the plugin package, calls classFactory() and initGui() for
+every user on every start. This script measures these steps (and
+optionally the first run()) in fresh interpreters with a headless QGIS
+application and a mocked iface. It needs the python environment of a QGIS
+installation.
+
+Usage:
+    python benchmarks/bench_startup.py [--repeat 5] [--with-run] [--plugin-dir DIR]
+
+To compare with an older version check it out next to the current one,
+e.g. git worktree add /tmp/qollabeo_old <commit>, and pass
+--plugin-dir /tmp/qollabeo_old.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+_CHILD = r"""
+import importlib, json, os, sys, time
+plugin_dir, with_run = sys.argv[1], sys.argv[2] == "1"
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+from qgis.testing import start_app
+app = start_app()
+from qgis.testing.mocked import get_iface
+iface = get_iface()
+
+sys.path.insert(0, os.path.dirname(plugin_dir))
+res = {}
+t0 = time.perf_counter()
+pkg = importlib.import_module(os.path.basename(plugin_dir))
+plugin = pkg.classFactory(iface)
+t1 = time.perf_counter()
+plugin.initGui()
+t2 = time.perf_counter()
+res["import_and_construct_ms"] = 1000 * (t1 - t0)
+res["init_gui_ms"] = 1000 * (t2 - t1)
+res["startup_ms"] = 1000 * (t2 - t0)
+if with_run:
+    plugin.run()
+    res["first_run_ms"] = 1000 * (time.perf_counter() - t2)
+print("RESULT " + json.dumps(res))
+os._exit(0)
+"""
+
+
+def measure(plugin_dir, with_run):
+    out = subprocess.run([sys.executable, "-c", _CHILD, plugin_dir, "1" if with_run else "0"],
+                         capture_output=True, text=True, check=True).stdout
+    for line in out.splitlines():
+        if line.startswith("RESULT "):
+            return json.loads(line[7:])
+    raise RuntimeError("No result from child process:\n%s" % out)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--plugin-dir", default=os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--with-run", action="store_true", help="also measure the first run() of the plugin")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    runs = [measure(os.path.abspath(args.plugin_dir), args.with_run) for _ in range(args.repeat)]
+    summary = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+
+    if args.json:
+        print(json.dumps({"plugin_dir": args.plugin_dir, "median": summary, "runs": runs}, indent=2))
+        return
+
+    print("plugin: %s (median of %d fresh starts)" % (args.plugin_dir, args.repeat))
+    for key, value in summary.items():
+        print("    %-24s %9.1f ms" % (key, value))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+# -*- coding: utf-8 -*-
+"""Load a room with one host and many participants and report the fan-out.
+
+One host and --users participants connect as headless python-socketio
+AsyncClients and speak the protocol of qollabeo.py: the host schedules and
+starts a session and answers every room_entered with the user list, the
+user_joined change and the codec (like add_user), the participants join.
+Then, at the same time, the host pans (set_extent at --pan-hz), adds vector
+layers (lyrs_changed and a windowed lyr_chunk stream acknowledged by every
+participant) and random members draw bursts of notes (feat_batch). Every
+message carries its send time; the time until a participant receives it is
+the fan-out latency.
+
+Reported are latency percentiles per message type, message rates, bytes
+received per client, events never received (dropped), events received
+after --late-ms (late) and holes in the journal sequence numbers. Without
+--url the reference server of server/ runs in-process on a free port; it
+then shares the event loop with all clients, hence, for numbers of a
+server run it separately (python -m server) and pass --url.
+Needs python-socketio and aiohttp.
+
+Usage:
+    python benchmarks/load_room.py [--users 50] [--url http://host:port --path /qollab] [--json]
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import time
+
+PLUGIN_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PLUGIN_DIR)
+
+import socketio
+
+from core.geom_codec import RECT, get_codec
+from core.group_state import GroupState
+from core.journal import JournalCursor
+from core.messages import user_joined_msg, user_list_msg
+from core.roster import Roster
+from core.stream import StreamReceiver, StreamSender, unpack_rows
+
+KINDS = ("extent", "lyrs", "chunk", "feat")
+
+
+class CountingClient(socketio.AsyncClient):
+    """AsyncClient counting the received socket.io packets and binary attachments."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.bytes_in = 0
+
+    async def _handle_eio_message(self, data):
+        self.bytes_in += len(data)
+        await super()._handle_eio_message(data)
+
+
+def percentiles(values):
+    if not values:
+        return {"n": 0}
+    values = sorted(values)
+    rank = lambda q: values[min(len(values) - 1, int(q * len(values)))]
+    return {"n": len(values), "p50": rank(0.50), "p95": rank(0.95), "p99": rank(0.99), "max": values[-1]}
+
+
+def synthetic_rows(count, seed):
+    rnd = random.Random(seed)
+    codec = get_codec("wkb")
+    rows = []
+    for i in range(count):
+        x, y = rnd.uniform(0, 1e5), rnd.uniform(0, 1e5)
+        ring = [(x, y), (x + 50, y), (x + 50, y + 30), (x, y + 30), (x, y)]
+        rows.append(([i, "feature %d" % i, rnd.random()], codec.encode("Polygon", [ring])))
+    return rows
+
+
+class Participant:
+
+    def __init__(self, name):
+        self.name = name
+        self.sio = CountingClient(reconnection=False)
+        self.joined = asyncio.Event()
+        self.cursor = JournalCursor()
+        self.first_seq = None
+        self.seqs = set()
+        self.latency = {kind: [] for kind in KINDS}
+        self.received = {kind: 0 for kind in KINDS}
+        self.chunks = {}
+        self.msgs_in = 0
+        self.sid = None
+
+    def journaled(self, data):
+        self.msgs_in += 1
+        seq = data.get("seq")
+        if seq is not None:
+            self.cursor.seen(seq)
+            self.seqs.add(seq)
+
+    def timed(self, kind, sent_at):
+        self.received[kind] += 1
+        self.latency[kind].append(1000.0 * (time.perf_counter() - sent_at))
+
+    async def connect(self, url, path, rid, pwd):
+        sio = self.sio
+
+        @sio.on("session_joined", namespace="/join")
+        async def joined(data):
+            self.sid = data["sid"]
+            self.first_seq = data.get("head", 0)
+            self.cursor.reset(self.first_seq)
+            self.joined.set()
+
+        @sio.on("*", namespace="/join")
+        async def other(event, data=None):
+            if isinstance(data, dict):
+                self.journaled(data)
+
+        @sio.on("extent_changed", namespace="/join")
+        async def extent(data):
+            self.journaled(data)
+            self.timed("extent", data["t"])
+
+        @sio.on("lyrs_changed", namespace="/join")
+        async def lyrs(data):
+            self.journaled(data)
+            self.timed("lyrs", data["t"])
+            for info in data.get("added", []):
+                if info.get("kind") == "vector":
+                    self.chunks[info["key"]] = receiver = StreamReceiver()
+                    await sio.emit("lyr_resume", {"key": info["key"], "after": receiver.resume(), "sid": self.sid},
+                                   namespace="/join")
+
+        @sio.on("lyr_chunk", namespace="/join")
+        async def chunk(data):
+            self.msgs_in += 1
+            if data.get("to") not in (None, self.sid) or data["key"] not in self.chunks:
+                return
+            receiver = self.chunks[data["key"]]
+            state = receiver.accept(data["k"], data["last"], broadcast=data.get("to") is None)
+            if state == "gap":
+                await sio.emit("lyr_resume", {"key": data["key"], "after": receiver.resume(), "sid": self.sid},
+                               namespace="/join")
+            if state != "ok":
+                return
+            unpack_rows(data["data"])
+            self.timed("chunk", data["t"])
+            await sio.emit("lyr_ack", {"key": data["key"], "k": data["k"], "sid": self.sid}, namespace="/join")
+
+        @sio.on("feat_batch", namespace="/join")
+        async def feats(data):
+            self.journaled(data)
+            for feat in data["feats"]:
+                self.timed("feat", feat["t"])
+
+        await sio.connect(url, socketio_path=path, namespaces=["/join"], auth={"rid": rid, "pwd": pwd})
+        await sio.emit("join_session", {"user": self.name, "rid": rid, "pwd": pwd, "codecs": ["wkt", "wkb"]}, namespace="/join")
+
+    def summary(self):
+        last = max(self.seqs) if self.seqs else self.first_seq or 0
+        return {"bytes_in": self.sio.bytes_in,
+                "msgs_in": self.msgs_in,
+                "journal_missing": max(0, last - (self.first_seq or 0) - len(self.seqs))}
+
+
+class Host:
+
+    def __init__(self, args):
+        self.args = args
+        self.sio = CountingClient(reconnection=False)
+        self.roster = Roster(0)
+        self.grp_state = GroupState()
+        self.streams = {}
+        self.chunks_sent = 0
+        self.msgs_out = 0
+        self.pump_pending = False
+        self.started = asyncio.Event()
+
+    async def emit(self, event, data):
+        self.msgs_out += 1
+        await self.sio.emit(event, data, namespace="/start")
+
+    async def start(self, url, path):
+        sio = self.sio
+        created = asyncio.get_running_loop().create_future()
+        sio.on("session_created", lambda data: created.set_result(data), namespace="/schedule")
+        sio.on("session_started", lambda data: self.started.set(), namespace="/start")
+
+        @sio.on("room_entered", namespace="/start")
+        async def entered(data):
+            #as add_user of the plugin: user list and codec to the new user, the change to everyone
+            self.roster.add(data["sid"], data["user"])
+            ver = self.roster.next_ver()
+            await self.emit("user_list", user_list_msg(self.rid, self.roster.users, ver=ver, to=data["sid"]))
+            await self.emit("user_joined", user_joined_msg(ver, data["sid"], data["user"]))
+            await self.emit("set_codec", {"codec": "wkb", "res": None, "to": data["sid"]})
+
+        @sio.on("lyr_resume", namespace="/start")
+        async def resume(data):
+            stream = self.streams.get(data["key"])
+            if stream is not None:
+                stream.add_receiver(data["sid"], int(data["after"]), stalled=bool(data.get("stalled")))
+                self.schedule_pump()
+
+        @sio.on("lyr_ack", namespace="/start")
+        async def ack(data):
+            stream = self.streams.get(data["key"])
+            if stream is not None:
+                stream.ack(data["sid"], int(data["k"]))
+                self.schedule_pump()
+
+        await sio.connect(url, socketio_path=path, namespaces=["/schedule", "/start"])
+        now = time.strftime("%Y-%m-%d %H:%M:%S")
+        await sio.emit("schedule_session", {"mail": "load@test", "from": now, "to": now, "title": "load test"}, namespace="/schedule")
+        session = await asyncio.wait_for(created, 10)
+        self.rid, self.pwd = session["rid"], session["pwd"]
+        await sio.emit("start_session", {"mail": "load@test", "title": "load test", "user": "host", "rid": self.rid,
+                                         "pwd": self.pwd, "codecs": ["wkt", "wkb"]}, namespace="/start")
+        await asyncio.wait_for(self.started.wait(), 10)
+
+    def schedule_pump(self):
+        if not self.pump_pending:
+            self.pump_pending = True
+            asyncio.ensure_future(self.pump())
+
+    async def pump(self):
+        #one chunk per stream and loop pass, like pump_lyr_streams of the plugin
+        busy = True
+        while busy:
+            self.pump_pending = False
+            busy = False
+            for key, stream in list(self.streams.items()):
+                for k, rid in stream.next_sends(limit=1):
+                    payload, last = stream.chunk(k)
+                    msg = {"key": key, "k": k, "data": payload, "last": last, "t": time.perf_counter()}
+                    if rid is not None:
+                        msg["to"] = rid
+                    await self.emit("lyr_chunk", msg)
+                    self.chunks_sent += 1
+                    busy = True
+            await asyncio.sleep(0)
+
+    async def pan(self):
+        period = 1.0 / self.args.pan_hz
+        cx, cy, zoom = 0.0, 0.0, 50000.0
+        for i in range(self.args.pans):
+            cx += 40.0
+            await self.emit("set_extent", {"zoom": zoom, "cx": cx, "cy": cy, "settled": i == self.args.pans - 1,
+                                           "t": time.perf_counter()})
+            await asyncio.sleep(period)
+
+    async def add_layers(self):
+        for key in range(1, self.args.layers + 1):
+            rows = synthetic_rows(self.args.layer_rows, key)
+            self.streams[key] = StreamSender(lambda start, count, rows=rows: rows[start:start + count], len(rows),
+                                             max_bytes=self.args.chunk_kb * 1024, window=self.args.window)
+            order = list(self.grp_state.order) + [key]
+            diff = self.grp_state.update(order, [True] * len(order))
+            diff["added"] = [{"key": key, "name": "layer %d" % key, "kind": "vector", "geom": "Polygon", "crs": "EPSG:3857",
+                              "fields": [["id", "int"], ["name", "str"], ["value", "float"]], "total": len(rows)}]
+            diff["t"] = time.perf_counter()
+            await self.emit("lyrs_changed", diff)
+            await asyncio.sleep(self.args.layer_gap)
+
+    def expected_chunks(self):
+        return sum(stream.last + 1 for stream in self.streams.values() if stream.last is not None)
+
+
+async def draw(members, args):
+    #bursts of rectangles drawn by random members of the room; one feat_batch per member and burst
+    codec = get_codec("wkb")
+    rnd = random.Random(0)
+    sent = 0
+    for burst in range(args.bursts):
+        for n, (sio, nspace, name) in enumerate(rnd.sample(members, min(args.burst_clients, len(members)))):
+            feats = []
+            for i in range(args.burst_size):
+                x, y = rnd.uniform(0, 1e5), rnd.uniform(0, 1e5)
+                feats.append({"uid": "%s-%d-%d" % (name, burst, i), "user": name, "t": time.perf_counter(),
+                              "geom": codec.encode(RECT, [[(x, y), (x + 100, y + 100)]])})
+            await sio.emit("feat_batch", {"feats": feats, "codec": "wkb", "res": None}, namespace=nspace)
+            sent += len(feats)
+        await asyncio.sleep(args.burst_gap)
+    return sent
+
+
+async def local_server(args):
+    from aiohttp import web
+    from server.app import create_server
+
+    sio = create_server(async_mode="aiohttp", host_grace=1.0)
+    app = web.Application()
+    sio.attach(app, socketio_path=args.path.strip("/"))
+    runner = web.AppRunner(app)
+    await runner.setup()
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        port = sock.getsockname()[1]
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner, "http://127.0.0.1:%d" % port
+
+
+async def run(args):
+    runner = None
+    url = args.url
+    if url is None:
+        runner, url = await local_server(args)
+
+    host = Host(args)
+    await host.start(url, args.path)
+    users = [Participant("user%d" % i) for i in range(args.users)]
+    t_join = time.perf_counter()
+    #joins are spread over --join-concurrency connections at a time
+    sem = asyncio.Semaphore(args.join_concurrency)
+
+    async def join(user):
+        async with sem:
+            await user.connect(url, args.path, host.rid, host.pwd)
+            await asyncio.wait_for(user.joined.wait(), 30)
+    await asyncio.gather(*(join(user) for user in users))
+    join_s = time.perf_counter() - t_join
+    await asyncio.sleep(args.settle)
+
+    members = [(host.sio, "/start", "host")] + [(user.sio, "/join", user.name) for user in users]
+    t_start = time.perf_counter()
+    _, _, feats_sent = await asyncio.gather(host.pan(), host.add_layers(), draw(members, args))
+    expected = {"extent": args.pans, "lyrs": args.layers, "feat": feats_sent}
+
+    #wait until every participant got everything or the drain timeout passed
+    deadline = time.perf_counter() + args.drain
+    while time.perf_counter() < deadline:
+        expected["chunk"] = host.expected_chunks()
+        if all(user.received[kind] >= expected[kind] for user in users for kind in KINDS) and \
+                all(stream.complete() for stream in host.streams.values()):
+            break
+        await asyncio.sleep(0.05)
+    duration = time.perf_counter() - t_start
+    expected["chunk"] = host.expected_chunks()
+
+    summaries = [user.summary() for user in users]
+    latency = {kind: percentiles([ms for user in users for ms in user.latency[kind]]) for kind in KINDS}
+    latency["all"] = percentiles([ms for user in users for kind in KINDS for ms in user.latency[kind]])
+    bytes_in = sorted(summary["bytes_in"] for summary in summaries)
+    msgs_in = sum(summary["msgs_in"] for summary in summaries)
+    events = {}
+    for kind in KINDS:
+        received = sum(user.received[kind] for user in users)
+        late = sum(1 for user in users for ms in user.latency[kind] if ms > args.late_ms)
+        events[kind] = {"expected": expected[kind] * len(users), "received": received,
+                        "dropped": max(0, expected[kind] * len(users) - received), "late": late}
+
+    report = {"server": args.url or "in-process reference server",
+              "users": args.users,
+              "join_s": join_s,
+              "duration_s": duration,
+              "latency_ms": latency,
+              "rates": {"host_msgs_out_per_s": host.msgs_out / duration,
+                        "msgs_in_per_s": msgs_in / duration,
+                        "msgs_in_per_client_per_s": msgs_in / duration / max(1, len(users))},
+              "bytes_per_client": {"min": bytes_in[0] if bytes_in else 0,
+                                   "mean": sum(bytes_in) / max(1, len(bytes_in)),
+                                   "max": bytes_in[-1] if bytes_in else 0,
+                                   "host_in": host.sio.bytes_in},
+              "events": events,
+              "journal_missing": sum(summary["journal_missing"] for summary in summaries),
+              "late_ms": args.late_ms}
+
+    for sio in [host.sio] + [user.sio for user in users]:
+        await sio.disconnect()
+    if runner is not None:
+        await runner.cleanup()
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--url", default=None, help="server to load; default: in-process reference server")
+    parser.add_argument("--path", default="/qollab", help="socket.io path (SIO_PATH)")
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--join-concurrency", type=int, default=20)
+    parser.add_argument("--pans", type=int, default=100)
+    parser.add_argument("--pan-hz", type=float, default=10, help="extent messages per second (EXTENT_MAX_HZ)")
+    parser.add_argument("--layers", type=int, default=2)
+    parser.add_argument("--layer-rows", type=int, default=5000)
+    parser.add_argument("--layer-gap", type=float, default=2.0, help="seconds between two layer adds")
+    parser.add_argument("--chunk-kb", type=int, default=256, help="STREAM_CHUNK_KB")
+    parser.add_argument("--window", type=int, default=4, help="STREAM_WINDOW")
+    parser.add_argument("--bursts", type=int, default=10)
+    parser.add_argument("--burst-clients", type=int, default=5, help="members drawing in the same burst")
+    parser.add_argument("--burst-size", type=int, default=10, help="notes per member and burst")
+    parser.add_argument("--burst-gap", type=float, default=1.0)
+    parser.add_argument("--settle", type=float, default=1.0, help="seconds between the joins and the load")
+    parser.add_argument("--drain", type=float, default=30.0, help="seconds to wait for outstanding events")
+    parser.add_argument("--late-ms", type=float, default=1000.0)
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    report = asyncio.run(run(args))
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return
+
+    print("%d users, joined in %.1f s, load ran %.1f s against %s" % (report["users"], report["join_s"], report["duration_s"], report["server"]))
+    print("%-8s %8s %10s %10s %10s %10s %9s %6s" % ("type", "n", "p50 ms", "p95 ms", "p99 ms", "max ms", "dropped", "late"))
+    for kind in KINDS + ("all",):
+        res = report["latency_ms"][kind]
+        if res["n"] == 0:
+            continue
+        ev = report["events"].get(kind, {"dropped": sum(e["dropped"] for e in report["events"].values()),
+                                         "late": sum(e["late"] for e in report["events"].values())})
+        print("%-8s %8d %10.1f %10.1f %10.1f %10.1f %9d %6d" % (kind, res["n"], res["p50"], res["p95"], res["p99"], res["max"],
+                                                             ev["dropped"], ev["late"]))
+    print("messages in: %.0f/s (%.1f/s per client), host out: %.0f/s" % (report["rates"]["msgs_in_per_s"],
+          report["rates"]["msgs_in_per_client_per_s"], report["rates"]["host_msgs_out_per_s"]))
+    print("bytes per client: min %d, mean %.0f, max %d; journal holes: %d" % (report["bytes_per_client"]["min"],
+          report["bytes_per_client"]["mean"], report["bytes_per_client"]["max"], report["journal_missing"]))
+
+
+if __name__ == "__main__":
+    main()
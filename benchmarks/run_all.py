@@ -0,0 +1,345 @@
+# -*- coding: utf-8 -*-
+"""Hot path benchmarks of the pure sync core; plain CPython, no QGIS needed.
+
+Every case runs a fixed workload of the core package (message building and
+parsing, extent throttling, outbox, notes state and changes, journal, layer
+diffing, user roster, layer chunks, geometry codecs and sketch strokes) and
+reports the best of --repeat runs as operations per second. With --baseline the
+results are compared to an earlier --json output and the exit code is 1 if a
+case got slower by more than --tolerance, e.g. for a regression check in CI:
+
+    python benchmarks/run_all.py --json > baseline.json
+    python benchmarks/run_all.py --baseline baseline.json --tolerance 0.3
+
+Usage: python benchmarks/run_all.py [--repeat 5] [--scale 1.0] [--only name,...] [--json]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.extent import ExtentThrottle, LatestExtentSlot
+from core.geom_codec import RECT, available_codecs, get_codec, resolution_for_crs
+from core.group_state import GroupState
+from core.journal import COMPACT_KEYS, EventJournal, JournalCursor
+from core.layer_registry import LayerRegistry
+from core.messages import (batch_feats, changed_note, extent_msg, extent_rect, feat_batch_msg, feat_delete_msg,
+                           feat_update_msg, user_joined_msg, user_left_msg, user_list_msg)
+from core.metrics import SyncMetrics
+from core.notes_state import NotesReplica, NotesRoomState
+from core.outbox import Outbox
+from core.roster import Roster
+from core.sketch import StrokeSender, StrokeView
+from core.stream import pack_rows, unpack_rows
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def bench_extent_messages(n):
+    #host side canvas events through the throttle, follower side slot and extent math
+    clock = FakeClock()
+    sent = []
+    throttle = ExtentThrottle(sent.append, clock=clock)
+    slot = LatestExtentSlot()
+    for i in range(n):
+        clock.now += 0.004
+        throttle.offer(500000.0 + i, 5300000.0, 25000.0 * (1 + (i % 50) / 100.0), 7.0)
+        throttle.poll()
+        msg = extent_msg(500000.0 + i, 5300000.0, 25000.0, False)
+        if slot.put(msg):
+            extent_rect(slot.take(), 25000.0, 7.0, 1200, 800)
+    return n
+
+
+def bench_outbox(n):
+    outbox = Outbox(maxlen=500)
+    for i in range(n):
+        if i % 4 == 0:
+            outbox.put(("emit", "set_extent", {"cx": i}, "/start"), coalesce=("/start", "extent"))
+        else:
+            outbox.put(("emit", "feat_batch", {"feats": []}, "/start"))
+        if i % 2:
+            outbox.get(timeout=0)
+    while outbox.get(timeout=0) is not None:
+        pass
+    return n
+
+
+def make_feats(n, codec, res, seed=1):
+    rnd = random.Random(seed)
+    feats = []
+    for i in range(n):
+        x, y = rnd.uniform(4e5, 6e5), rnd.uniform(5.2e6, 5.4e6)
+        feats.append({"uid": "u%d" % i, "user": "user%d" % (i % 20),
+                      "geom": codec.encode(RECT, [[(x, y), (x + 100.0, y + 80.0)]], res)})
+    return feats
+
+
+def bench_notes(n):
+    #batches of 50 notes: stamped by the room, applied by a replica, then a late joiner snapshot
+    codec = get_codec(available_codecs()[0])
+    res = resolution_for_crs(False)
+    feats = make_feats(n, codec, res)
+    room = NotesRoomState(page_size=5000)
+    replica = NotesReplica()
+    for start in range(0, n, 50):
+        msg = feat_batch_msg(feats[start:start + 50], codec.name, res)
+        stamped = room.add([dict(feat, codec=codec.name, res=res) for feat in msg["feats"]])
+        replica.accept(batch_feats(feat_batch_msg(stamped, codec.name, res)))
+    late = NotesReplica()
+    after = -1
+    while True:
+        state = room.sync(after)
+        late.accept_state(state)
+        if state["seq"] >= state["head"]:
+            break
+        after = state["seq"]
+    return n
+
+
+def bench_notes_changes(n):
+    #n updates and deletes of 2000 notes by two users: merged by the room, applied by a replica, tombstones compacted
+    codec = get_codec(available_codecs()[0])
+    res = resolution_for_crs(False)
+    feats = make_feats(2000, codec, res)
+    room = NotesRoomState(page_size=5000)
+    replica = NotesReplica()
+    replica.accept(room.add([dict(feat, codec=codec.name, res=res) for feat in feats]))
+    rnd = random.Random(9)
+    clocks = {"a": 0, "b": 0}
+    for i in range(n):
+        sid = "ab"[i % 2]
+        clocks[sid] += 1
+        feat = feats[rnd.randrange(len(feats))]
+        if i % 10 == 0:
+            msg = feat_delete_msg(feat["uid"], clocks[sid])
+        else:
+            msg = feat_update_msg(feat["uid"], feat["geom"], codec.name, res, clocks[sid])
+        note = room.change(dict(msg, sid=sid, deleted="geom" not in msg))
+        if note is not None:
+            replica.accept([changed_note({"note": note})])
+        if i % 500 == 0:
+            room.compact(replica.take_ack() or replica.acked)
+    return n
+
+
+def bench_journal(n):
+    events = ("extent_changed", "feat_batch", "lyrs_changed", "user_list")
+    journal = EventJournal(capacity=1000)
+    cursor = JournalCursor()
+    cursor.reset(0)
+    for i in range(n):
+        event = events[i % len(events)]
+        seq = journal.append(event, {"i": i}, key=COMPACT_KEYS.get(event))
+        cursor.seen(seq)
+        if i % 200 == 0:
+            journal.resume(max(0, seq - 150))
+    journal.resume(0)
+    return n
+
+
+def bench_layer_diff(n):
+    #n batches on a group of 200 layers: moves, visibility toggles, adds and removes as the tree signals report them
+    rnd = random.Random(3)
+    host, replica = GroupState(), GroupState()
+    registry = LayerRegistry()
+    order = list(range(200))
+    for lid in order:
+        registry.add("lid%d" % lid, {"name": "layer %d" % lid})
+    registry.take_diff()
+    host.reset(0, order, [True] * len(order))
+    replica.apply(host.snapshot())
+    next_key = 200
+    for _ in range(n):
+        op = rnd.random()
+        order = host.order
+        if op < 0.5:
+            key = rnd.choice(order)
+            host.insert(key, rnd.choice([None] + order))
+        elif op < 0.7:
+            registry.add("lid%d" % next_key, {"name": "layer %d" % next_key})
+            host.insert(next_key, rnd.choice([None] + order))
+            next_key += 1
+        elif op < 0.8 and len(order) > 10:
+            key = rnd.choice(order)
+            registry.remove("lid%d" % key)
+            host.remove(key)
+        registry.take_diff()
+        for key in rnd.sample(host.order, 5):
+            host.set_visible(key, rnd.random() > 0.1)
+        diff = host.commit()
+        if diff is not None and (replica.apply(diff) is None or replica.order != host.order):
+            raise RuntimeError("replica out of sync")
+    return n
+
+
+def bench_roster(n):
+    #users entering and leaving a meeting of 200 users; the host sends versioned changes applied by a replica
+    roster, replica = Roster(0), Roster()
+    for i in range(200):
+        roster.add("sid%d" % i, "user %d" % i)
+        roster.next_ver()
+    msg = user_list_msg("rid", roster.users, ver=roster.ver)
+    replica.reset(msg["ver"])
+    for sid, name in msg["users"].items():
+        replica.add(sid, name)
+    for i in range(n):
+        sid = "sid%d" % (200 + i)
+        roster.add(sid, "user %d" % (200 + i))
+        joined = user_joined_msg(roster.next_ver(), sid, roster.names[sid])
+        roster.remove("sid%d" % i)
+        left = user_left_msg(roster.next_ver(), "sid%d" % i)
+        for msg in (joined, left):
+            if replica.follows(msg["ver"]) != "ok":
+                raise RuntimeError("replica out of sync")
+            if "user" in msg:
+                replica.add(msg["sid"], msg["user"])
+            else:
+                replica.remove(msg["sid"])
+            replica.ver = msg["ver"]
+    if replica.users != roster.users:
+        raise RuntimeError("replica out of sync")
+    return n
+
+
+def bench_layer_chunks(n):
+    codec = get_codec("wkb")
+    rows = []
+    for i in range(n):
+        ring = [(i, 0.0), (i + 1.0, 0.0), (i + 1.0, 1.0), (i, 1.0), (i, 0.0)]
+        rows.append(([i, "feature %d" % i, i * 0.5], codec.encode("Polygon", [ring])))
+    start = 0
+    while start < n:
+        payload, used = pack_rows(rows[start:start + 2000], 256 * 1024)
+        unpack_rows(payload)
+        start += used
+    return n
+
+
+def bench_geom_codecs(n):
+    res = resolution_for_crs(False)
+    rnd = random.Random(5)
+    rects = [[(x, y), (x + 250.0, y + 120.0)] for x, y in ((rnd.uniform(4e5, 6e5), rnd.uniform(5.2e6, 5.4e6)) for _ in range(n))]
+    count = 0
+    for name in available_codecs():
+        codec = get_codec(name)
+        for rect in rects:
+            codec.decode(codec.encode(RECT, [rect], res), res)
+            count += 1
+    return count
+
+
+def bench_sketch(n):
+    #a freehand stroke of n input points at 250 Hz: simplified, rate limited and applied by a viewer
+    clock = FakeClock()
+    view = StrokeView()
+    def send(event, msg):
+        if event == "stroke_begin":
+            view.begin(msg)
+        elif event == "stroke_append":
+            view.append(msg)
+    sender = StrokeSender(send, max_hz=10.0, digits=2, clock=clock)
+    sender.begin("uid", "user", "LineString", 0.0, 0.0)
+    rnd = random.Random(7)
+    x = y = 0.0
+    for i in range(n):
+        clock.now += 0.004
+        x += 0.5 + rnd.uniform(-0.2, 0.2)
+        y += rnd.uniform(-0.5, 0.5)
+        sender.add(x, y, 0.1)
+    if sender.end(2) != view.strokes["uid"]["pts"]:
+        raise RuntimeError("viewer out of sync")
+    return n
+
+
+def bench_metrics(n):
+    metrics = SyncMetrics()
+    msg = metrics.stamp({"zoom": 25000.0, "cx": 1.0, "cy": 2.0, "settled": False})
+    for i in range(n):
+        metrics.received("extent_changed", msg)
+        metrics.sent(msg)
+    metrics.summary()
+    return n
+
+
+#name: (function, workload at --scale 1)
+CASES = {"extent_messages": (bench_extent_messages, 50000),
+         "outbox": (bench_outbox, 100000),
+         "notes": (bench_notes, 20000),
+         "notes_changes": (bench_notes_changes, 20000),
+         "journal": (bench_journal, 50000),
+         "layer_diff": (bench_layer_diff, 1000),
+         "roster": (bench_roster, 5000),
+         "layer_chunks": (bench_layer_chunks, 20000),
+         "geom_codecs": (bench_geom_codecs, 5000),
+         "sketch": (bench_sketch, 50000),
+         "metrics": (bench_metrics, 50000)}
+
+
+def run(name, repeat, scale):
+    func, workload = CASES[name]
+    workload = max(1, int(workload * scale))
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        ops = func(workload)
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return {"ops": ops, "best_s": best, "ops_per_s": ops / best}
+
+
+def compare(results, baseline, tolerance):
+    """Cases slower than the baseline by more than tolerance (relative) as [(name, ratio), ...]."""
+    slower = []
+    for name, res in results.items():
+        base = baseline.get(name)
+        if base is None:
+            continue
+        ratio = res["ops_per_s"] / base["ops_per_s"]
+        if ratio < 1.0 - tolerance:
+            slower.append((name, ratio))
+    return slower
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--scale", type=float, default=1.0, help="factor for the workload of every case")
+    parser.add_argument("--only", default=None, help="comma separated case names; default: all")
+    parser.add_argument("--baseline", default=None, help="--json output of an earlier run")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown against the baseline")
+    parser.add_argument("--json", action="store_true", help="print machine readable results")
+    args = parser.parse_args()
+
+    names = list(CASES) if args.only is None else args.only.split(",")
+    results = {name: run(name, args.repeat, args.scale) for name in names}
+
+    slower = []
+    if args.baseline is not None:
+        with open(args.baseline) as fobj:
+            slower = compare(results, json.load(fobj)["results"], args.tolerance)
+
+    if args.json:
+        print(json.dumps({"python": sys.version.split()[0], "scale": args.scale, "results": results,
+                          "regressions": [{"name": name, "ratio": ratio} for name, ratio in slower]}, indent=2))
+    else:
+        print("%-16s %10s %10s %14s" % ("case", "ops", "best s", "ops/s"))
+        for name, res in results.items():
+            print("%-16s %10d %10.4f %14.0f" % (name, res["ops"], res["best_s"], res["ops_per_s"]))
+        for name, ratio in slower:
+            print("REGRESSION %s: %.0f%% of the baseline throughput" % (name, 100 * ratio))
+    sys.exit(1 if slower else 0)
+
+
+if __name__ == "__main__":
+    main()
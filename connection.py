@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+
+import socketio
+from socketio import packet
+
+#ConnectionManager drives internals of python-socketio's Client (see below) which are not part
+#of its public API; they exist unchanged throughout 5.x, the plugin is tested with 5.17.0
+SOCKETIO_TESTED = "5.17.0"
+SOCKETIO_MAJOR = 5
+
+
+def socketio_version():
+    try:
+        from importlib.metadata import version
+        return version("python-socketio")
+    except Exception:
+        return getattr(socketio, "__version__", None)
+
+
+def check_socketio():
+    """Raise ImportError if the installed python-socketio lacks the internals used here."""
+    version = socketio_version()
+    client = socketio.Client
+    missing = [name for name in ("_send_packet", "connect", "disconnect") if not callable(getattr(client, name, None))]
+    try:
+        sio = client()
+        missing += [name for name, kind in (("namespaces", dict), ("connection_namespaces", list)) if not isinstance(getattr(sio, name, None), kind)]
+        if not hasattr(sio, "connection_auth"):
+            missing.append("connection_auth")
+    except Exception as err:
+        missing.append("Client() (%s)" % err)
+    if not hasattr(packet, "Packet") or not hasattr(packet, "CONNECT") or not hasattr(packet, "DISCONNECT"):
+        missing.append("packet.Packet")
+    major = version.split(".")[0] if version else None
+    if missing or major != str(SOCKETIO_MAJOR):
+        raise ImportError("QollabEO needs python-socketio %d.x (tested with %s), found %s%s. Please install it with: "
+                          "pip install \"python-socketio[client]==%s\"" % (SOCKETIO_MAJOR, SOCKETIO_TESTED, version or "an unknown version",
+                          "; missing: " + ", ".join(missing) if missing else "", SOCKETIO_TESTED))
+
+
+check_socketio()
+
+
+class ConnectionManager:
+    """Single long-lived Socket.IO connection shared by all QollabEO actions.
+
+    Socket.IO multiplexes namespaces over one Engine.IO transport. The
+    connection is opened once with the anchor namespace (/schedule) which
+    stays attached, /start and /join are attached and detached on demand by
+    sending the namespace CONNECT/DISCONNECT packets. Starting or joining a
+    session therefore only costs a namespace round trip instead of a new
+    TCP/TLS/Engine.IO handshake.
+
+    python-socketio's Client only connects namespaces within connect(); the
+    namespace packets are sent through its internal _send_packet and the
+    client's namespaces, connection_namespaces and connection_auth are
+    updated directly. check_socketio() verifies these internals when this
+    module is imported, so an incompatible python-socketio fails loudly
+    instead of silently never attaching a namespace.
+    """
+
+    def __init__(self, sio, anchor="/schedule"):
+        self.sio = sio
+        self.anchor = anchor
+        self.target = None      #(url, sio_path) of the current connection
+        self._lock = threading.RLock()
+
+    def is_connected(self, url=None, sio_path=None):
+        if not self.sio.connected:
+            return False
+        return url is None or self.target == (url, sio_path)
+
+    def connect(self, url, sio_path, headers=None):
+        """Connect the transport (if not yet connected to url); raises on failure."""
+        with self._lock:
+            if self.is_connected(url, sio_path):
+                return
+            if self.sio.connected:
+                self.close()
+
+            self.sio.connect(url, socketio_path=sio_path, wait=True, headers=headers or {}, namespaces=[self.anchor])
+            self.target = (url, sio_path)
+
+    def attach(self, nspace, url, sio_path, auth=None, headers=None, timeout=10):
+        """Attach a namespace to the shared connection; returns False on timeout."""
+        with self._lock:
+            self.connect(url, sio_path, headers=headers)
+            if nspace in self.sio.namespaces:
+                return True
+
+            #reconnects of the client re-attach all connection namespaces with this auth
+            if auth is not None:
+                self.sio.connection_auth = auth
+            if nspace not in self.sio.connection_namespaces:
+                self.sio.connection_namespaces.append(nspace)
+
+            self.sio._send_packet(packet.Packet(packet.CONNECT, data=auth, namespace=nspace))
+
+        deadline = time.monotonic() + timeout
+        while nspace not in self.sio.namespaces:
+            if time.monotonic() > deadline or not self.sio.connected:
+                self.detach(nspace)
+                return False
+            self.sio.sleep(0.01)
+        return True
+
+    def detach(self, nspace):
+        """Leave a namespace but keep the connection for later sessions."""
+        with self._lock:
+            if nspace == self.anchor:
+                return
+            if nspace in self.sio.connection_namespaces:
+                self.sio.connection_namespaces.remove(nspace)
+            if self.sio.connected and nspace in self.sio.namespaces:
+                self.sio._send_packet(packet.Packet(packet.DISCONNECT, namespace=nspace))
+                del self.sio.namespaces[nspace]
+
+    def close(self):
+        with self._lock:
+            self.sio.disconnect()
+            self.sio.eio.disconnect(abort=True)
+            self.target = None
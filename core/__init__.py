@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+#pure python parts of the QollabEO synchronisation; nothing in this package may
+#import qgis or PyQt so it can be used and profiled outside of a running QGIS
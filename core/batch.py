@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+import threading
+
+
+class BatchInbox:
+    """Thread safe accumulator for items which are processed in batches.
+
+    Producers (e.g. Socket.IO handlers) add items from any thread. Only the
+    first item added to an empty inbox returns True, hence, the consumer is
+    woken up once per batch and takes everything collected until then with
+    drain().
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._items = []
+
+    def put(self, item):
+        """Add a single item; returns True if the consumer has to be woken up."""
+        return self.extend((item,))
+
+    def extend(self, items):
+        """Add several items; returns True if the consumer has to be woken up."""
+        with self._lock:
+            wake = not self._items
+            self._items.extend(items)
+            return wake and bool(self._items)
+
+    def drain(self):
+        """Return and remove all collected items."""
+        with self._lock:
+            items = self._items
+            self._items = []
+        return items
+
+    def __len__(self):
+        with self._lock:
+            return len(self._items)
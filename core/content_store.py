@@ -0,0 +1,190 @@
+# -*- coding: utf-8 -*-
+import hashlib
+import os
+import threading
+from collections import Counter, OrderedDict
+
+
+def file_manifest(path, chunk_size=1024 * 1024):
+    """Split a file into fixed size chunks and describe it by their sha256 hashes.
+
+    The id of the file is the hash over all chunk hashes, hence, the same
+    file shared again has the same id and a modified file only differs in
+    the chunks which actually changed.
+    """
+    chunks = []
+    size = 0
+    with open(path, "rb") as fobj:
+        while True:
+            data = fobj.read(chunk_size)
+            if not data:
+                break
+            chunks.append(hashlib.sha256(data).hexdigest())
+            size += len(data)
+    file_id = hashlib.sha256("".join(chunks).encode("ascii")).hexdigest()
+    return {"id": file_id, "size": size, "chunk_size": chunk_size, "chunks": chunks}
+
+
+def read_chunk(path, manifest, ix):
+    with open(path, "rb") as fobj:
+        fobj.seek(ix * manifest["chunk_size"])
+        return fobj.read(manifest["chunk_size"])
+
+
+class ChunkCache:
+    """Size capped on-disk cache of chunks and assembled files.
+
+    Chunks are stored under their sha256 hash, assembled files under the id
+    of their manifest. Entries are evicted least recently used first once
+    the total size exceeds max_bytes; the order survives restarts through
+    the file modification times. Pinned entries, e.g. the chunks of a pull
+    still running or an assembled file in use, are not evicted until they
+    are unpinned; hence, a file larger than the cache still completes.
+    Thread safe.
+    """
+
+    def __init__(self, root, max_bytes):
+        self.root = root
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._size = 0
+        self._pins = Counter()
+        os.makedirs(root, exist_ok=True)
+
+        found = []
+        for entry in os.scandir(root):
+            if entry.is_file() and not entry.name.endswith(".tmp"):
+                stat = entry.stat()
+                found.append((stat.st_mtime, entry.name, stat.st_size))
+        for _, name, size in sorted(found):
+            self._entries[name] = size
+            self._size += size
+
+    def path(self, name):
+        return os.path.join(self.root, name)
+
+    def has(self, name):
+        with self._lock:
+            return name in self._entries
+
+    def touch(self, name):
+        with self._lock:
+            if name in self._entries:
+                self._entries.move_to_end(name)
+                try:
+                    os.utime(self.path(name))
+                except OSError:
+                    pass
+
+    def pin(self, names):
+        """Keep entries, cached or not yet, until they are unpinned as often."""
+        with self._lock:
+            self._pins.update(set(names))
+
+    def unpin(self, names):
+        with self._lock:
+            self._release(names)
+            self._evict(keep=None)
+
+    def put(self, digest, data):
+        """Store a chunk; returns False if data does not match its hash."""
+        if hashlib.sha256(data).hexdigest() != digest:
+            return False
+        self._write(digest, data)
+        return True
+
+    def get(self, name):
+        self.touch(name)
+        with open(self.path(name), "rb") as fobj:
+            return fobj.read()
+
+    def missing(self, manifest):
+        """Hashes of the manifest not in the cache; each hash once, in file order."""
+        seen = set()
+        wants = []
+        with self._lock:
+            for digest in manifest["chunks"]:
+                if digest not in self._entries and digest not in seen:
+                    seen.add(digest)
+                    wants.append(digest)
+        return wants
+
+    def assemble(self, manifest, ext=""):
+        """Write the file of a manifest from cached chunks; returns its path."""
+        name = manifest["id"] + ext
+        if self.has(name):
+            self.touch(name)
+            return self.path(name)
+
+        #the chunks are released once the file is complete; adding the file evicts them first if needed
+        self.pin(manifest["chunks"])
+        try:
+            tmp_path = self.path(name + ".tmp")
+            with open(tmp_path, "wb") as fobj:
+                for digest in manifest["chunks"]:
+                    fobj.write(self.get(digest))
+            os.replace(tmp_path, self.path(name))
+        finally:
+            with self._lock:
+                self._release(manifest["chunks"])
+        self._add(name, manifest["size"])
+        return self.path(name)
+
+    def _write(self, name, data):
+        tmp_path = self.path(name + ".tmp")
+        with open(tmp_path, "wb") as fobj:
+            fobj.write(data)
+        os.replace(tmp_path, self.path(name))
+        self._add(name, len(data))
+
+    def _add(self, name, size):
+        with self._lock:
+            self._size += size - self._entries.pop(name, 0)
+            self._entries[name] = size
+            self._evict(keep=name)
+
+    def _release(self, names):
+        self._pins.subtract(set(names))
+        self._pins = +self._pins
+
+    def _evict(self, keep):
+        for name in list(self._entries):
+            if self._size <= self.max_bytes:
+                break
+            if name == keep or name in self._pins:
+                continue
+            try:
+                os.remove(self.path(name))
+            except OSError:
+                #e.g. an assembled file still opened by a layer
+                continue
+            self._size -= self._entries.pop(name)
+
+
+class ChunkPull:
+    """Chunks a participant still needs; at most window of them are requested at once."""
+
+    def __init__(self, wants, window=8):
+        self.pending = list(reversed(wants))
+        self.outstanding = set()
+        self.window = window
+
+    @property
+    def done(self):
+        return not self.pending and not self.outstanding
+
+    def next_wants(self):
+        wants = []
+        while self.pending and len(self.outstanding) < self.window:
+            digest = self.pending.pop()
+            self.outstanding.add(digest)
+            wants.append(digest)
+        return wants
+
+    def received(self, digest):
+        self.outstanding.discard(digest)
+
+    def retry(self):
+        """Request everything outstanding again, e.g. after a reconnect."""
+        return sorted(self.outstanding)
@@ -0,0 +1,140 @@
+# -*- coding: utf-8 -*-
+import math
+import threading
+import time
+
+from .messages import extent_msg
+
+#timers only have millisecond resolution; polls that fire slightly early still count
+_TOLERANCE = 0.001
+
+
+class ExtentThrottle:
+    """Rate limited, latest-wins sender for the extent of the host canvas.
+
+    Every call to offer() only replaces the pending extent. The pending extent
+    is sent once the rate limit allows it and if it differs noticeably from the
+    last sent one. When no new extent was offered for settle_ms a final extent
+    flagged as "settled" is sent, hence, followers always end up at exactly the
+    extent the host stopped at.
+
+    :param send: Callable receiving the message dict which shall be sent.
+    :param max_hz: Maximum number of extent messages per second.
+    :param min_px: Minimum movement of the center in screen pixels.
+    :param min_scale_ratio: Minimum relative change of the scale (0.01 = 1%).
+    :param settle_ms: Idle time after which the extent counts as settled.
+    """
+
+    def __init__(self, send, max_hz=10.0, min_px=2.0, min_scale_ratio=0.01, settle_ms=250, clock=time.monotonic):
+        self.send = send
+        self.min_interval = 1.0 / max_hz if max_hz > 0 else 0.0
+        self.min_px = min_px
+        self.min_log_scale = math.log1p(min_scale_ratio)
+        self.settle = settle_ms / 1000.0
+        self.clock = clock
+
+        self.reset()
+
+    def reset(self):
+        self.pending = None     #(cx, cy, scale, map units per pixel)
+        self.last_sent = None
+        self.last_send_time = None
+        self.last_offer_time = None
+        self.sent_count = 0
+
+    def offer(self, cx, cy, scale, mupp):
+        """Store the newest extent; returns seconds until poll() must be called or None."""
+        now = self.clock()
+        self.pending = (cx, cy, scale, mupp)
+        self.last_offer_time = now
+        return self.poll(now)
+
+    def poll(self, now=None):
+        """Send the pending extent if allowed; returns seconds until the next poll or None."""
+        if self.pending is None:
+            return None
+
+        if now is None:
+            now = self.clock()
+
+        #host stopped moving; always send the exact final extent
+        idle = now - self.last_offer_time
+        if idle >= self.settle - _TOLERANCE:
+            self._send(now, settled=True)
+            self.pending = None
+            return None
+
+        wait_rate = 0.0
+        if self.last_send_time is not None:
+            wait_rate = self.min_interval - (now - self.last_send_time)
+            if wait_rate <= _TOLERANCE:
+                wait_rate = 0.0
+
+        if wait_rate == 0.0 and self._is_significant():
+            self._send(now, settled=False)
+            wait_rate = self.min_interval
+
+        #no need to poll before the next send is allowed; except the extent settles earlier
+        return min(wait_rate, self.settle - idle) if wait_rate > 0.0 else self.settle - idle
+
+    def _is_significant(self):
+        if self.last_sent is None:
+            return True
+
+        cx, cy, scale, mupp = self.pending
+        last_cx, last_cy, last_scale, _ = self.last_sent
+
+        if scale > 0 and last_scale > 0:
+            if abs(math.log(scale / last_scale)) >= self.min_log_scale:
+                return True
+
+        if mupp > 0:
+            dist_px = math.hypot(cx - last_cx, cy - last_cy) / mupp
+            if dist_px >= self.min_px:
+                return True
+
+        return False
+
+    def _send(self, now, settled):
+        cx, cy, scale, _ = self.pending
+
+        #skip intermediate duplicates; the settled message is sent anyway as it
+        #finishes the movement on the follower side
+        if not settled and self.last_sent is not None and self.last_sent[:3] == self.pending[:3]:
+            return
+
+        self.send(extent_msg(cx, cy, scale, settled))
+        self.last_sent = self.pending
+        self.last_send_time = now
+        self.sent_count += 1
+
+
+class LatestExtentSlot:
+    """Thread safe single slot holding the newest extent received from the host.
+
+    Socket.IO handlers run on a different thread than the canvas. Instead of
+    queueing every extent for the GUI thread the handler only overwrites the
+    slot and wakes the GUI thread if the slot was empty before; superseded
+    extents are therefore dropped before they are ever rendered.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._data = None
+        self.dropped = 0
+
+    def put(self, data):
+        """Store data; returns True if the consumer has to be woken up."""
+        with self._lock:
+            wake = self._data is None
+            if not wake:
+                self.dropped += 1
+            self._data = data
+        return wake
+
+    def take(self):
+        """Return and clear the newest extent or None if nothing is pending."""
+        with self._lock:
+            data = self._data
+            self._data = None
+        return data
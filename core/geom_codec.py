@@ -0,0 +1,228 @@
+# -*- coding: utf-8 -*-
+"""Geometry codecs for sync messages.
+
+Geometries are passed to the codecs in a simple neutral form (kind, parts):
+kind is one of RECT, POINT, LINE or POLYGON and parts is a list of rings,
+each ring a list of (x, y) tuples. A rectangle is given by the two corners
+[[(xmin, ymin), (xmax, ymax)]], points and lines have a single ring.
+
+Codecs are looked up by their name which is sent with every message;
+register_codec() allows adding further codecs.
+"""
+import re
+import struct
+
+RECT = "Rect"
+POINT = "Point"
+LINE = "LineString"
+POLYGON = "Polygon"
+
+
+class WktCodec:
+    """Well known text; understood by every client, hence, used as fallback."""
+
+    name = "wkt"
+
+    def encode(self, kind, parts, res=None):
+        if kind == RECT:
+            (xmin, ymin), (xmax, ymax) = parts[0]
+            kind, parts = POLYGON, [[(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]]
+
+        rings = ["(%s)" % ", ".join("%r %r" % (x, y) for x, y in ring) for ring in parts]
+        if kind == POLYGON:
+            return "Polygon (%s)" % ", ".join(rings)
+        return "%s %s" % (kind, rings[0])
+
+    _num_pair = re.compile(r"([-+0-9.eE]+)\s+([-+0-9.eE]+)")
+
+    def decode(self, payload, res=None):
+        kind = payload[:payload.index("(")].strip()
+        kind = {"POLYGON": POLYGON, "LINESTRING": LINE, "POINT": POINT}[kind.upper()]
+        body = payload[payload.index("("):]
+        parts = []
+        for ring in body.split(")")[:-1]:
+            ring = ring.lstrip(", (")
+            if ring == "":
+                continue
+            parts.append([(float(x), float(y)) for x, y in self._num_pair.findall(ring)])
+        return kind, parts
+
+
+class WkbCodec:
+    """Little endian well known binary (2D only)."""
+
+    name = "wkb"
+
+    _types = {POINT: 1, LINE: 2, POLYGON: 3}
+    _kinds = {1: POINT, 2: LINE, 3: POLYGON}
+
+    def encode(self, kind, parts, res=None):
+        if kind == RECT:
+            (xmin, ymin), (xmax, ymax) = parts[0]
+            kind, parts = POLYGON, [[(xmin, ymin), (xmin, ymax), (xmax, ymax), (xmax, ymin), (xmin, ymin)]]
+
+        if kind == POINT:
+            return struct.pack("<BIdd", 1, 1, parts[0][0][0], parts[0][0][1])
+
+        chunks = [struct.pack("<BI", 1, self._types[kind])]
+        if kind == POLYGON:
+            chunks.append(struct.pack("<I", len(parts)))
+        for ring in parts:
+            coords = [c for pnt in ring for c in pnt]
+            chunks.append(struct.pack("<I%dd" % len(coords), len(ring), *coords))
+        return b"".join(chunks)
+
+    def decode(self, payload, res=None):
+        byte_order, wkb_type = struct.unpack_from("<BI", payload, 0)
+        fmt = "<" if byte_order == 1 else ">"
+        if byte_order != 1:
+            wkb_type, = struct.unpack_from(">I", payload, 1)
+        kind = self._kinds[wkb_type]
+        offset = 5
+
+        if kind == POINT:
+            return kind, [[struct.unpack_from(fmt + "dd", payload, offset)]]
+
+        nrings = 1
+        if kind == POLYGON:
+            nrings, = struct.unpack_from(fmt + "I", payload, offset)
+            offset += 4
+
+        parts = []
+        for _ in range(nrings):
+            npnts, = struct.unpack_from(fmt + "I", payload, offset)
+            offset += 4
+            coords = struct.unpack_from(fmt + "%dd" % (2 * npnts), payload, offset)
+            offset += 16 * npnts
+            parts.append(list(zip(coords[0::2], coords[1::2])))
+        return kind, parts
+
+
+def _write_varint(out, value):
+    #zigzag encoding; small negative deltas stay small
+    value = (value << 1) ^ (value >> 63) if value < 0 else value << 1
+    while value >= 0x80:
+        out.append((value & 0x7F) | 0x80)
+        value >>= 7
+    out.append(value)
+
+
+def _read_varint(payload, offset):
+    shift = 0
+    value = 0
+    while True:
+        byte = payload[offset]
+        offset += 1
+        value |= (byte & 0x7F) << shift
+        if byte < 0x80:
+            break
+        shift += 7
+    return (value >> 1) ^ -(value & 1), offset
+
+
+class QuantizedDeltaCodec:
+    """Coordinates quantized to res map units and delta encoded as zigzag varints.
+
+    A rectangle only needs four numbers: the lower left corner, width and height.
+    The resolution has to be the same for sender and receiver; it is sent with
+    every message.
+    """
+
+    name = "qdelta"
+
+    _kinds = (RECT, POINT, LINE, POLYGON)
+
+    def encode(self, kind, parts, res=0.01):
+        out = bytearray()
+        out.append(self._kinds.index(kind))
+
+        if kind == RECT:
+            (xmin, ymin), (xmax, ymax) = parts[0]
+            qx, qy = round(xmin / res), round(ymin / res)
+            for value in (qx, qy, round(xmax / res) - qx, round(ymax / res) - qy):
+                _write_varint(out, value)
+            return bytes(out)
+
+        _write_varint(out, len(parts))
+        last_x = last_y = 0
+        for ring in parts:
+            _write_varint(out, len(ring))
+            for x, y in ring:
+                qx, qy = round(x / res), round(y / res)
+                _write_varint(out, qx - last_x)
+                _write_varint(out, qy - last_y)
+                last_x, last_y = qx, qy
+        return bytes(out)
+
+    def decode(self, payload, res=0.01):
+        kind = self._kinds[payload[0]]
+        offset = 1
+
+        if kind == RECT:
+            values = []
+            for _ in range(4):
+                value, offset = _read_varint(payload, offset)
+                values.append(value)
+            qx, qy, qw, qh = values
+            return kind, [[(qx * res, qy * res), ((qx + qw) * res, (qy + qh) * res)]]
+
+        nrings, offset = _read_varint(payload, offset)
+        parts = []
+        last_x = last_y = 0
+        for _ in range(nrings):
+            npnts, offset = _read_varint(payload, offset)
+            ring = []
+            for _ in range(npnts):
+                dx, offset = _read_varint(payload, offset)
+                dy, offset = _read_varint(payload, offset)
+                last_x += dx
+                last_y += dy
+                ring.append((last_x * res, last_y * res))
+            parts.append(ring)
+        return kind, parts
+
+
+_codecs = {}
+
+#codecs in order of preference; the first one supported by every client is used
+_preference = []
+
+
+def register_codec(codec, preferred=False):
+    _codecs[codec.name] = codec
+    if codec.name in _preference:
+        _preference.remove(codec.name)
+    if preferred:
+        _preference.insert(0, codec.name)
+    else:
+        _preference.append(codec.name)
+
+
+register_codec(QuantizedDeltaCodec())
+register_codec(WkbCodec())
+register_codec(WktCodec())
+
+
+def get_codec(name):
+    #messages without codec are sent by older clients using wkt
+    return _codecs[name or WktCodec.name]
+
+
+def available_codecs():
+    return list(_preference)
+
+
+def negotiate(supported_lists, preference=None):
+    """Return the most preferred codec supported by all clients; wkt if there is none."""
+    if preference is None:
+        preference = _preference
+    for name in preference:
+        if all(name in supported for supported in supported_lists):
+            return name
+    return WktCodec.name
+
+
+def resolution_for_crs(is_geographic):
+    """Quantization step for a session CRS; roughly 1 cm for projected and geographic CRS."""
+    return 1e-7 if is_geographic else 0.01
+
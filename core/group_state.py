@@ -0,0 +1,253 @@
+# -*- coding: utf-8 -*-
+from bisect import bisect_left
+
+
+def encode_bits(flags):
+    """Bitset of an iterable of booleans as hex string; bit i is flags[i]."""
+    value = 0
+    for ix, flag in enumerate(flags):
+        if flag:
+            value |= 1 << ix
+    return "%x" % value
+
+
+def decode_bits(hex_str, count):
+    value = int(hex_str or "0", 16)
+    return [bool(value >> ix & 1) for ix in range(count)]
+
+
+def _stable_keys(old, new):
+    #keys of old which keep their relative order in new (longest increasing subsequence of new positions)
+    new_ix = {key: ix for ix, key in enumerate(new)}
+    seq = [key for key in old if key in new_ix]
+
+    tails, tails_at, prev = [], [], [None] * len(seq)
+    for ix, key in enumerate(seq):
+        pos = bisect_left(tails, new_ix[key])
+        if pos == len(tails):
+            tails.append(new_ix[key])
+            tails_at.append(ix)
+        else:
+            tails[pos] = new_ix[key]
+            tails_at[pos] = ix
+        prev[ix] = tails_at[pos - 1] if pos else None
+
+    stable = set()
+    ix = tails_at[-1] if tails_at else None
+    while ix is not None:
+        stable.add(seq[ix])
+        ix = prev[ix]
+    return stable
+
+
+def move_ops(old, new):
+    """Minimal moves turning the order old into new.
+
+    Returns [key, after] pairs where after is the key the layer is placed
+    behind (None: first place); keys of new missing in old are inserted.
+    Applied in the given order with apply_moves the result equals new;
+    every pair refers to the final predecessor of the key.
+    """
+    stable = _stable_keys(old, new)
+    return [[key, new[ix - 1] if ix else None] for ix, key in enumerate(new) if key not in stable]
+
+
+def apply_moves(order, removed, moves):
+    #the order as linked list (None is the head); every move is O(1) instead of a list remove and insert
+    removed = set(removed)
+    keys = [None] + [key for key in order if key not in removed]
+    succ = dict(zip(keys, keys[1:] + [None]))
+    pred = dict(zip(keys[1:], keys))
+    for key, after in moves:
+        if key in pred:
+            before, behind = pred[key], succ[key]
+            succ[before] = behind
+            if behind is not None:
+                pred[behind] = before
+        behind = succ[after]
+        succ[after], pred[key], succ[key] = key, after, behind
+        if behind is not None:
+            pred[behind] = key
+
+    order = []
+    key = succ[None]
+    while key is not None:
+        order.append(key)
+        key = succ[key]
+    return order
+
+
+class GroupState:
+    """Versioned order and visibility of the synchronised layers.
+
+    The host places, removes and hides layers with insert(), remove() and
+    set_visible() as the layer tree signals arrive and calls commit() once
+    per batch; the change to the previous version is returned as compact
+    diff:
+
+        {"kind": "diff", "base": 3, "ver": 4, "rm": [keys],
+         "mv": [[key, after], ...], "vis": "<hex bitset>"}
+
+    Only the changed keys are visited; the order is kept as linked list and
+    the whole order is only walked for the visibility bitset. update() sets
+    a complete new order instead (full resync).
+
+    vis is the XOR of the old and new visibility over the new order, layers
+    new to the group count as visible before. Followers keep a GroupState as
+    replica and apply() diffs whose base matches their version; otherwise a
+    snapshot ({"kind": "snapshot", "ver", "order", "vis"}) is needed.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, ver=0, order=(), visible=()):
+        order = list(order)
+        self.ver = ver
+        self.visible = dict(zip(order, visible))
+        #the order as linked list (None is the head); _order caches it as list
+        keys = [None] + order
+        self._succ = dict(zip(keys, order + [None]))
+        self._pred = dict(zip(order, keys))
+        self._order = order
+        #host; keys of the last version and the changes made since then
+        self._base = set(order)
+        self._removed = set()
+        self._placed = {}
+        self._was_visible = {}
+
+    @property
+    def order(self):
+        if self._order is None:
+            self._order = []
+            key = self._succ[None]
+            while key is not None:
+                self._order.append(key)
+                key = self._succ[key]
+        return self._order
+
+    def __contains__(self, key):
+        return key in self._pred
+
+    def flags(self, order=None):
+        order = self.order if order is None else order
+        return [self.visible.get(key, True) for key in order]
+
+    def snapshot(self):
+        return {"kind": "snapshot", "ver": self.ver, "order": list(self.order), "vis": encode_bits(self.flags())}
+
+    def insert(self, key, after=None, visible=True):
+        """Place key behind after (None: first place); a new key is added, a known one moved."""
+        if key == after:
+            self.set_visible(key, visible)
+            return
+        if key in self._pred:
+            self._unlink(key)
+        behind = self._succ[after]
+        self._succ[after], self._pred[key], self._succ[key] = key, after, behind
+        if behind is not None:
+            self._pred[behind] = key
+        self._order = None
+        self._removed.discard(key)
+        self._placed[key] = True
+        self.set_visible(key, visible)
+
+    def remove(self, key):
+        if key not in self._pred:
+            return
+        self._unlink(key)
+        self._order = None
+        self._placed.pop(key, None)
+        if key in self._base:
+            self._removed.add(key)
+            #followers still know its old visibility if it is added again
+            self._was_visible.setdefault(key, self.visible.get(key, True))
+        else:
+            self._was_visible.pop(key, None)
+        self.visible.pop(key, None)
+
+    def set_visible(self, key, visible):
+        old = self.visible.get(key, True)
+        if old != visible:
+            self._was_visible.setdefault(key, old)
+            self.visible[key] = visible
+
+    def _unlink(self, key):
+        before, behind = self._pred.pop(key), self._succ.pop(key)
+        self._succ[before] = behind
+        if behind is not None:
+            self._pred[behind] = before
+
+    def commit(self):
+        """Diff of the changes since the last version; None if nothing changed."""
+        #runs of placed keys are moved behind their final predecessor, every run starting behind
+        #a key which stayed in place; hence, the moves applied in this order lead to the same order
+        mv = []
+        for key in self._placed:
+            if self._placed[key] is not True:
+                continue
+            while self._placed.get(self._pred[key]) is True:
+                key = self._pred[key]
+            while self._placed.get(key) is True:
+                mv.append([key, self._pred[key]])
+                self._placed[key] = False
+                key = self._succ[key]
+        rm = list(self._removed)
+        toggled = {key for key, old in self._was_visible.items() if key in self._pred and self.visible.get(key, True) != old}
+
+        self._base.difference_update(self._removed)
+        self._base.update(self._placed)
+        self._removed = set()
+        self._placed = {}
+        self._was_visible = {}
+        if not rm and not mv and not toggled:
+            return None
+
+        diff = {"kind": "diff", "base": self.ver, "ver": self.ver + 1, "rm": rm, "mv": mv,
+                "vis": encode_bits(key in toggled for key in self.order) if toggled else "0"}
+        self.ver += 1
+        return diff
+
+    def update(self, order, visible):
+        """Set the whole new state; returns the diff or None if nothing changed.
+
+        Changes made with insert() and remove() have to be committed before.
+        """
+        order = list(order)
+        visible = list(visible)
+        old_flags = self.flags(order)
+        keys = set(order)
+        rm = [key for key in self.order if key not in keys]
+        mv = move_ops(self.order, order) if order != self.order else []
+        if not rm and not mv and old_flags == visible:
+            return None
+
+        diff = {"kind": "diff", "base": self.ver, "ver": self.ver + 1, "rm": rm, "mv": mv,
+                "vis": encode_bits(old != new for old, new in zip(old_flags, visible))}
+        self.reset(self.ver + 1, order, visible)
+        return diff
+
+    def apply(self, msg):
+        """Apply a diff or snapshot of the host.
+
+        Returns (removed keys, moves, [(key, visible), ...] of changed layers)
+        or None if a diff does not fit the current version.
+        """
+        if msg["kind"] == "snapshot":
+            order = list(msg["order"])
+            visible = decode_bits(msg["vis"], len(order))
+            keys = set(order)
+            removed = [key for key in self.order if key not in keys]
+            moves = move_ops(self.order, order)
+        else:
+            if msg["base"] != self.ver:
+                return None
+            removed = list(msg["rm"])
+            moves = [list(move) for move in msg["mv"]]
+            order = apply_moves(self.order, removed, moves)
+            toggled = decode_bits(msg["vis"], len(order))
+            visible = [flag != flip for flag, flip in zip(self.flags(order), toggled)]
+
+        changed = [(key, flag) for key, flag in zip(order, visible) if self.visible.get(key, True) != flag]
+        self.reset(msg["ver"], order, visible)
+        return removed, moves, changed
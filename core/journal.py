@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+from collections import deque
+
+#room events which only matter in their newest version; older ones are not replayed
+COMPACT_KEYS = {"extent_changed": "extent",
+                "crs_changed": "crs",
+                "codec_changed": "codec",
+                "user_list": "users"}
+
+
+class EventJournal:
+    """Sequenced log of the events of a room (server side).
+
+    Every event relayed to a room gets the next sequence number and is kept
+    in a ring of capacity entries. Events with a compaction key (e.g. the
+    extent or the crs) are superseded by the next event with the same key;
+    only the newest one per key is replayed and it is kept even after it
+    dropped out of the ring. A client resuming after an outage gets the
+    events after its last sequence number (replay), or, if these are no
+    longer in the ring, the newest keyed events only (snapshot) and has to
+    fetch notes and layers with their own snapshots. In both cases the cost
+    depends on the length of the outage, not of the meeting.
+
+    A journal covers one audience (the participants of a room, or its host)
+    and every journaled event is delivered to all of its members, including
+    the sender; otherwise clients would see holes in the sequence numbers.
+    """
+
+    def __init__(self, capacity=1000):
+        self.head = 0
+        self._ring = deque(maxlen=capacity)
+        self._latest = {}
+
+    def append(self, event, data, key=None):
+        self.head += 1
+        entry = (self.head, event, data, key)
+        self._ring.append(entry)
+        if key is not None:
+            self._latest[key] = entry
+        return self.head
+
+    def _current(self, entry):
+        return entry[3] is None or self._latest[entry[3]] is entry
+
+    def resume(self, after):
+        """Answer to a resume request: {"kind": "replay" | "snapshot", "head", "events": [[seq, event, data], ...]}."""
+        first = self._ring[0][0] if self._ring else self.head + 1
+        if after >= first - 1:
+            events = [[entry[0], entry[1], entry[2]] for entry in self._ring
+                      if entry[0] > after and self._current(entry)]
+            return {"kind": "replay", "head": self.head, "events": events}
+
+        events = sorted([seq, event, data] for seq, event, data, _ in self._latest.values())
+        return {"kind": "snapshot", "head": self.head, "events": events}
+
+
+class JournalCursor:
+    """Sequence numbers of the room events seen by a client.
+
+    last is the highest sequence number up to which every event was seen;
+    events arriving twice (live and replayed) are reported as duplicates.
+    Without a start value the first event seen anchors the cursor. A gap is
+    repaired with a single resume request at a time; its answer is unpacked
+    by replay.
+    """
+
+    def __init__(self):
+        self.reset()
+
+    def reset(self, last=None):
+        self.last = last
+        self._ahead = set()
+        self.resume_pending = False
+
+    def want_resume(self):
+        """Sequence number for a resume request; None if one is on its way or nothing was seen yet."""
+        if self.resume_pending or self.last is None:
+            return None
+        self.resume_pending = True
+        return self.last
+
+    def replay(self, answer):
+        """Events of a resume answer not seen yet as [(event, data), ...]; replayed ones with their seq."""
+        if answer["kind"] == "replay":
+            events = [(event, dict(data, seq=seq)) for seq, event, data in answer["events"] if self.seen(seq) != "dup"]
+        else:
+            #a snapshot only has the newest keyed events; they are applied regardless
+            events = [(event, data) for _, event, data in answer["events"]]
+        #compacted events are never replayed; their sequence numbers are covered by head
+        self.jump(answer["head"])
+        self.resume_pending = False
+        return events
+
+    def seen(self, seq):
+        """Return "ok", "dup" or "gap" (events between last and seq are missing)."""
+        if self.last is None:
+            self.last = seq
+            return "ok"
+        if seq <= self.last or seq in self._ahead:
+            return "dup"
+
+        self._ahead.add(seq)
+        while self.last + 1 in self._ahead:
+            self.last += 1
+            self._ahead.remove(self.last)
+        return "gap" if self._ahead else "ok"
+
+    def jump(self, seq):
+        """Everything up to seq is known (e.g. after a replay which skipped compacted events)."""
+        if self.last is None or seq > self.last:
+            self.last = seq
+        self._ahead = {ahead for ahead in self._ahead if ahead > self.last}
+        while self.last + 1 in self._ahead:
+            self.last += 1
+            self._ahead.remove(self.last)
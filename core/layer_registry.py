@@ -0,0 +1,93 @@
+# -*- coding: utf-8 -*-
+
+
+class LayerRegistry:
+    """Synchronised layers of the QollabEO group keyed by layer id.
+
+    The host feeds every layer added to or removed from the group into the
+    registry as the layer tree signals arrive; nothing is rebuilt from the
+    whole group. Changes are collected until take_diff() is called, hence,
+    any number of layers added or removed at once end up in one message. A
+    layer removed and added again before take_diff() does not show up in the
+    diff at all. A layer may be in the tree more than once for a moment
+    (drag and drop inserts the moved node before it removes the old one);
+    the nodes are counted and the layer is removed with its last node.
+
+    Every layer gets a short integer key which identifies it in all
+    messages; unlike names keys are unique and unlike QGIS layer ids they
+    are compact. A key is never reused within a session.
+    """
+
+    def __init__(self):
+        self.layers = {}
+        self.lids = {}
+        self.nodes = {}
+        self._added = {}
+        self._removed = {}
+        self._next_key = 0
+
+    def reset(self, layers=None):
+        """Replace the content without reporting it as change; layers is an iterable of (lid, info)."""
+        self.layers = {}
+        self.lids = {}
+        self.nodes = {}
+        self._added = {}
+        self._removed = {}
+        for lid, info in layers or ():
+            self.nodes[lid] = self.nodes.get(lid, 0) + 1
+            if lid not in self.layers:
+                self.layers[lid] = self._keyed(info)
+                self.lids[self.layers[lid]["key"]] = lid
+
+    def _keyed(self, info):
+        self._next_key += 1
+        return dict(info, key=self._next_key)
+
+    def key(self, lid):
+        return self.layers[lid]["key"]
+
+    def lid(self, key):
+        return self.lids.get(key)
+
+    def add(self, lid, info):
+        """Add a node of the layer; returns its key."""
+        self.nodes[lid] = self.nodes.get(lid, 0) + 1
+        if lid in self._removed:
+            #moved within the batch; keeps its key
+            self.layers[lid] = dict(info, key=self._removed.pop(lid)["key"])
+        elif lid not in self.layers:
+            info = self._keyed(info)
+            self.layers[lid] = info
+            self._added[lid] = info
+        self.lids[self.layers[lid]["key"]] = lid
+        return self.layers[lid]["key"]
+
+    def remove(self, lid):
+        """Remove a node of the layer; returns the key if it was the last one, otherwise None."""
+        if lid not in self.layers:
+            return None
+        self.nodes[lid] -= 1
+        if self.nodes[lid] > 0:
+            return None
+        del self.nodes[lid]
+        info = self.layers.pop(lid)
+        self.lids.pop(info["key"], None)
+        if lid in self._added:
+            del self._added[lid]
+        else:
+            self._removed[lid] = info
+        return info["key"]
+
+    def __contains__(self, lid):
+        return lid in self.layers
+
+    def has_changes(self):
+        return bool(self._added) or bool(self._removed)
+
+    def take_diff(self):
+        """Return the collected changes as lyrs_changed message and start a new batch."""
+        diff = {"added": list(self._added.values()),
+                "removed": [info["key"] for info in self._removed.values()]}
+        self._added = {}
+        self._removed = {}
+        return diff
@@ -0,0 +1,132 @@
+# -*- coding: utf-8 -*-
+"""Payloads of the QollabEO sync messages.
+
+The *_msg functions build the payload of an outbound message, the others
+read an inbound one. Geometries are already encoded (see geom_codec);
+QGIS objects never appear in a payload.
+"""
+import hashlib
+
+
+def extent_msg(cx, cy, zoom, settled):
+    return {"zoom": zoom, "cx": cx, "cy": cy, "settled": settled}
+
+
+def extent_rect(msg, scale, mupp, width, height):
+    """Extent (xmin, ymin, xmax, ymax) showing an extent message on a canvas of width x height pixels.
+
+    The scale is proportional to the map units per pixel of a given canvas;
+    hence, center and scale of the host are applied as a single extent.
+    Returns None if the canvas has no valid scale or size yet.
+    """
+    if scale <= 0 or width <= 0 or height <= 0:
+        return None
+    mupp = mupp * msg["zoom"] / scale
+    half_w = width * mupp / 2.0
+    half_h = height * mupp / 2.0
+    return msg["cx"] - half_w, msg["cy"] - half_h, msg["cx"] + half_w, msg["cy"] + half_h
+
+
+def wkt_ref(wkt):
+    """Reference of a crs without portable authority id: a hash of its wkt."""
+    return "wkt:" + hashlib.sha1(wkt.encode("utf-8")).hexdigest()[:20]
+
+
+def crs_msg(ref, wkt=None):
+    """Crs as its reference (authority id or wkt_ref); the wkt is only added if a user asked for it."""
+    msg = {"ref": ref}
+    if wkt is not None:
+        msg["wkt"] = wkt
+    return msg
+
+
+def crs_of_msg(msg):
+    """(ref, wkt or None) of a crs message; hosts of older versions send the wkt only."""
+    if "ref" in msg:
+        return msg["ref"], msg.get("wkt")
+    return wkt_ref(msg["crs"]), msg["crs"]
+
+
+def codec_msg(codec, res):
+    return {"codec": codec, "res": res}
+
+
+def feat_batch_msg(feats, codec, res):
+    """Notes with encoded geometries; codec and res are sent once per batch."""
+    return {"feats": feats, "codec": codec, "res": res}
+
+
+def batch_feats(msg):
+    """Notes of a feat_batch; every note keeps the codec of its batch as notes from different batches are decoded together."""
+    codec = msg.get("codec")
+    res = msg.get("res")
+    for feat in msg["feats"]:
+        feat["codec"] = codec
+        feat["res"] = res
+    return msg["feats"]
+
+
+def feat_update_msg(uid, geom, codec, res, clock, sid=None):
+    """New geometry of a note with the version (lamport clock, sid) of the change (see core.notes_state).
+
+    Without sid the server adds the current sid of the sender.
+    """
+    msg = {"uid": uid, "geom": geom, "codec": codec, "res": res, "clock": clock}
+    if sid is not None:
+        msg["sid"] = sid
+    return msg
+
+
+def feat_delete_msg(uid, clock, sid=None):
+    """Delete of a note with the version of the change."""
+    msg = {"uid": uid, "clock": clock}
+    if sid is not None:
+        msg["sid"] = sid
+    return msg
+
+
+def changed_note(msg):
+    """Note of a feat_update / feat_delete of the server; the note is nested as the journal adds its own seq."""
+    return msg["note"]
+
+
+def user_list_msg(rid, users, ver=None, to=None):
+    """Full user list; the host sends it with its roster version to a single user (to: sid) only."""
+    msg = {"rid": rid, "users": dict(users)}
+    if ver is not None:
+        msg["ver"] = ver
+    if to is not None:
+        msg["to"] = to
+    return msg
+
+
+def user_joined_msg(ver, sid, user):
+    return {"ver": ver, "sid": sid, "user": user}
+
+
+def user_left_msg(ver, sid):
+    return {"ver": ver, "sid": sid}
+
+
+def user_list_users(msg):
+    """sid -> name of a user_list; journaled lists carry the users next to their sequence number."""
+    return msg.get("users", msg)
+
+
+def _flat(pts):
+    return [value for pnt in pts for value in pnt]
+
+
+def stroke_begin_msg(uid, user, kind, pts):
+    """First vertices of a stroke being drawn (see core.sketch); coordinates as flat [x0, y0, x1, y1, ...]."""
+    return {"uid": uid, "user": user, "kind": kind, "xy": _flat(pts)}
+
+
+def stroke_append_msg(uid, start, pts):
+    """Vertices of a stroke from index start on."""
+    return {"uid": uid, "from": start, "xy": _flat(pts)}
+
+
+def stroke_end_msg(uid, kept=True):
+    """End of a stroke; a kept stroke follows as note with the same uid, others are dropped."""
+    return {"uid": uid, "kept": kept}
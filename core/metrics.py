@@ -0,0 +1,215 @@
+# -*- coding: utf-8 -*-
+import bisect
+import itertools
+import threading
+import time
+from collections import deque
+
+#upper bounds of the latency histogram buckets in milliseconds; the last bucket is open
+LATENCY_BUCKETS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+def now_ms():
+    return time.time() * 1000.0
+
+
+def payload_size(data):
+    """Approximate wire size of a message payload in bytes (strings, bytes and numbers)."""
+    if isinstance(data, (bytes, bytearray)):
+        return len(data)
+    if isinstance(data, str):
+        return len(data)
+    if isinstance(data, dict):
+        return sum(len(str(key)) + payload_size(value) + 4 for key, value in data.items()) + 2
+    if isinstance(data, (list, tuple)):
+        return sum(payload_size(value) + 1 for value in data) + 2
+    if data is None or isinstance(data, bool):
+        return 4
+    return 8
+
+
+class ClockSync:
+    """Offset of the local clock to the server clock from ping/pong round trips.
+
+    A ping leaves at local time t0, the server stamps it with its time ts and
+    the pong arrives at local time t1. Assuming symmetric paths the server
+    clock is ahead by ts - (t0 + t1) / 2. The sample with the smallest round
+    trip of the last samples is the least disturbed by queueing and is used.
+    """
+
+    def __init__(self, samples=8):
+        self._samples = deque(maxlen=samples)
+        self.rtt = None
+        self.offset = 0.0
+
+    def add(self, t0, ts, t1):
+        rtt = t1 - t0
+        if rtt < 0:
+            return
+        self.rtt = rtt
+        self._samples.append((rtt, ts - (t0 + t1) / 2.0))
+        self.offset = min(self._samples)[1]
+
+    def server_ms(self, local=None):
+        return (now_ms() if local is None else local) + self.offset
+
+
+class LatencyHistogram:
+    """Counts of latencies in LATENCY_BUCKETS_MS; percentiles are given as bucket bounds."""
+
+    def __init__(self):
+        self.counts = [0] * (len(LATENCY_BUCKETS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, ms):
+        ms = max(0.0, ms)
+        self.counts[bisect.bisect_left(LATENCY_BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def percentile(self, q):
+        if self.count == 0:
+            return None
+        rank = q * self.count
+        seen = 0
+        for ix, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank and count > 0:
+                return LATENCY_BUCKETS_MS[ix] if ix < len(LATENCY_BUCKETS_MS) else self.max
+        return self.max
+
+    def to_dict(self):
+        return {"count": self.count,
+                "mean": self.total / self.count if self.count else None,
+                "p50": self.percentile(0.50),
+                "p95": self.percentile(0.95),
+                "p99": self.percentile(0.99),
+                "max": self.max,
+                "buckets": list(LATENCY_BUCKETS_MS) + ["inf"],
+                "counts": list(self.counts)}
+
+
+class RateMeter:
+    """Messages and bytes per second over the last window seconds."""
+
+    def __init__(self, window=10.0, clock=time.monotonic):
+        self.window = window
+        self.clock = clock
+        self._events = deque()
+        self.msgs = 0
+        self.bytes = 0
+
+    def add(self, size):
+        now = self.clock()
+        self._events.append((now, size))
+        self.msgs += 1
+        self.bytes += size
+        self._trim(now)
+
+    def _trim(self, now):
+        while self._events and self._events[0][0] < now - self.window:
+            self._events.popleft()
+
+    def rate(self):
+        """(messages per second, bytes per second)."""
+        self._trim(self.clock())
+        return len(self._events) / self.window, sum(size for _, size in self._events) / self.window
+
+
+class SyncMetrics:
+    """Latency and traffic of the sync messages of one client; thread safe.
+
+    Outbound messages are stamped with the send time in server time and a
+    message id. Inbound messages with such a stamp give the sync lag from
+    the sender to this client (clock offsets of both removed through the
+    server clock). Lags are kept per event type as histograms and the lags
+    of the last seconds for the live view; peers report their own RTT and
+    lag which are kept per sid.
+    """
+
+    def __init__(self, recent=5.0, clock=time.monotonic):
+        self.clock = clock
+        self.recent = recent
+        self.sync = ClockSync()
+        self._lock = threading.Lock()
+        self._mids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.started = now_ms()
+            self.histograms = {}
+            self.inbound = RateMeter(clock=self.clock)
+            self.outbound = RateMeter(clock=self.clock)
+            self._recent = deque()
+            self.peers = {}
+
+    def stamp(self, data):
+        """Copy of a dict payload with send time ("ts", server clock) and message id ("mid")."""
+        return dict(data, ts=round(self.sync.server_ms(), 1), mid=next(self._mids))
+
+    def sent(self, data):
+        with self._lock:
+            self.outbound.add(payload_size(data))
+
+    def received(self, event, data):
+        size = payload_size(data)
+        lag = None
+        if isinstance(data, dict) and isinstance(data.get("ts"), (int, float)):
+            lag = self.sync.server_ms() - data["ts"]
+        with self._lock:
+            self.inbound.add(size)
+            if lag is None:
+                return
+            self.histograms.setdefault(event, LatencyHistogram()).add(lag)
+            now = self.clock()
+            self._recent.append((now, lag))
+            while self._recent and self._recent[0][0] < now - self.recent:
+                self._recent.popleft()
+
+    def pong(self, t0, ts):
+        with self._lock:
+            self.sync.add(t0, ts, now_ms())
+
+    def peer(self, sid, stats):
+        with self._lock:
+            self.peers[sid] = dict(stats, seen=self.clock())
+
+    def forget_peer(self, sid):
+        with self._lock:
+            self.peers.pop(sid, None)
+
+    def lag(self):
+        """Median sync lag of the last seconds in ms; None without recent messages."""
+        with self._lock:
+            now = self.clock()
+            lags = sorted(lag for t, lag in self._recent if t >= now - self.recent)
+        return lags[len(lags) // 2] if lags else None
+
+    def summary(self):
+        """Compact own stats, also sent to the other participants."""
+        lag = self.lag()
+        with self._lock:
+            msgs_in, bytes_in = self.inbound.rate()
+            msgs_out, bytes_out = self.outbound.rate()
+        return {"rtt": None if self.sync.rtt is None else round(self.sync.rtt, 1),
+                "lag": None if lag is None else round(lag, 1),
+                "in_rate": round(msgs_in, 1), "out_rate": round(msgs_out, 1),
+                "in_bps": round(bytes_in), "out_bps": round(bytes_out)}
+
+    def to_dict(self):
+        with self._lock:
+            peers = {sid: {key: value for key, value in stats.items() if key != "seen"} for sid, stats in self.peers.items()}
+            histograms = {event: hist.to_dict() for event, hist in self.histograms.items()}
+            totals = {"msgs_in": self.inbound.msgs, "bytes_in": self.inbound.bytes,
+                      "msgs_out": self.outbound.msgs, "bytes_out": self.outbound.bytes}
+        return {"started": self.started,
+                "exported": now_ms(),
+                "clock_offset_ms": self.sync.offset,
+                "summary": self.summary(),
+                "totals": totals,
+                "lag_ms": histograms,
+                "peers": peers}
@@ -0,0 +1,348 @@
+# -*- coding: utf-8 -*-
+import time
+from bisect import bisect_right
+
+#attributes of a note as they are sent in feat_added/feat_batch/feat_update/feat_delete messages;
+#codec and res are sent once per feat_batch and stored with every note of the batch; clock and
+#sid are the version of the last update or delete, deleted marks tombstones
+NOTE_KEYS = ("uid", "user", "geom", "codec", "res", "clock", "sid", "deleted")
+
+
+def to_columns(feats):
+    """Pack a list of note dicts into a columnar dict; keys are not repeated per note.
+
+    The version columns are left out if no note of the list was changed.
+    """
+    cols = {key: [feat.get(key) for feat in feats] for key in NOTE_KEYS + ("seq",)}
+    for key in ("clock", "sid", "deleted"):
+        if not any(cols[key]):
+            del cols[key]
+    return cols
+
+
+def from_columns(cols):
+    """Inverse of to_columns."""
+    keys = list(cols.keys())
+    return [dict(zip(keys, values)) for values in zip(*(cols[key] for key in keys))]
+
+
+def version(note):
+    """(lamport clock, sid) of a note; added notes which were never changed have version (0, "")."""
+    return note.get("clock") or 0, note.get("sid") or ""
+
+
+class NotesRoomState:
+    """Versioned notes state of a single room as kept by the server.
+
+    Every note gets a monotonically increasing sequence number when it is
+    added, updated or deleted; a note only keeps the sequence number of its
+    last change. Updates and deletes carry a version (lamport clock, sid) and
+    are merged last-writer-wins: a change is only applied if its version is
+    greater than the one of the note. Deleted notes stay as tombstones, hence,
+    older changes arriving late or replayed lose against the delete, a newer
+    update restores the note; tombstones every member has acknowledged are
+    dropped with compact().
+
+    Clients synchronise with sync(after): a client without any state
+    (after < 0) or which missed compacted tombstones (after < floor) receives
+    a snapshot, a client which already knows all changes up to "after" only
+    receives the notes changed since then. Large answers are split into pages
+    of at most page_size notes; the client asks for the next page with the
+    returned "seq" (and snapshot=True while receiving a snapshot) until it
+    reaches "head".
+
+    This class is the reference for the server side and can be used as local
+    stand-in of a room, e.g. for testing or benchmarking.
+    """
+
+    def __init__(self, page_size=5000):
+        self.page_size = page_size
+        self.head = 0
+        self.floor = 0          #highest sequence number of a compacted tombstone
+        self.seqs = []          #sorted; parallel to self.log
+        self.log = []           #uid changed with every sequence number; older changes of a note are skipped
+        self.notes = {}
+        self.tombstones = {}    #uid: seq of the deleted notes
+
+    def _stamp(self, note):
+        self.head += 1
+        note = dict(note, seq=self.head)
+        self.notes[note["uid"]] = note
+        self.seqs.append(self.head)
+        self.log.append(note["uid"])
+        return note
+
+    def _trim(self):
+        #drop the outdated log entries once they make up more than half of the log
+        if len(self.log) > 2 * len(self.notes) + 1000:
+            live = sorted((note["seq"], uid) for uid, note in self.notes.items())
+            self.seqs = [seq for seq, _ in live]
+            self.log = [uid for _, uid in live]
+
+    def add(self, feats):
+        """Stamp new notes with their sequence number; returns the stamped notes.
+
+        Notes of a feat_batch must carry the codec and res of the batch.
+
+        Notes with an already known uid are ignored (e.g. sent twice after a reconnect).
+        """
+        stamped = []
+        for feat in feats:
+            if feat["uid"] in self.notes:
+                continue
+            stamped.append(self._stamp(feat))
+        return stamped
+
+    def change(self, op):
+        """Merge an update (geom, codec, res) or delete (deleted) of a note with its version (clock, sid).
+
+        Returns the changed note with its new sequence number or None if the
+        note is unknown or already has a newer version.
+        """
+        note = self.notes.get(op["uid"])
+        if note is None or version(op) <= version(note):
+            return None
+        note = dict(note, clock=op["clock"], sid=op["sid"], deleted=bool(op.get("deleted")))
+        if note["deleted"]:
+            note["geom"] = None
+        else:
+            note.update(geom=op["geom"], codec=op.get("codec", "wkt"), res=op.get("res"))
+        note = self._stamp(note)
+        if note["deleted"]:
+            self.tombstones[note["uid"]] = note["seq"]
+        else:
+            #an update newer than the delete restores the note
+            self.tombstones.pop(note["uid"], None)
+        self._trim()
+        return note
+
+    def compact(self, acked):
+        """Drop the tombstones of deletes every member has seen (sequence number up to acked); returns their number."""
+        uids = [uid for uid, seq in self.tombstones.items() if seq <= acked]
+        for uid in uids:
+            self.floor = max(self.floor, self.tombstones.pop(uid))
+            del self.notes[uid]
+        if uids:
+            self._trim()
+        return len(uids)
+
+    def sync(self, after=-1, snapshot=False):
+        """Return the notes_state message for a client which knows all changes up to after.
+
+        snapshot=True continues a snapshot with the page after "after"; notes
+        deleted in the meantime are part of it as tombstones.
+        """
+        restart = after < 0 or (after < self.floor and not snapshot)
+        if restart:
+            after = -1
+        page = []
+        ix = bisect_right(self.seqs, after)
+        upto = max(after, 0)
+        while ix < len(self.seqs) and len(page) < self.page_size:
+            seq, note = self.seqs[ix], self.notes.get(self.log[ix])
+            ix += 1
+            upto = seq
+            #a new snapshot only holds the notes which exist
+            if note is None or note["seq"] != seq or (after < 0 and note.get("deleted")):
+                continue
+            page.append(note)
+        if ix >= len(self.seqs):
+            upto = self.head
+
+        return {"kind": "snapshot" if restart else "delta", "seq": upto, "head": self.head, "floor": self.floor,
+                "cols": to_columns(page)}
+
+
+def squash_changes(changes, present):
+    """Only the last change of every note: (added notes, {uid: changed note}, deleted uids).
+
+    changes as returned by NotesReplica; present(uid) tells if a note is in the local layer.
+    """
+    last = {}
+    for kind, note in changes:
+        last[note["uid"]] = (kind, note)
+
+    added, changed, deleted = [], {}, []
+    for uid, (kind, note) in last.items():
+        if kind == "delete":
+            deleted.append(uid)
+        elif present(uid):
+            changed[uid] = note
+        else:
+            added.append(note)
+    return added, changed, deleted
+
+
+class NotesReplica:
+    """Client side counterpart of NotesRoomState.
+
+    Tracks the highest sequence number seen and the version of every note
+    present in the local notes layer, hence, notes contained in a snapshot as
+    well as in a live message are only added once and older changes of a
+    note are dropped. Local updates and deletes are versioned with a lamport
+    clock and sid, the sid this client got when it joined; it is kept across
+    reconnects, hence, their echo from the server is recognised by uid and
+    version and skipped. Own messages without echo (e.g. lost with a dropped
+    connection) are sent again with resend. Deleted notes are kept as
+    tombstones until the server compacted them (floor of notes_state).
+    """
+
+    def __init__(self, now=time.monotonic):
+        self.now = now
+        self.reset()
+
+    def reset(self):
+        self.seq = -1
+        self.floor = 0
+        self.acked = -1
+        self.clock = 0
+        self.versions = {}      #uid: version of the notes present or deleted
+        self.deleted = {}       #uid: seq of the tombstones; None for own deletes not echoed yet
+        self.pending = {}       #uid: version of own adds and changes not echoed yet
+        self.unechoed = {}      #uid: [time sent, [(event, msg), ...]] of the pending changes
+        self.snapshot = None    #uids of a snapshot being received page by page
+        self.sid = None         #sid of this client when it joined; the second part of the own versions
+
+    def add_local(self, uid):
+        self.versions[uid] = self.pending[uid] = (0, "")
+
+    def change_local(self, uid, deleted=False):
+        """Version a local update or delete of a note; returns its lamport clock."""
+        self.clock += 1
+        self.versions[uid] = self.pending[uid] = (self.clock, self.sid or "")
+        if deleted:
+            self.deleted[uid] = None
+        else:
+            self.deleted.pop(uid, None)
+        return self.clock
+
+    def sent(self, uid, event, msg):
+        """Keep a message of an own add or change until its echo arrives."""
+        if uid not in self.pending:
+            return
+        entry = self.unechoed.setdefault(uid, [None, []])
+        entry[0] = self.now()
+        entry[1].append((event, msg))
+
+    def resend(self, timeout=10.0):
+        """Messages of own changes without echo for timeout seconds as [(event, msg), ...].
+
+        The server ignores adds and changes it already has, hence, sending
+        them again is safe. Every change ends up echoed or superseded by a
+        newer one of another user; giving it up instead would leave this
+        client with a note nobody else has.
+        """
+        now = self.now()
+        msgs = []
+        for entry in self.unechoed.values():
+            if now - entry[0] >= timeout:
+                entry[0] = now
+                msgs.extend(entry[1])
+        return msgs
+
+    def _settle(self, uid):
+        self.pending.pop(uid, None)
+        self.unechoed.pop(uid, None)
+
+    def merge(self, note):
+        """Merge a note of the server; returns "add", "update", "delete" or None if nothing changes locally."""
+        seq = note.get("seq")
+        if seq is not None and seq > self.seq:
+            self.seq = seq
+        uid = note["uid"]
+        ver = (note.get("clock") or 0, note.get("sid") or "")
+        if ver[0] > self.clock:
+            self.clock = ver[0]
+        if self.snapshot is not None:
+            self.snapshot.add(uid)
+
+        known = self.versions.get(uid)
+        if known is None:
+            #neither present nor pending
+            self.versions[uid] = ver
+            if note.get("deleted"):
+                self.deleted[uid] = seq
+                return None
+            return "add"
+        if self.pending.get(uid) == ver:
+            #echo of an own change
+            self._settle(uid)
+            if uid in self.deleted:
+                self.deleted[uid] = seq
+            return None
+        if ver <= known:
+            return None
+
+        present = uid not in self.deleted
+        self.versions[uid] = ver
+        self._settle(uid)
+        if note.get("deleted"):
+            self.deleted[uid] = seq
+            return "delete" if present else None
+        self.deleted.pop(uid, None)
+        return "update" if present else "add"
+
+    def accept(self, feats):
+        """Merge live notes; returns the changes to apply locally as [(kind, note), ...]."""
+        ops = []
+        for feat in feats:
+            #replayed change of a note whose tombstone is compacted already
+            if feat["uid"] not in self.versions and feat.get("seq") is not None and feat["seq"] <= self.floor:
+                continue
+            kind = self.merge(feat)
+            if kind is not None:
+                ops.append((kind, feat))
+        return ops
+
+    def sync_msg(self, after=None):
+        """Arguments of notes_sync for the next page after "after" or, by default, for all changes after seq."""
+        if after is None:
+            return {"seq": self.seq, "snapshot": False}
+        return {"seq": after, "snapshot": self.snapshot is not None}
+
+    def accept_state(self, msg):
+        """Handle a notes_state message; returns (changes as in accept, next_after or None if complete).
+
+        After the last page of a snapshot, notes which are neither part of it
+        nor pending locally are deleted; their tombstones were compacted.
+        """
+        if msg["kind"] == "snapshot":
+            self.snapshot = set()
+        ops = []
+        for feat in from_columns(msg["cols"]):
+            kind = self.merge(feat)
+            if kind is not None:
+                ops.append((kind, feat))
+        if msg["seq"] > self.seq:
+            self.seq = msg["seq"]
+        if msg["seq"] < msg["head"]:
+            return ops, msg["seq"]
+
+        if self.snapshot is not None:
+            gone = [uid for uid in self.versions
+                    if uid not in self.snapshot and uid not in self.deleted and uid not in self.pending]
+            for uid in gone:
+                del self.versions[uid]
+                ops.append(("delete", {"uid": uid}))
+            self.snapshot = None
+        self.compact(msg.get("floor", 0))
+        return ops, None
+
+    def compact(self, floor):
+        """Drop the tombstones the server compacted."""
+        self.floor = max(self.floor, floor)
+        uids = [uid for uid, seq in self.deleted.items() if seq is not None and seq <= self.floor]
+        for uid in uids:
+            del self.deleted[uid]
+            del self.versions[uid]
+
+    def take_ack(self):
+        """Sequence number to acknowledge with notes_ack; None if it did not advance.
+
+        Nothing is acknowledged while own changes are on their way, the server
+        must not compact the tombstone of a note they may restore.
+        """
+        if self.seq <= self.acked or self.pending:
+            return None
+        self.acked = self.seq
+        return self.seq
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+import threading
+import time
+from collections import deque
+
+DROP_OLDEST = "drop_oldest"
+DROP_NEWEST = "drop_newest"
+
+
+class Outbox:
+    """Bounded, thread safe queue of outbound messages.
+
+    Producers never block. Messages with a coalesce key (e.g. "set_extent")
+    replace a still queued message with the same key, hence, only the newest
+    one is sent. If the queue is full the drop policy decides which message
+    is lost: DROP_OLDEST removes the oldest droppable message, DROP_NEWEST
+    rejects the new one. Essential messages (notes, session control, streams)
+    are never dropped in favour of others, but at most essential_max of them
+    are queued; beyond that a new one is rejected and counted in overflowed,
+    the producer has to repair the loss (e.g. with a resync). Forced items
+    (connection commands) are never rejected.
+
+    :param maxlen: Maximum number of queued droppable messages.
+    :param policy: DROP_OLDEST or DROP_NEWEST.
+    :param high_water: Fraction of maxlen above which pressure() is True;
+        producers may use it to reduce their rate.
+    :param essential_max: Maximum number of queued essential messages
+        (None: unlimited).
+    """
+
+    def __init__(self, maxlen=500, policy=DROP_OLDEST, high_water=0.8, essential_max=None):
+        self.maxlen = maxlen
+        self.policy = policy
+        self.high_water = high_water
+        self.essential_max = essential_max
+
+        self._cond = threading.Condition()
+        self._queue = deque()       #entries: [item, coalesce key, essential]
+        self._keys = {}
+        self._droppable = 0
+
+        self.dropped = 0
+        self.coalesced = 0
+        self.overflowed = 0
+
+    def put(self, item, coalesce=None, essential=False, force=False):
+        """Queue item; returns False if it was rejected by the drop policy or the essential limit."""
+        essential = essential or force
+        with self._cond:
+            if coalesce is not None and coalesce in self._keys:
+                self._keys[coalesce][0] = item
+                self.coalesced += 1
+                return True
+
+            if not essential and self._droppable >= self.maxlen:
+                if self.policy == DROP_NEWEST or not self._drop_oldest():
+                    self.dropped += 1
+                    return False
+            if essential and not force and self.essential_max is not None and len(self._queue) - self._droppable >= self.essential_max:
+                self.overflowed += 1
+                return False
+
+            entry = [item, coalesce, essential]
+            self._queue.append(entry)
+            if coalesce is not None:
+                self._keys[coalesce] = entry
+            if not essential:
+                self._droppable += 1
+
+            self._cond.notify()
+            return True
+
+    def _drop_oldest(self):
+        for ix, entry in enumerate(self._queue):
+            if not entry[2]:
+                del self._queue[ix]
+                self._forget(entry)
+                self.dropped += 1
+                return True
+        return False
+
+    def _forget(self, entry):
+        if entry[1] is not None and self._keys.get(entry[1]) is entry:
+            del self._keys[entry[1]]
+        if not entry[2]:
+            self._droppable -= 1
+
+    def get(self, timeout=None):
+        """Return the next item; blocks up to timeout seconds and returns None if empty."""
+        with self._cond:
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while not self._queue:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return None
+                self._cond.wait(remaining)
+
+            entry = self._queue.popleft()
+            self._forget(entry)
+            return entry[0]
+
+    def clear(self):
+        with self._cond:
+            self._queue.clear()
+            self._keys.clear()
+            self._droppable = 0
+
+    def pressure(self):
+        with self._cond:
+            return self._droppable >= self.high_water * self.maxlen
+
+    def __len__(self):
+        with self._cond:
+            return len(self._queue)
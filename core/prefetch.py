@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+import math
+import time
+from collections import OrderedDict, deque
+
+
+class ExtentPredictor:
+    """Guess the next extents of the host from its recent extent messages.
+
+    Center and scale are extrapolated from the oldest and newest of the
+    last history messages: the center linearly, the scale with a constant
+    zoom rate. predict() returns steps extents spread over horizon seconds
+    from now. Nothing is predicted if the host stopped moving (a settled
+    message or no message within horizon) or barely moves.
+    """
+
+    def __init__(self, history=4, horizon=1.0, steps=2, clock=time.monotonic):
+        self.horizon = horizon
+        self.steps = steps
+        self.clock = clock
+        self._track = deque(maxlen=max(2, history))
+
+    def reset(self):
+        self._track.clear()
+
+    def observe(self, cx, cy, zoom, settled=False, now=None):
+        now = self.clock() if now is None else now
+        if settled:
+            self._track.clear()
+        self._track.append((now, cx, cy, zoom))
+
+    def predict(self, now=None, min_shift=0.0):
+        """List of (cx, cy, zoom); min_shift is the least center shift (map units) worth predicting."""
+        now = self.clock() if now is None else now
+        if len(self._track) < 2:
+            return []
+        t0, x0, y0, z0 = self._track[0]
+        t1, x1, y1, z1 = self._track[-1]
+        dt = t1 - t0
+        if dt <= 0 or now - t1 > self.horizon or z0 <= 0 or z1 <= 0:
+            return []
+
+        vx, vy = (x1 - x0) / dt, (y1 - y0) / dt
+        zoom_rate = math.log(z1 / z0) / dt
+        step = self.horizon / self.steps
+
+        preds = []
+        for k in range(1, self.steps + 1):
+            ahead = now - t1 + k * step
+            cx, cy = x1 + vx * ahead, y1 + vy * ahead
+            zoom = z1 * math.exp(zoom_rate * ahead)
+            if math.hypot(cx - x1, cy - y1) < min_shift and abs(math.log(zoom / z1)) < 0.05:
+                continue
+            preds.append((cx, cy, zoom))
+        return preds
+
+
+class PrefetchPlanner:
+    """Decide which predicted extents to fetch within a budget.
+
+    Predictions are keyed by a grid of cell map units and binary zoom
+    steps; extents that fall into the same cell are fetched once. At most
+    max_jobs fetches run at the same time, fetches no longer predicted are
+    cancelled and keys fetched recently are skipped.
+    """
+
+    def __init__(self, max_jobs=2, remember=64):
+        self.max_jobs = max_jobs
+        self._done = OrderedDict()
+        self._remember = remember
+
+    def key(self, pred, cell):
+        cx, cy, zoom = pred
+        return (round(cx / cell), round(cy / cell), round(math.log2(zoom) * 2))
+
+    def plan(self, preds, running, cell):
+        """Return (start, cancel): [(key, pred), ...] to start and the running keys to cancel."""
+        wanted = OrderedDict()
+        for pred in preds:
+            key = self.key(pred, cell)
+            if key not in self._done and key not in wanted:
+                wanted[key] = pred
+            if len(wanted) == self.max_jobs:
+                break
+
+        cancel = [key for key in running if key not in wanted]
+        free = self.max_jobs - (len(running) - len(cancel))
+        start = [(key, pred) for key, pred in wanted.items() if key not in running][:max(0, free)]
+        return start, cancel
+
+    def done(self, key):
+        self._done[key] = True
+        self._done.move_to_end(key)
+        while len(self._done) > self._remember:
+            self._done.popitem(last=False)
+
+    def reset(self):
+        self._done.clear()
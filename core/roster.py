@@ -0,0 +1,95 @@
+# -*- coding: utf-8 -*-
+
+
+class Roster:
+    """Users of a meeting by sid with a version of the host.
+
+    Users are kept in a list together with the row of every sid; adding and
+    removing are O(1): a removed user is replaced by the last one (swap
+    remove), hence, only the row of the moved user changes.
+
+    The host owns the roster: every change gets the next version and is
+    sent to the room as user_joined / user_left, the full roster (snapshot)
+    only goes to a new user. Replicas apply an event only if its version
+    directly follows their own; until their first snapshot (ver None) or
+    after a gap they need a snapshot, which is requested once at a time.
+    """
+
+    def __init__(self, ver=None):
+        self.reset(ver)
+
+    def reset(self, ver=None):
+        self.ver = ver
+        self.sync_pending = False
+        self.sids = []
+        self.names = {}
+        self.rows = {}
+
+    @property
+    def users(self):
+        return {sid: self.names[sid] for sid in self.sids}
+
+    def add(self, sid, name):
+        """Append a user; returns its row or None if the sid is already known."""
+        if sid in self.rows:
+            return None
+        self.rows[sid] = len(self.sids)
+        self.sids.append(sid)
+        self.names[sid] = name
+        return self.rows[sid]
+
+    def remove(self, sid):
+        """Remove a user; returns (row, sid moved into the row or None) or None if the sid is unknown."""
+        row = self.rows.pop(sid, None)
+        if row is None:
+            return None
+        del self.names[sid]
+        last = self.sids.pop()
+        if last == sid:
+            return row, None
+        self.sids[row] = last
+        self.rows[last] = row
+        return row, last
+
+    def want_sync(self, force=False):
+        """True if a snapshot is to be requested; False while one is on its way.
+
+        With force it is requested again anyway, e.g. if the request may have been lost.
+        """
+        if self.sync_pending and not force:
+            return False
+        self.sync_pending = True
+        return True
+
+    def next_ver(self):
+        #host only
+        self.ver = (self.ver or 0) + 1
+        return self.ver
+
+    def accept(self, data):
+        """Check a user_joined / user_left of the host: "apply", "skip" or "sync" (a full roster is needed).
+
+        On "apply" the version is taken over and the caller adds or removes the user.
+        Until the first snapshot (ver None) events are skipped as it is on its way.
+        """
+        state = self.follows(data["ver"])
+        if state == "gap":
+            return "skip" if self.ver is None else "sync"
+        if state == "dup":
+            return "skip"
+        self.ver = data["ver"]
+        return "apply"
+
+    def follows(self, ver):
+        """Return "ok" if an event of version ver is the next one, "dup" if it is known and "gap" otherwise."""
+        if self.ver is None or ver > self.ver + 1:
+            return "gap"
+        if ver <= self.ver:
+            return "dup"
+        return "ok"
+
+    def __contains__(self, sid):
+        return sid in self.rows
+
+    def __len__(self):
+        return len(self.sids)
@@ -0,0 +1,209 @@
+# -*- coding: utf-8 -*-
+"""Live strokes: notes streamed to the other users while they are drawn.
+
+A stroke is a line or polygon being sketched. The user drawing it sends
+stroke_begin with the first vertex, stroke_append with the vertices added
+since the last message and stroke_end once it is done; the finished stroke
+is sent as a regular note (feat_batch) with the same uid afterwards and
+replaces the preview. Stroke messages are not journaled, a missed one only
+affects the preview.
+"""
+import time
+
+from .messages import stroke_append_msg, stroke_begin_msg, stroke_end_msg
+
+#timers only have millisecond resolution; polls that fire slightly early still count
+_TOLERANCE = 0.001
+
+
+def simplify(points, tolerance):
+    """Douglas-Peucker simplification of a polyline [(x, y), ...]; the first and last point are always kept.
+
+    Vertices closer than tolerance (map units) to the simplified line are
+    dropped. Iterative, hence, long freehand strokes do not hit the recursion
+    limit.
+    """
+    count = len(points)
+    if count < 3 or tolerance <= 0:
+        return list(points)
+
+    keep = [False] * count
+    keep[0] = keep[-1] = True
+    tol2 = tolerance * tolerance
+    stack = [(0, count - 1)]
+    while stack:
+        first, last = stack.pop()
+        x1, y1 = points[first]
+        dx, dy = points[last][0] - x1, points[last][1] - y1
+        seg2 = dx * dx + dy * dy
+        max_d2, max_ix = tol2, None
+        for ix in range(first + 1, last):
+            px, py = points[ix][0] - x1, points[ix][1] - y1
+            t = 0.0 if seg2 == 0 else min(1.0, max(0.0, (px * dx + py * dy) / seg2))
+            ex, ey = t * dx - px, t * dy - py
+            d2 = ex * ex + ey * ey
+            if d2 > max_d2:
+                max_d2, max_ix = d2, ix
+        if max_ix is not None:
+            keep[max_ix] = True
+            stack.append((first, max_ix))
+            stack.append((max_ix, last))
+    return [pnt for pnt, kept in zip(points, keep) if kept]
+
+
+class StrokeSender:
+    """Rate limited, incremental sender of the stroke being drawn locally.
+
+    Input points are collected with add(). At most max_hz times per second
+    the points after the last sent vertex are simplified (Douglas-Peucker at
+    the tolerance given with the points, e.g. a few pixels at the current
+    map scale) and sent as stroke_append together with the index of the
+    first new vertex. Sent vertices never change, hence, the other users only
+    append and the traffic only depends on the simplified length.
+
+    :param send: Callable receiving (event, message dict).
+    :param max_hz: Maximum number of stroke_append messages per second.
+    :param digits: Decimal places of the sent coordinates; None keeps them as they are.
+    """
+
+    def __init__(self, send, max_hz=10.0, digits=None, clock=time.monotonic):
+        self.send = send
+        self.min_interval = 1.0 / max_hz if max_hz > 0 else 0.0
+        self.digits = digits
+        self.clock = clock
+        self.reset()
+
+    def reset(self):
+        self.uid = None
+        self.vertices = []      #sent vertices
+        self.tail = []          #input points since the last sent vertex; starts with it
+        self.tolerance = 0.0
+        self.last_send_time = None
+
+    @property
+    def active(self):
+        return self.uid is not None
+
+    def _round(self, pnt):
+        if self.digits is None:
+            return pnt
+        return round(pnt[0], self.digits), round(pnt[1], self.digits)
+
+    def begin(self, uid, user, kind, x, y):
+        self.reset()
+        self.uid = uid
+        first = self._round((x, y))
+        self.vertices = [first]
+        self.tail = [first]
+        self.send("stroke_begin", stroke_begin_msg(uid, user, kind, [first]))
+
+    def add(self, x, y, tolerance=0.0):
+        """Add an input point; returns seconds until poll() must be called or None."""
+        if not self.active:
+            return None
+        pnt = self._round((x, y))
+        if pnt == self.tail[-1]:
+            return None
+        self.tail.append(pnt)
+        self.tolerance = tolerance
+        return self.poll()
+
+    def poll(self, now=None):
+        """Send the pending vertices if the rate limit allows it; returns seconds until the next poll or None."""
+        if not self.active or len(self.tail) < 2:
+            return None
+        if now is None:
+            now = self.clock()
+        if self.last_send_time is not None:
+            wait = self.min_interval - (now - self.last_send_time)
+            if wait > _TOLERANCE:
+                return wait
+        self._send(now)
+        return None
+
+    def _send(self, now):
+        new = simplify(self.tail, self.tolerance)[1:]
+        start = len(self.vertices)
+        self.vertices.extend(new)
+        self.tail = [self.vertices[-1]]
+        self.last_send_time = now
+        self.send("stroke_append", stroke_append_msg(self.uid, start, new))
+
+    def end(self, min_vertices=1):
+        """Send the remaining vertices and stroke_end; returns all vertices of the stroke.
+
+        Strokes with less than min_vertices vertices are dropped (empty list).
+        """
+        if not self.active:
+            return []
+        if len(self.tail) > 1:
+            self._send(self.clock())
+        vertices = self.vertices if len(self.vertices) >= min_vertices else []
+        self.send("stroke_end", stroke_end_msg(self.uid, kept=bool(vertices)))
+        self.reset()
+        return vertices
+
+    def cancel(self):
+        if self.active:
+            self.send("stroke_end", stroke_end_msg(self.uid, kept=False))
+        self.reset()
+
+
+class StrokeView:
+    """Strokes of the other users currently being drawn, by uid.
+
+    begin/append/end return what changed for the preview. Vertices are
+    appended in the order of their index; vertices already known (e.g. sent
+    twice) are skipped, after a missed stroke_append the stroke simply
+    continues with the next vertices. Strokes without any message (or their
+    note) for idle seconds are dropped by expire(), e.g. if the stroke_end
+    was missed during an outage.
+    """
+
+    def __init__(self, idle=60.0, clock=time.monotonic):
+        self.idle = idle
+        self.clock = clock
+        self.strokes = {}
+
+    def begin(self, msg):
+        stroke = {"user": msg.get("user"), "kind": msg.get("kind"), "sid": msg.get("sid"),
+                  "pts": list(zip(msg["xy"][0::2], msg["xy"][1::2])), "seen": self.clock()}
+        self.strokes[msg["uid"]] = stroke
+        return stroke
+
+    def append(self, msg):
+        """New vertices of a known stroke; None for strokes which began before this user joined."""
+        stroke = self.strokes.get(msg["uid"])
+        if stroke is None:
+            return None
+        stroke["seen"] = self.clock()
+        pts = list(zip(msg["xy"][0::2], msg["xy"][1::2]))
+        known = len(stroke["pts"]) - msg["from"]
+        if known > 0:
+            pts = pts[known:]
+        stroke["pts"].extend(pts)
+        return pts
+
+    def end(self, uid):
+        return self.strokes.pop(uid, None)
+
+    def kept(self, uid):
+        #a finished stroke waits for its note; the wait counts from its end
+        stroke = self.strokes.get(uid)
+        if stroke is not None:
+            stroke["seen"] = self.clock()
+
+    def expire(self, now=None):
+        """Drop the strokes idle for longer than idle seconds; returns their uids."""
+        now = self.clock() if now is None else now
+        uids = [uid for uid, stroke in self.strokes.items() if now - stroke["seen"] > self.idle]
+        for uid in uids:
+            del self.strokes[uid]
+        return uids
+
+    def end_of(self, sid):
+        """Drop the strokes of a user who left; returns their uids."""
+        uids = [uid for uid, stroke in self.strokes.items() if stroke["sid"] == sid]
+        for uid in uids:
+            del self.strokes[uid]
+        return uids
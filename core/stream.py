@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+import json
+import struct
+import time
+import zlib
+from collections import OrderedDict
+
+_LEN = struct.Struct("<I")
+
+
+def pack_rows(rows, max_bytes):
+    """Compress a prefix of rows into one chunk of at most max_bytes (before compression).
+
+    A row is (attributes, wkb) with a list of json values and the geometry as
+    bytes, or None for a feature which no longer exists; it is skipped. At
+    least one row is packed (unless rows run out), even if it exceeds
+    max_bytes. Returns (payload, number of used rows including the skipped).
+    """
+    attrs, geoms, size, used = [], [], 0, 0
+    for row in rows:
+        if row is not None:
+            attr_json = json.dumps(row[0], separators=(",", ":"))
+            row_size = len(attr_json) + len(row[1]) + 8
+            if attrs and size + row_size > max_bytes:
+                break
+            attrs.append(attr_json)
+            geoms.append(row[1])
+            size += row_size
+        used += 1
+
+    attr_bytes = ("[" + ",".join(attrs) + "]").encode("utf-8")
+    parts = [_LEN.pack(len(attr_bytes)), attr_bytes]
+    for wkb in geoms:
+        parts.append(_LEN.pack(len(wkb)))
+        parts.append(wkb)
+    return zlib.compress(b"".join(parts), 6), used
+
+
+def unpack_rows(payload):
+    data = zlib.decompress(payload)
+    attr_len = _LEN.unpack_from(data, 0)[0]
+    attrs = json.loads(data[4:4 + attr_len].decode("utf-8"))
+
+    rows, pos = [], 4 + attr_len
+    for attr in attrs:
+        wkb_len = _LEN.unpack_from(data, pos)[0]
+        rows.append((attr, data[pos + 4:pos + 4 + wkb_len]))
+        pos += 4 + wkb_len
+    return rows
+
+
+class StreamSender:
+    """Host side of a layer stream split into numbered chunks.
+
+    fetch(start, count) returns the rows start .. start + count of the layer
+    in a fixed order, None for features deleted in the meantime; these are
+    skipped, a chunk only ends the stream once all rows are used. Chunk
+    boundaries are recorded while the chunks are built, hence, every chunk
+    can be rebuilt for a resume without keeping the data; the last chunks
+    are cached as most receivers ask for the same.
+
+    Building a chunk reads the features: job() and store() run on the
+    thread using the sender, build() in between only calls fetch and may run
+    in a task (one at a time per sender), see next_sends(build=False).
+
+    Chunks are broadcast to all receivers which are in sync; the broadcast
+    runs at most window chunks ahead of the slowest of them. A receiver that
+    resumes after an interruption (or joins late) is served individually
+    until it caught up with the broadcast.
+    """
+
+    def __init__(self, fetch, total, max_bytes=256 * 1024, window=4, cache=16):
+        self.fetch = fetch
+        self.total = total
+        self.max_bytes = max_bytes
+        self.window = window
+        self.bounds = [0]
+        self.last = 0 if total == 0 else None
+        self.sent = -1
+        self.acked = {}
+        self.unicast = {}
+        self._cache = OrderedDict()
+        self._cache_size = cache
+        self._batch = 256
+        #first chunk next_sends(build=False) could not send as it is not built yet
+        self.wanted = None
+
+    def chunk(self, k):
+        """Return (payload, is_last) of chunk k, built if needed; all chunks before k must have been built."""
+        if k in self._cache:
+            self._cache.move_to_end(k)
+            return self._cache[k]
+        return self.store(k, *self.build(*self.job(k)))
+
+    def job(self, k):
+        """(start, count) of chunk k for build(); count is None if the chunk was never built."""
+        start = self.bounds[k]
+        if k + 1 < len(self.bounds):
+            return start, self.bounds[k + 1] - start
+        return start, None
+
+    def build(self, start, count=None):
+        """Read and pack the rows of a chunk; returns (payload, used rows) for store()."""
+        if count is not None:
+            #rebuild with exactly the rows the chunk had before
+            return pack_rows(self.fetch(start, count), float("inf"))
+        return pack_rows(self._rows(start), self.max_bytes)
+
+    def _rows(self, start):
+        #rows from start on, fetched in batches until the chunk is full; windows of deleted features are skipped
+        pos = start
+        while pos < self.total:
+            count = min(self._batch, self.total - pos)
+            for row in self.fetch(pos, count):
+                yield row
+            pos += count
+
+    def store(self, k, payload, used):
+        """Keep a chunk built with build(); returns (payload, is_last)."""
+        if k + 1 == len(self.bounds):
+            start = self.bounds[k]
+            self.bounds.append(start + used)
+            #fetch a bit more than fits next time; the rest of a fetch is wasted
+            self._batch = max(1, int(used * 1.2) + 1)
+            if start + used >= self.total:
+                self.last = k
+
+        entry = (payload, k == self.last)
+        self._cache[k] = entry
+        if len(self._cache) > self._cache_size:
+            self._cache.popitem(last=False)
+        return entry
+
+    def add_receiver(self, rid, after=-1, stalled=False):
+        """Register a receiver which holds the chunks up to after (-1: none yet).
+
+        A receiver which is already served individually keeps its position,
+        the chunks up to it are on the way; only a stalled receiver is
+        rewound to after.
+        """
+        self.acked[rid] = after
+        if after >= self.sent:
+            self.unicast.pop(rid, None)
+        elif rid in self.unicast and not stalled:
+            self.unicast[rid] = max(self.unicast[rid], after + 1)
+        else:
+            self.unicast[rid] = after + 1
+
+    def remove_receiver(self, rid):
+        self.acked.pop(rid, None)
+        self.unicast.pop(rid, None)
+
+    def ack(self, rid, k):
+        if rid in self.acked:
+            self.acked[rid] = max(self.acked[rid], k)
+
+    def complete(self):
+        return self.last is not None and all(k >= self.last for k in self.acked.values())
+
+    def next_sends(self, limit=None, build=True):
+        """Chunks to send now as [(k, rid), ...]; rid None means broadcast.
+
+        limit caps the number of chunks per call, e.g. to build one chunk per
+        event loop pass; call again until it returns nothing. Without build
+        only chunks which are built already are returned; the first missing
+        one is noted in wanted and has to be built before calling again.
+        """
+        limit = float("inf") if limit is None else limit
+        self.wanted = None
+        sends = []
+        for rid, nxt in list(self.unicast.items()):
+            while nxt <= self.sent and nxt <= self.acked[rid] + self.window and len(sends) < limit:
+                if not self._ready(nxt, build):
+                    break
+                sends.append((nxt, rid))
+                nxt += 1
+            if nxt > self.sent:
+                del self.unicast[rid]
+            else:
+                self.unicast[rid] = nxt
+
+        in_sync = [k for rid, k in self.acked.items() if rid not in self.unicast]
+        if in_sync:
+            floor = min(in_sync)
+            #the next chunk is built before it is sent; its end tells whether it is the last one
+            while (self.last is None or self.sent < self.last) and self.sent + 1 <= floor + self.window and len(sends) < limit:
+                if not self._ready(self.sent + 1, build):
+                    break
+                self.sent += 1
+                sends.append((self.sent, None))
+        return sends
+
+    def _ready(self, k, build):
+        if k in self._cache:
+            return True
+        if build:
+            self.chunk(k)
+            return True
+        if self.wanted is None:
+            self.wanted = k
+        return False
+
+
+class StreamReceiver:
+    """Participant side of a layer stream; chunks are applied in order only.
+
+    After a resume request the receiver is served individually until it
+    caught up; broadcast chunks ahead of it are expected meanwhile and are
+    no reason to resume again.
+    """
+
+    def __init__(self, clock=time.monotonic):
+        self.clock = clock
+        self.acked = -1
+        self.done = False
+        self.resuming = False
+        self.last_seen = clock()
+
+    def resume(self):
+        """Note a resume request; returns the chunk the transfer continues after."""
+        self.resuming = True
+        self.last_seen = self.clock()
+        return self.acked
+
+    def accept(self, k, last, broadcast=False):
+        """Return "ok" if chunk k is the next one, "dup" for old chunks and "gap" if chunks are missing.
+
+        Broadcast chunks ahead of a receiver which is resuming return "wait".
+        """
+        self.last_seen = self.clock()
+        if k <= self.acked:
+            return "dup"
+        if k > self.acked + 1:
+            return "wait" if broadcast and self.resuming else "gap"
+        self.acked = k
+        self.done = bool(last)
+        if broadcast or self.done:
+            self.resuming = False
+        return "ok"
+
+    def stalled(self, timeout, now=None):
+        now = self.clock() if now is None else now
+        return not self.done and now - self.last_seen > timeout
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+import threading
+
+from qgis.core import QgsCoordinateReferenceSystem
+
+from .core.messages import wkt_ref
+
+#process wide: reference (authority id or wkt hash) -> QgsCoordinateReferenceSystem; a crs
+#is parsed only once no matter how often it is sent or compared
+_cache = {}
+_lock = threading.Lock()
+#the last custom crs asked for its reference and the reference; usually the project crs
+_last = [None, None]
+
+
+def _portable(authid):
+    #ids of user defined crs (USER:100000) only exist in the local crs database
+    return bool(authid) and not authid.upper().startswith("USER:")
+
+
+def crs_ref(crs):
+    """Short reference of a crs: its authority id (e.g. EPSG:31256) or, for custom crs, a hash of the wkt."""
+    authid = crs.authid()
+    if _portable(authid):
+        ref = authid
+    else:
+        #the wkt of custom crs is only exported once for the last one
+        with _lock:
+            if _last[0] is not None and _last[0] == crs:
+                return _last[1]
+        ref = wkt_ref(crs.toWkt())
+        with _lock:
+            _last[0], _last[1] = crs, ref
+    with _lock:
+        _cache.setdefault(ref, crs)
+    return ref
+
+
+def crs_from_ref(ref, wkt=None):
+    """Crs of a reference; None if it is neither cached nor an authority id and no (matching) wkt is given."""
+    with _lock:
+        crs = _cache.get(ref)
+    if crs is not None:
+        return crs
+    if wkt is not None and wkt_ref(wkt) == ref:
+        crs = QgsCoordinateReferenceSystem.fromWkt(wkt)
+    elif not ref.startswith("wkt:"):
+        crs = QgsCoordinateReferenceSystem(ref)
+    if crs is None or not crs.isValid():
+        return None
+    with _lock:
+        return _cache.setdefault(ref, crs)
+
+
+def is_crs(crs, ref, wkt=None):
+    """True if ref (and wkt) of a crs message describe crs.
+
+    Hosts of older versions send the wkt only, its wkt_ref never equals the
+    authority id of crs_ref; the parsed (and cached) crs is compared by its
+    authority id instead, or by the wkt if it has none.
+    """
+    if crs_ref(crs) == ref:
+        return True
+    if wkt is None or not ref.startswith("wkt:"):
+        return False
+    other = crs_from_ref(ref, wkt)
+    if other is not None and _portable(other.authid()):
+        return other.authid() == crs.authid()
+    return wkt == crs.toWkt()
@@ -0,0 +1,55 @@
+# -*- coding: utf-8 -*-
+from qgis.core import QgsGeometry, QgsPointXY, QgsRectangle, QgsWkbTypes
+
+from .core.geom_codec import RECT, POINT, LINE, POLYGON, get_codec
+
+
+def geom_to_parts(geom):
+    """Convert a single part QgsGeometry into the neutral (kind, parts) form of the codecs."""
+    geom_type = QgsWkbTypes.geometryType(geom.wkbType())
+    if geom_type == QgsWkbTypes.PointGeometry:
+        pnt = geom.asMultiPoint()[0] if geom.isMultipart() else geom.asPoint()
+        return POINT, [[(pnt.x(), pnt.y())]]
+    if geom_type == QgsWkbTypes.LineGeometry:
+        line = geom.asMultiPolyline()[0] if geom.isMultipart() else geom.asPolyline()
+        return LINE, [[(pnt.x(), pnt.y()) for pnt in line]]
+    poly = geom.asMultiPolygon()[0] if geom.isMultipart() else geom.asPolygon()
+    return POLYGON, [[(pnt.x(), pnt.y()) for pnt in ring] for ring in poly]
+
+
+def parts_to_geom(kind, parts):
+    if kind == RECT:
+        (xmin, ymin), (xmax, ymax) = parts[0]
+        return QgsGeometry.fromRect(QgsRectangle(xmin, ymin, xmax, ymax))
+    if kind == POINT:
+        return QgsGeometry.fromPointXY(QgsPointXY(*parts[0][0]))
+    if kind == LINE:
+        return QgsGeometry.fromPolylineXY([QgsPointXY(x, y) for x, y in parts[0]])
+    return QgsGeometry.fromPolygonXY([[QgsPointXY(x, y) for x, y in ring] for ring in parts])
+
+
+def encode_geom(geom, codec_name="wkt", res=None, rect=None):
+    """Encode a geometry for sending; rectangles (rect) are sent as four numbers if the codec supports it."""
+    #wkt and wkb are directly provided by QGIS which is considerably faster
+    if codec_name == "wkt":
+        return rect.asWktPolygon() if rect is not None else geom.asWkt()
+    if codec_name == "wkb":
+        return bytes(geom.asWkb())
+
+    codec = get_codec(codec_name)
+    if rect is not None:
+        return codec.encode(RECT, [[(rect.xMinimum(), rect.yMinimum()), (rect.xMaximum(), rect.yMaximum())]], res)
+    kind, parts = geom_to_parts(geom)
+    return codec.encode(kind, parts, res)
+
+
+def decode_geom(payload, codec_name=None, res=None):
+    if codec_name is None or codec_name == "wkt":
+        return QgsGeometry.fromWkt(payload)
+    if codec_name == "wkb":
+        geom = QgsGeometry()
+        geom.fromWkb(bytes(payload))
+        return geom
+
+    kind, parts = get_codec(codec_name).decode(payload, res)
+    return parts_to_geom(kind, parts)
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsFeature, QgsFeatureRequest, QgsField, QgsGeometry, QgsVectorLayer, QgsVectorLayerFeatureSource,
+                       QgsWkbTypes)
+
+from .core.stream import StreamSender
+
+
+def is_streamable(lyr):
+    return isinstance(lyr, QgsVectorLayer) and lyr.isValid()
+
+
+def layer_info(lyr):
+    """Description of a local vector layer for lyrs_changed; the features follow as stream."""
+    return {"name":lyr.name(),
+            "kind":"vector",
+            "geom":QgsWkbTypes.displayString(lyr.wkbType()),
+            "crs":lyr.crs().authid() or lyr.crs().toWkt(),
+            "fields":[[field.name(), int(field.type())] for field in lyr.fields()],
+            "total":lyr.featureCount()}
+
+
+def _json_value(value):
+    if value is None or isinstance(value, (bool, int, float, str)):
+        return value
+    if isinstance(value, QVariant) and value.isNull():
+        return None
+    return str(value)
+
+
+def feature_source(lyr):
+    """Copy of the data source of lyr which may be read in a QgsTask; layers are only used on the gui thread."""
+    return QgsVectorLayerFeatureSource(lyr)
+
+
+def sorted_fids(source):
+    """Feature ids of a feature_source in ascending order; runs in a QgsTask for large layers."""
+    request = QgsFeatureRequest().setFlags(QgsFeatureRequest.NoGeometry).setNoAttributes()
+    return sorted(feat.id() for feat in source.getFeatures(request))
+
+
+def layer_sender(lyr, fids, max_bytes, window):
+    """StreamSender over the features fids (see sorted_fids) of lyr.
+
+    The features are read from a feature_source, hence, chunks may be built
+    in a QgsTask (one at a time).
+    """
+    source = feature_source(lyr)
+
+    def fetch(start, count):
+        ids = fids[start:start + count]
+        rows = {}
+        for feat in source.getFeatures(QgsFeatureRequest().setFilterFids(ids)):
+            geom = feat.geometry()
+            wkb = bytes(geom.asWkb()) if not geom.isNull() else b""
+            rows[feat.id()] = ([_json_value(value) for value in feat.attributes()], wkb)
+        #the provider does not guarantee the order of the requested ids; chunks must be reproducible.
+        #features deleted since the ids were collected are None
+        return [rows.get(fid) for fid in ids]
+
+    return StreamSender(fetch, len(fids), max_bytes=max_bytes, window=window)
+
+
+class StreamedLayer:
+    """Memory layer of a participant filled chunk by chunk from a layer stream.
+
+    Every chunk is added with a single provider call and the layer is
+    repainted, hence, the features show up while the rest is still on the
+    way.
+    """
+
+    def __init__(self, info):
+        lyr = QgsVectorLayer("%s?crs=%s&index=yes" % (info["geom"], info["crs"]), info["name"], "memory")
+        lyr.dataProvider().addAttributes([QgsField(name, QVariant.Type(type_id)) for name, type_id in info["fields"]])
+        lyr.updateFields()
+
+        self.layer = lyr
+        self.total = info.get("total", 0)
+
+    def add_rows(self, rows):
+        fields = self.layer.fields()
+        feats = []
+        for attrs, wkb in rows:
+            feat = QgsFeature(fields)
+            feat.setAttributes(attrs)
+            if wkb:
+                geom = QgsGeometry()
+                geom.fromWkb(wkb)
+                feat.setGeometry(geom)
+            feats.append(feat)
+
+        self.layer.dataProvider().addFeatures(feats)
+        self.layer.updateExtents()
+        self.layer.triggerRepaint()
@@ -0,0 +1,191 @@
+# -*- coding: utf-8 -*-
+from qgis.PyQt.QtCore import QThread, pyqtSignal
+from qgis.core import Qgis, QgsMessageLog
+
+from .connection import ConnectionManager
+from .core.outbox import Outbox, DROP_OLDEST
+
+#telemetry which is sent again anyway; the only messages which may be dropped when the queue is
+#full or the connection is down. session control, notes, user list and stream messages are essential,
+#so is stroke_end: without it the preview of the stroke stays on the screens of the others
+DROPPABLE_EVENTS = ("set_extent", "peer_stats", "peer_table", "clock_ping", "stroke_begin", "stroke_append")
+
+
+class NetworkWorker(QThread):
+    """Thread owning the Socket.IO connection.
+
+    All blocking network calls (connecting, attaching namespaces, emitting)
+    are executed on this thread in the order they were requested; the GUI
+    thread only queues them in a bounded Outbox and never waits. Results are
+    reported back with Qt signals.
+
+    Essential messages are bounded as well: at most essential_max of them
+    wait in the Outbox and at most held_max per namespace are held back
+    while it is not attached. If a limit is exceeded (a long outage or a
+    stalled connection) the messages of the namespace are discarded, no
+    further ones are held until it is attached again, and then overflowed
+    is emitted instead of sending the stale backlog; the plugin answers it
+    with a resync of the whole session state.
+    """
+
+    #disconnected, connecting, connected or failed
+    state_changed = pyqtSignal(str)
+    #namespace, True if attached sucessfully
+    attached = pyqtSignal(str, bool)
+    #namespace which lost essential messages; emitted once it is attached again
+    overflowed = pyqtSignal(str)
+
+    def __init__(self, sio, anchor="/schedule", maxlen=500, policy=DROP_OLDEST, held_max=2000, essential_max=2000, metrics=None, parent=None):
+        super(NetworkWorker, self).__init__(parent)
+        self.sio = sio
+        self.conn = ConnectionManager(sio, anchor=anchor)
+        self.outbox = Outbox(maxlen=maxlen, policy=policy, essential_max=essential_max)
+        self.state = "disconnected"
+        #essential messages of namespaces which are not attached (e.g. during an outage); network thread only
+        self.held = {}
+        self.held_max = held_max
+        #namespaces which lost essential messages; network thread only
+        self.lost = set()
+        #optional SyncMetrics counting the messages actually sent
+        self.metrics = metrics
+
+    def emit_msg(self, event, data, nspace, coalesce=None):
+        """Queue a message; returns False if it was dropped because the queue is full.
+
+        Messages with the same coalesce key and namespace replace each other
+        while they are queued. DROPPABLE_EVENTS are dropped when the queue is
+        full; all other messages are kept until their namespace is attached
+        again unless the essential limits are exceeded (see overflowed).
+        """
+        key = None if coalesce is None else (nspace, coalesce)
+        essential = event not in DROPPABLE_EVENTS
+        if self.outbox.put(("emit", event, data, nspace), coalesce=key, essential=essential):
+            return True
+        if essential:
+            self._command("lose", nspace)
+        return False
+
+    def prewarm(self, url, sio_path):
+        self._command("prewarm", url, sio_path)
+
+    def attach(self, nspace, url, sio_path, auth=None, headers=None):
+        self._command("attach", nspace, url, sio_path, auth, headers)
+
+    def detach(self, nspace):
+        self._command("detach", nspace)
+
+    def close(self):
+        self._command("close")
+
+    def stop(self, timeout=3000):
+        self._command("stop")
+        self.wait(timeout)
+
+    def report_state(self, state):
+        #may be called from any thread, e.g. the Socket.IO handlers
+        if state != self.state:
+            self.state = state
+            self.state_changed.emit(state)
+
+    def _command(self, *cmd):
+        #commands are never dropped or rejected
+        self.outbox.put(cmd, force=True)
+        if not self.isRunning() and cmd[0] != "stop":
+            self.start()
+
+    def run(self):
+        while True:
+            cmd = self.outbox.get()
+            if cmd[0] == "stop":
+                break
+            try:
+                getattr(self, "_do_" + cmd[0])(*cmd[1:])
+            except Exception as err:
+                QgsMessageLog.logMessage("Network error (%s): %s" % (cmd[0], err), "QollabEO", level=Qgis.Warning)
+                if not self.sio.connected:
+                    self.report_state("failed")
+
+    def _do_emit(self, event, data, nspace):
+        #while the namespace is not attached essential messages are held back, telemetry is dropped
+        if not self._is_attached(nspace):
+            if event in DROPPABLE_EVENTS or nspace in self.lost:
+                return
+            held = self.held.setdefault(nspace, [])
+            if len(held) >= self.held_max:
+                self._do_lose(nspace)
+            else:
+                held.append((event, data))
+            return
+        self._flush(nspace)
+        self._send(event, data, nspace)
+
+    def _is_attached(self, nspace):
+        return self.sio.connected and nspace in self.sio.namespaces
+
+    def _send(self, event, data, nspace):
+        self.sio.emit(event, data, namespace=nspace)
+        if self.metrics is not None:
+            self.metrics.sent(data)
+
+    def _do_lose(self, nspace):
+        #the backlog is incomplete now; it is discarded and replaced by a resync once attached
+        self.held.pop(nspace, None)
+        self.lost.add(nspace)
+        if self._is_attached(nspace):
+            self._flush(nspace)
+
+    def _flush(self, nspace):
+        #held messages go out in their original order before anything newer
+        if nspace in self.lost:
+            self.lost.discard(nspace)
+            self.overflowed.emit(nspace)
+            return
+        held = self.held.pop(nspace, [])
+        for ix, (event, data) in enumerate(held):
+            try:
+                self._send(event, data, nspace)
+            except Exception:
+                self.held[nspace] = held[ix:]
+                raise
+
+    def flush(self, nspace):
+        """Send the held messages of nspace, e.g. once Socket.IO reconnected it by itself."""
+        self._command("flush", nspace)
+
+    def _do_flush(self, nspace):
+        if self._is_attached(nspace):
+            self._flush(nspace)
+
+    def _do_prewarm(self, url, sio_path):
+        if self.conn.is_connected(url, sio_path):
+            return
+        self.report_state("connecting")
+        self.conn.connect(url, sio_path)
+        self.report_state("connected")
+
+    def _do_attach(self, nspace, url, sio_path, auth, headers):
+        ok = False
+        try:
+            if not self.conn.is_connected(url, sio_path):
+                self.report_state("connecting")
+            ok = self.conn.attach(nspace, url, sio_path, auth=auth, headers=headers)
+            if ok:
+                self._flush(nspace)
+            else:
+                self.held.pop(nspace, None)
+                self.lost.discard(nspace)
+        finally:
+            self.report_state("connected" if self.sio.connected else "failed")
+            self.attached.emit(nspace, ok)
+
+    def _do_detach(self, nspace):
+        #messages of a namespace which is left are never sent
+        self.held.pop(nspace, None)
+        self.lost.discard(nspace)
+        self.conn.detach(nspace)
+
+    def _do_close(self):
+        self.held.clear()
+        self.lost.clear()
+        self.conn.close()
+        self.report_state("disconnected")
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+from qgis.PyQt.QtCore import QVariant
+from qgis.core import (QgsVectorLayer, QgsField, QgsFeatureRequest, QgsRectangle, QgsWkbTypes, QgsLineSymbol,
+                       QgsMarkerSymbol, QgsSingleSymbolRenderer, QgsPalLayerSettings, QgsVectorLayerSimpleLabeling)
+
+
+class NotesLayer:
+    """Memory layer holding the notes of a meeting.
+
+    The memory provider keeps a spatial index (index=yes), hence, rendering and
+    hit testing only visit features intersecting the requested extent. In
+    addition the feature id of every note is stored by its uid which allows
+    looking up notes for updates, deletes or zooming in O(1).
+    """
+
+    def __init__(self, crs_wkt, style_path=None, geom_type="Polygon", name="notes", symbol=None):
+        lyr = QgsVectorLayer("%s?crs=%s&index=yes" % (geom_type, crs_wkt), name, "memory")
+        if style_path is not None:
+            lyr.loadNamedStyle(style_path)
+        elif symbol is not None:
+            #simple style with the name of the user as label; the qml style is made for polygons
+            lyr.setRenderer(QgsSingleSymbolRenderer(symbol))
+            labels = QgsPalLayerSettings()
+            labels.fieldName = "user"
+            lyr.setLabeling(QgsVectorLayerSimpleLabeling(labels))
+            lyr.setLabelsEnabled(True)
+        lyr_pro = lyr.dataProvider()
+        lyr_pro.addAttributes([QgsField("user", QVariant.String)])
+        lyr_pro.addAttributes([QgsField("uid", QVariant.String)])
+        lyr.updateFields()
+
+        self.layer = lyr
+        self.uid_ix = lyr.fields().indexOf("uid")
+        self.fids = {}
+
+    def fields(self):
+        return self.layer.fields()
+
+    def add_feats(self, feats):
+        """Add features with a single provider call; returns the added features."""
+        if len(feats) == 0:
+            return []
+
+        (res, out_feats) = self.layer.dataProvider().addFeatures(feats)
+        for feat in out_feats:
+            self.fids[feat.attribute(self.uid_ix)] = feat.id()
+
+        #no reload necessary; the memory provider already knows the new features
+        self.layer.updateExtents()
+        self.layer.triggerRepaint()
+        return out_feats
+
+    def change_geoms(self, geoms):
+        """Replace the geometries of notes ({uid: geometry}) with a single provider call; unknown uids are skipped."""
+        by_fid = {self.fids[uid]: geom for uid, geom in geoms.items() if uid in self.fids}
+        if len(by_fid) == 0:
+            return
+        self.layer.dataProvider().changeGeometryValues(by_fid)
+        self.layer.updateExtents()
+        self.layer.triggerRepaint()
+
+    def delete(self, uids):
+        """Delete notes by uid with a single provider call; unknown uids are skipped."""
+        fids = [self.fids.pop(uid) for uid in uids if uid in self.fids]
+        if len(fids) == 0:
+            return
+        self.layer.dataProvider().deleteFeatures(fids)
+        self.layer.updateExtents()
+        self.layer.triggerRepaint()
+
+    def has(self, uid):
+        return uid in self.fids
+
+    def fid(self, uid):
+        return self.fids.get(uid)
+
+    def feature(self, uid):
+        fid = self.fids.get(uid)
+        if fid is None:
+            return None
+        return self.layer.getFeature(fid)
+
+    def feats_in_rect(self, rect):
+        """Iterate over all notes intersecting rect (uses the spatial index)."""
+        request = QgsFeatureRequest().setFilterRect(rect)
+        return self.layer.getFeatures(request)
+
+    def feats_at(self, pnt, tolerance):
+        """Notes whose geometry is within tolerance map units of pnt; e.g. for hit testing."""
+        rect = QgsRectangle(pnt.x() - tolerance, pnt.y() - tolerance, pnt.x() + tolerance, pnt.y() + tolerance)
+        request = QgsFeatureRequest().setFilterRect(rect).setFlags(QgsFeatureRequest.ExactIntersect)
+        return list(self.layer.getFeatures(request))
+
+    def zoom_to(self, uid, canvas):
+        feat = self.feature(uid)
+        if feat is None or not feat.hasGeometry():
+            return False
+        canvas.setExtent(feat.geometry().boundingBox().buffered(feat.geometry().boundingBox().width() * 0.1))
+        canvas.refresh()
+        return True
+
+
+class NotesLayers:
+    """The notes of a meeting in one layer per geometry type: polygons (e.g.
+    rectangles), lines (sketches) and points (markers).
+
+    Offers the interface of NotesLayer used for adding, changing and deleting
+    notes: features are added to the layer matching their geometry and uids
+    are looked up in all layers. layer is the polygon layer which existed before the others.
+    """
+
+    def __init__(self, crs_wkt, style_path=None):
+        self.polygons = NotesLayer(crs_wkt, style_path=style_path)
+        self.lines = NotesLayer(crs_wkt, geom_type="LineString", name="sketches",
+                                symbol=QgsLineSymbol.createSimple({"line_color": "255,0,0", "line_width": "0.6"}))
+        self.points = NotesLayer(crs_wkt, geom_type="Point", name="markers",
+                                 symbol=QgsMarkerSymbol.createSimple({"color": "255,0,0", "size": "3"}))
+        self.by_type = {QgsWkbTypes.PolygonGeometry: self.polygons,
+                        QgsWkbTypes.LineGeometry: self.lines,
+                        QgsWkbTypes.PointGeometry: self.points}
+        self.layer = self.polygons.layer
+
+    def layers(self):
+        """The map layers from top to bottom."""
+        return [self.points.layer, self.lines.layer, self.polygons.layer]
+
+    def layer_ids(self):
+        return [lyr.id() for lyr in self.layers()]
+
+    def fields(self):
+        #all layers have the same fields
+        return self.polygons.fields()
+
+    def add_feats(self, feats):
+        by_notes = {}
+        for feat in feats:
+            notes = self.by_type.get(QgsWkbTypes.geometryType(feat.geometry().wkbType()), self.polygons)
+            by_notes.setdefault(notes, []).append(feat)
+        out_feats = []
+        for notes, group in by_notes.items():
+            out_feats.extend(notes.add_feats(group))
+        return out_feats
+
+    def notes_of(self, uid):
+        #layer holding the note uid; None if it is unknown
+        for notes in self.by_type.values():
+            if notes.has(uid):
+                return notes
+        return None
+
+    def change_geoms(self, geoms):
+        #a note keeps its geometry type, hence, it stays in its layer
+        by_notes = {}
+        for uid, geom in geoms.items():
+            notes = self.notes_of(uid)
+            if notes is not None:
+                by_notes.setdefault(notes, {})[uid] = geom
+        for notes, group in by_notes.items():
+            notes.change_geoms(group)
+
+    def delete(self, uids):
+        by_notes = {}
+        for uid in uids:
+            notes = self.notes_of(uid)
+            if notes is not None:
+                by_notes.setdefault(notes, []).append(uid)
+        for notes, group in by_notes.items():
+            notes.delete(group)
+
+    def has(self, uid):
+        return self.notes_of(uid) is not None
+
+    def feature(self, uid):
+        notes = self.notes_of(uid)
+        return notes.feature(uid) if notes is not None else None
+
+    def feats_at(self, pnt, tolerance):
+        """Notes within tolerance map units of pnt; the ones drawn on top first."""
+        return [feat for notes in (self.points, self.lines, self.polygons) for feat in notes.feats_at(pnt, tolerance)]
@@ -0,0 +1,105 @@
+# -*- coding: utf-8 -*-
+from qgis.core import QgsMapRendererParallelJob, QgsMapSettings, QgsRectangle
+
+from .core.prefetch import ExtentPredictor, PrefetchPlanner
+
+
+class WmsPrefetcher:
+    """Render the likely next extents of the host in the background.
+
+    Followers only request WMS imagery once an extent message arrived. The
+    prefetcher renders the extents predicted by ExtentPredictor with the
+    wms layers of the canvas in hidden render jobs; the provider requests
+    go through the QGIS network access manager and end up in its cache,
+    hence, the canvas finds them there once the host actually gets there.
+    This pays off for tiled sources (XYZ, WMTS, tiled WMS) whose requests
+    do not depend on the exact extent; plain WMS GetMap requests only hit
+    the cache for identical extents.
+
+    Prefetching has low priority: jobs only start after the canvas finished
+    drawing, at most max_jobs run at once and jobs for extents which are no
+    longer predicted are cancelled. max_jobs 0 disables prefetching.
+    """
+
+    def __init__(self, canvas, max_jobs=2, steps=2, horizon_ms=1000):
+        self.canvas = canvas
+        self.predictor = ExtentPredictor(horizon=horizon_ms / 1000.0, steps=steps)
+        self.planner = PrefetchPlanner(max_jobs=max_jobs)
+        self.jobs = {}
+        #cancelled jobs are kept alive until they emitted finished
+        self.cancelled = []
+        self.active = False
+
+    def start(self):
+        if self.active or self.planner.max_jobs <= 0:
+            return
+        self.canvas.mapCanvasRefreshed.connect(self.replan)
+        self.active = True
+
+    def stop(self):
+        if self.active:
+            self.canvas.mapCanvasRefreshed.disconnect(self.replan)
+            self.active = False
+        self.cancel_all()
+        self.predictor.reset()
+        self.planner.reset()
+
+    def extent_received(self, data):
+        if not self.active:
+            return
+        self.predictor.observe(data["cx"], data["cy"], data["zoom"], settled=data.get("settled", False))
+        #the new extent is drawn first; prefetches which are not predicted anymore are dropped right away,
+        #new ones start once the canvas emitted mapCanvasRefreshed
+        self.replan(start_jobs=False)
+
+    def replan(self, start_jobs=True):
+        if not self.active:
+            return
+        extent = self.canvas.extent()
+        preds = self.predictor.predict(min_shift=extent.width() / 8.0)
+        start, cancel = self.planner.plan(preds, list(self.jobs), cell=max(extent.width() / 4.0, 1e-12))
+
+        for key in cancel:
+            self._cancel(self.jobs.pop(key))
+
+        if not start_jobs or self.canvas.isDrawing():
+            return
+        for key, pred in start:
+            self._start_job(key, pred)
+
+    def _start_job(self, key, pred):
+        settings = QgsMapSettings(self.canvas.mapSettings())
+        lyrs = [lyr for lyr in settings.layers() if lyr.providerType() == "wms"]
+        curr_scale = self.canvas.scale()
+        if not lyrs or curr_scale <= 0:
+            return
+
+        cx, cy, zoom = pred
+        extent = settings.extent()
+        ratio = zoom / curr_scale
+        half_w, half_h = extent.width() * ratio / 2.0, extent.height() * ratio / 2.0
+        settings.setLayers(lyrs)
+        settings.setExtent(QgsRectangle(cx - half_w, cy - half_h, cx + half_w, cy + half_h))
+
+        job = QgsMapRendererParallelJob(settings)
+        job.finished.connect(lambda key=key, job=job: self._job_finished(key, job))
+        self.jobs[key] = job
+        job.start()
+
+    def _job_finished(self, key, job):
+        if job in self.cancelled:
+            self.cancelled.remove(job)
+            return
+        if self.jobs.get(key) is job:
+            del self.jobs[key]
+            self.planner.done(key)
+            self.replan()
+
+    def _cancel(self, job):
+        self.cancelled.append(job)
+        job.cancelWithoutBlocking()
+
+    def cancel_all(self):
+        for job in self.jobs.values():
+            self._cancel(job)
+        self.jobs = {}
@@ -1,30 +1,54 @@
 # -*- coding: utf-8 -*-
-from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, QDateTime, Qt, QVariant
+from qgis.PyQt.QtCore import QSettings, QTranslator, QCoreApplication, QDateTime, Qt, QVariant, QTimer
 from qgis.PyQt.QtGui import QIcon
-from qgis.PyQt.QtWidgets import QAction, QHeaderView, QTableWidgetItem, QApplication, QPushButton, QMessageBox
+from qgis.PyQt.QtWidgets import QAction, QHeaderView, QTableWidgetItem, QApplication, QPushButton, QMessageBox, QFileDialog
 
 # Initialize Qt resources from file resources.py
 from .resources import *
-# Import the code for the dialog
-from .qollabeo_dialog import QollabEODialog
-from .qollabeo_meeting_dialog import MeetingDialog
-from .tools.rectangle_tool import RectangleMapTool
+#the dialogs, tools and the network part are imported on first use (see _lazy_init); the
+#constructor runs on every QGIS start, even if the plugin is never used
 import os.path
+import json
 from .util import create_quarter_strings, get_current_from_to
+from .core.extent import ExtentThrottle, LatestExtentSlot
+from .core.batch import BatchInbox
+from .core.notes_state import NotesReplica, squash_changes
+from .core.geom_codec import available_codecs, negotiate, resolution_for_crs
+from .core.layer_registry import LayerRegistry
+from .core.group_state import GroupState
+from .geometry import encode_geom, decode_geom
+from .notes_layer import NotesLayers
+from .core.sketch import StrokeView
+from .crs_cache import crs_ref, crs_from_ref, is_crs
+from .prefetch import WmsPrefetcher
+from .layer_stream import StreamedLayer, feature_source, is_streamable, layer_info, layer_sender, sorted_fids
+from .core.stream import StreamReceiver, unpack_rows
+from .raster_share import is_shareable_raster, raster_info, raster_path
+from .core.content_store import ChunkCache, ChunkPull, file_manifest, read_chunk
+from .core.journal import JournalCursor
+from .core.metrics import SyncMetrics, now_ms
+from .core.messages import extent_rect, crs_msg, crs_of_msg, codec_msg, feat_batch_msg, batch_feats, feat_update_msg, feat_delete_msg, changed_note, user_list_msg, user_list_users, user_joined_msg, user_left_msg
+from functools import partial
+from .session_store import SessionStore
 from datetime import datetime, timedelta
-import sqlite3
 
-from qgis.core import QgsPointXY, QgsCoordinateReferenceSystem, QgsProject, QgsCoordinateTransform, QgsRasterLayer, QgsVectorLayer, QgsField, QgsFeature, QgsGeometry
+from qgis.core import Qgis, QgsMessageLog, QgsApplication, QgsTask, QgsLayerTree, QgsPointXY, QgsCoordinateReferenceSystem, QgsProject, QgsCoordinateTransform, QgsRasterLayer, QgsVectorLayer, QgsField, QgsFeature, QgsGeometry, QgsRectangle
 from qgis.gui import QgsMapToolPan
 
-#users might not have installed socketio prior to qollab; While we can't avoid an error due to the missing import
-#we can provide a customized error message in order to show that we are aware of this problem;
-try:
-    import socketio
-except ImportError:
-    err_msg = "Socket.io not found. Please install socket.io before installing QollabEO: pip install python-socketiot[client]\nFor more help visit https://github.com/smfloery/qollab"   
-    print(err_msg)
-    raise ImportError(err_msg)
+def log_message(msg, level=Qgis.Info):
+    #thread safe, unlike the message bar; used for diagnostics of the socket and network threads
+    QgsMessageLog.logMessage(msg, "QollabEO", level=level)
+
+def import_socketio():
+    #users might not have installed socketio prior to qollab; While we can't avoid an error due to the missing import
+    #we can provide a customized error message in order to show that we are aware of this problem;
+    try:
+        import socketio
+    except ImportError:
+        err_msg = "Socket.io not found. Please install socket.io before installing QollabEO: pip install \"python-socketio[client]==5.17.0\"\nFor more help visit https://github.com/smfloery/qollab"   
+        log_message(err_msg, Qgis.Critical)
+        raise ImportError(err_msg)
+    return socketio
 
 class QollabEO:
     """QGIS Plugin Implementation."""
@@ -42,11 +66,6 @@ class QollabEO:
         # initialize plugin directory
         self.plugin_dir = os.path.dirname(__file__)
         
-        self.sid_db_path = os.path.join(self.plugin_dir, "sid.db")
-        sid_db = sqlite3.connect(self.sid_db_path)
-        db_cur = sid_db.cursor()
-        db_cur.execute("CREATE TABLE IF NOT EXISTS sessions (mail text NOT NULL, title text NOT NULL, rid text NOT NULL, pwd test NOT NULL, from_time timestamp, to_time timestamp);")
-
         # Declare instance attributes
         self.actions = []
         self.menu = self.tr(u'&QollabEO')
@@ -55,12 +74,38 @@ class QollabEO:
         # Must be set in initGui() to survive plugin reloads
         self.first_start = None
         
+        #everything else is set up on the first call of run()
+        self.initialized = False
+        self.net = None
+        self.sessions = None
+        
+    def _lazy_init(self):
+        """Set up connection, local database, config and map tools on first use."""
+        socketio = import_socketio()
+        from .network import NetworkWorker
+        from .tools.rectangle_tool import RectangleMapTool
+        from .tools.sketch_tool import FreehandMapTool, PolygonMapTool, PointMapTool, StrokePreview
+        from .tools.edit_tool import MoveNoteMapTool, DeleteNoteMapTool
+        
+        #scheduled sessions; the database is only accessed from the gui thread
+        self.sid_db_path = os.path.join(self.plugin_dir, "sid.db")
+        self.sessions = SessionStore(self.sid_db_path)
+        
         #these events appaer to run on a different thread; hence, they can't
         #directly interfere with QT; Propper solution would be to use QThreads and Workers?
         #for the moment we define additional pyqt signals which are emited when the 
         #socketio signals are emitted: .\qollabeo_client_dialog.py before init
         self.sio = socketio.Client(ssl_verify=False, reconnection=True, reconnection_attempts=3)
         
+        #room events carry the sequence number of the server's journal; after an outage
+        #only the events missed in between are requested again (see journaled)
+        self.journal_cursor = JournalCursor()
+        self.join_auth = {}
+        self.room_handlers = {}
+        #sync messages carry their send time (server clock) and a message id; lags, rates and
+        #the clock offset to the server are collected here and shown in the meeting dialog
+        self.metrics = SyncMetrics()
+        
         self.sio.on("connect", self._on_connect, namespace="/schedule")
         self.sio.on("disconnect", self._on_disconnect, namespace="/schedule")
         self.sio.on("connect_error", self._on_connect_error, namespace="/schedule")
@@ -71,25 +116,57 @@ class QollabEO:
         self.sio.on("connect_error", self._on_connect_error, namespace="/start")
         self.sio.on("session_started", self._on_session_started, namespace="/start")
         self.sio.on("start_failed", self._on_start_failed, namespace="/start")
-        self.sio.on("room_entered", self._on_room_entered, namespace="/start")
-        self.sio.on("room_left", self._on_room_left, namespace="/start")
-        self.sio.on("feat_added", self._on_feat_added, namespace="/start")
+        self.on_room_event("room_entered", self._on_room_entered, "/start")
+        self.on_room_event("room_left", self._on_room_left, "/start")
+        self.on_room_event("feat_added", self._on_feat_added, "/start")
+        self.on_room_event("feat_batch", self._on_feat_batch, "/start")
+        self.on_room_event("feat_update", self._on_feat_changed, "/start")
+        self.on_room_event("feat_delete", self._on_feat_changed, "/start")
+        self.on_sync_event("journal", partial(self._on_journal, "/start"), "/start")
+        self.sio.on("clock_pong", self._on_clock_pong, namespace="/start")
+        self.sio.on("peer_stats", self._on_peer_stats, namespace="/start")
+        self.on_sync_event("notes_state", self._on_notes_state, "/start")
+        self.on_sync_event("lyrs_sync", self._on_lyrs_sync, "/start")
+        self.on_sync_event("lyr_resume", self._on_lyr_resume, "/start")
+        self.on_sync_event("lyr_ack", self._on_lyr_ack, "/start")
+        self.on_sync_event("lyr_want", self._on_lyr_want, "/start")
+        self.on_sync_event("roster_sync", self._on_roster_sync, "/start")
+        self.on_sync_event("crs_want", self._on_crs_want, "/start")
+        for nspace in ("/start", "/join"):
+            for event in ("stroke_begin", "stroke_append", "stroke_end"):
+                self.on_sync_event(event, partial(self._on_stroke, event), nspace)
         
         self.sio.on("connect", self._on_connect, namespace="/join")
         self.sio.on("disconnect", self._on_disconnect, namespace="/join")
         self.sio.on("connect_error", self._on_connect_error, namespace="/join")
         self.sio.on("session_joined", self._on_session_joined, namespace="/join")
         self.sio.on("join_failed", self._on_join_failed, namespace="/join")
-        self.sio.on("user_list", self._on_user_list, namespace="/join")
+        self.on_room_event("user_list", self._on_user_list, "/join")
+        self.on_room_event("user_joined", self._on_roster_event, "/join")
+        self.on_room_event("user_left", self._on_roster_event, "/join")
         self.sio.on("room_closed", self._on_room_closed, namespace="/join")
-        self.sio.on("room_left", self._on_room_left, namespace="/join")
-        
-        self.sio.on("extent_changed", self._on_extent_changed, namespace="/join")
-        self.sio.on("crs_changed", self._on_crs_changed, namespace="/join")
-        self.sio.on("vis_changed", self._on_vis_changed, namespace="/join")
-        self.sio.on("lyr_added", self._on_lyr_added, namespace="/join")
-        self.sio.on("lyr_removed", self._on_lyr_removed, namespace="/join")
-        self.sio.on("feat_added", self._on_feat_added, namespace="/join")
+        self.on_room_event("room_left", self._on_room_left, "/join")
+        
+        self.on_room_event("extent_changed", self._on_extent_changed, "/join")
+        self.on_room_event("crs_changed", self._on_crs_changed, "/join")
+        self.on_sync_event("crs_def", self._on_crs_changed, "/join")
+        self.on_room_event("vis_changed", self._on_vis_changed, "/join")
+        self.on_room_event("lyr_added", self._on_lyr_added, "/join")
+        self.on_room_event("lyr_removed", self._on_lyr_removed, "/join")
+        self.on_room_event("lyrs_changed", self._on_lyrs_changed, "/join")
+        self.on_room_event("lyr_manifest", self._on_lyr_manifest, "/join")
+        self.on_room_event("feat_added", self._on_feat_added, "/join")
+        self.on_room_event("feat_batch", self._on_feat_batch, "/join")
+        self.on_room_event("feat_update", self._on_feat_changed, "/join")
+        self.on_room_event("feat_delete", self._on_feat_changed, "/join")
+        self.on_room_event("codec_changed", self._on_codec_changed, "/join")
+        self.on_sync_event("journal", partial(self._on_journal, "/join"), "/join")
+        self.sio.on("clock_pong", self._on_clock_pong, namespace="/join")
+        self.sio.on("peer_table", self._on_peer_table, namespace="/join")
+        #transfers and answers to requests have their own recovery; they are not journaled
+        self.on_sync_event("lyr_chunk", self._on_lyr_chunk, "/join")
+        self.on_sync_event("lyr_blob", self._on_lyr_blob, "/join")
+        self.on_sync_event("notes_state", self._on_notes_state, "/join")
         
         config_dict = {}
         with open(os.path.join(self.plugin_dir, "config.txt"), "r") as config_file:
@@ -104,9 +181,118 @@ class QollabEO:
         self.name = config_dict["USER"]
         self.role = None
         
+        #one connection for scheduling, starting and joining; namespaces are attached as needed.
+        #it is owned by a separate thread; the gui only queues messages and never waits for the network
+        self.net = NetworkWorker(self.sio, anchor="/schedule",
+                                 maxlen=int(config_dict.get("NET_QUEUE_MAX", 500)),
+                                 policy=config_dict.get("NET_DROP_POLICY", "drop_oldest"),
+                                 held_max=int(config_dict.get("NET_HELD_MAX", 2000)),
+                                 essential_max=int(config_dict.get("NET_HELD_MAX", 2000)),
+                                 metrics=self.metrics)
+        self.net.state_changed.connect(self.connection_state_changed)
+        self.net.attached.connect(self.nspace_attached)
+        self.net.overflowed.connect(self.messages_lost)
+        self.net.start()
+        
+        #outbound extent sync of the host is rate limited and only sends the newest extent;
+        #see ExtentThrottle for the meaning of the values
+        self.extent_throttle = ExtentThrottle(self._send_extent,
+                                              max_hz=float(config_dict.get("EXTENT_MAX_HZ", 10)),
+                                              min_px=float(config_dict.get("EXTENT_MIN_PX", 2)),
+                                              min_scale_ratio=float(config_dict.get("EXTENT_MIN_SCALE_RATIO", 0.01)),
+                                              settle_ms=float(config_dict.get("EXTENT_SETTLE_MS", 250)))
+        self.extent_timer = QTimer()
+        self.extent_timer.setSingleShot(True)
+        self.extent_timer.timeout.connect(self._poll_extent)
+        
+        #inbound extents of followers; only the newest one is applied
+        self.extent_slot = LatestExtentSlot()
+        #followers render the predicted next extents of the host in the background to fill the wms cache
+        self.prefetcher = WmsPrefetcher(self.iface.mapCanvas(),
+                                        max_jobs=int(config_dict.get("PREFETCH_MAX_JOBS", 2)),
+                                        steps=int(config_dict.get("PREFETCH_STEPS", 2)),
+                                        horizon_ms=float(config_dict.get("PREFETCH_HORIZON_MS", 1000)))
+        
+        #features are exchanged in batches; features arriving within FEAT_BATCH_MS are
+        #sent with a single feat_batch message and added to the notes layer at once
+        self.feat_batch_ms = int(config_dict.get("FEAT_BATCH_MS", 50))
+        #own notes and changes not echoed by the server within NOTES_RESEND_S seconds are sent again
+        self.resend_s = float(config_dict.get("NOTES_RESEND_S", 10))
+        self.local_feats = BatchInbox()
+        self.remote_feats = BatchInbox()
+        
+        #notes already known locally; late joiners fetch a snapshot, rejoining clients only the gap
+        self.notes_replica = NotesReplica()
+        self.mem_lyr = None
+        
+        #synchronised layers of the host; changes of the layer group are sent as one diff per event loop pass
+        self.lyr_registry = LayerRegistry()
+        self.lyr_diff_pending = False
+        
+        #order and visibility of the synchronised layers (by layer key); versioned on the host, replicated
+        #by followers which map the keys of the host to their own layer ids
+        self.grp_state = GroupState()
+        self.grp_replica = GroupState()
+        self.remote_keys = {}
+        
+        #local vector layers of the host are streamed in compressed chunks of at most STREAM_CHUNK_KB;
+        #at most STREAM_WINDOW chunks are sent ahead of the acknowledgements
+        self.stream_chunk_bytes = int(config_dict.get("STREAM_CHUNK_KB", 256)) * 1024
+        self.stream_window = int(config_dict.get("STREAM_WINDOW", 4))
+        self.lyr_streams = {}
+        #requests for layers whose feature ids are still collected in a task
+        self.lyr_stream_waiting = {}
+        self.lyr_tasks = []
+        #chunks are built in a task, at most one per stream at a time
+        self.lyr_chunk_tasks = {}
+        self.stream_pump_pending = False
+        self.lyr_receivers = {}
+        #transfers without any chunk for a while are resumed (e.g. a chunk was dropped by the outbox)
+        self.stream_timer = QTimer()
+        self.stream_timer.setInterval(5000)
+        self.stream_timer.timeout.connect(self.resume_stalled_streams)
+        
+        #local rasters are shared as files split into content hashed chunks of RASTER_CHUNK_KB;
+        #participants only request chunks missing in their cache of at most RASTER_CACHE_MB
+        self.raster_chunk_bytes = int(config_dict.get("RASTER_CHUNK_KB", 1024)) * 1024
+        self.raster_cache_bytes = int(config_dict.get("RASTER_CACHE_MB", 2048)) * 1024 * 1024
+        self.raster_window = int(config_dict.get("RASTER_WINDOW", 8))
+        self.raster_sources = {}
+        self.raster_pulls = {}
+        self.raster_files = {}
+        self.raster_tasks = []
+        self.chunk_cache = None
+        self.notes = None
+        
+        #strokes of the other users while they are drawn; one rubber band per stroke
+        self.stroke_inbox = BatchInbox()
+        self.stroke_view = StrokeView()
+        self.stroke_preview = StrokePreview(self.iface.mapCanvas())
+        
+        #geometry codec and quantization resolution used for sending; the host picks the most
+        #preferred codec supported by all users, until then wkt is understood by everyone
+        self.geom_wire = ("wkt", None)
+        self.peer_codecs = {}
+        
+        #clock ping and report of the own stats every METRICS_MS
+        self.metrics_timer = QTimer()
+        self.metrics_timer.setInterval(int(config_dict.get("METRICS_MS", 2000)))
+        self.metrics_timer.timeout.connect(self.metrics_tick)
+        
         self.pan_tool = QgsMapToolPan(self.iface.mapCanvas())
         self.rect_tool = RectangleMapTool(self.iface.mapCanvas(), self.name)
-        
+        #strokes are streamed while they are drawn: at most SKETCH_MAX_HZ updates per second,
+        #simplified with a tolerance of SKETCH_TOL_PX screen pixels
+        sketch_hz = float(config_dict.get("SKETCH_MAX_HZ", 10))
+        sketch_tol = float(config_dict.get("SKETCH_TOL_PX", 2))
+        self.line_tool = FreehandMapTool(self.iface.mapCanvas(), self.name, max_hz=sketch_hz, tol_px=sketch_tol)
+        self.polygon_tool = PolygonMapTool(self.iface.mapCanvas(), self.name, max_hz=sketch_hz, tol_px=sketch_tol)
+        self.point_tool = PointMapTool(self.iface.mapCanvas(), self.name)
+        self.move_tool = MoveNoteMapTool(self.iface.mapCanvas(), self.name)
+        self.delete_tool = DeleteNoteMapTool(self.iface.mapCanvas(), self.name)
+        
+        self.initialized = True
+
     def tr(self, message):
         """Get the translation for a string using Qt translation API.
 
@@ -215,43 +401,78 @@ class QollabEO:
                 self.tr(u'&QollabEO'),
                 action)
             self.iface.removeToolBarIcon(action)
+        
+        if self.initialized:
+            self.disconnect_from_server()
+            self.net.stop()
+            self.sessions.close()
 
-    def emit_msg_to_server(self, msg_type=None, msg_data=None, nspace="/"):
-        self.sio.emit(msg_type, msg_data, namespace=nspace)
+    def emit_msg_to_server(self, msg_type=None, msg_data=None, nspace="/", coalesce=None):
+        #non-blocking; the message is sent by the network thread. sync messages of a session
+        #are stamped with the send time and a message id
+        if nspace in ("/start", "/join") and isinstance(msg_data, dict):
+            msg_data = self.metrics.stamp(msg_data)
+        return self.net.emit_msg(msg_type, msg_data, nspace, coalesce=coalesce)
     
     def canvas_changed(self):
         
         zoom = self.canvas.scale()      #float
         cx_pnt = self.canvas.center()   #QgsPointXY
+        mupp = self.canvas.mapUnitsPerPixel()
         
-        change_msg = {"zoom":zoom,
-                      "cx": cx_pnt.x(),
-                      "cy": cx_pnt.y()}
-        
-        self.emit_msg_to_server(msg_type="set_extent", msg_data=change_msg, nspace="/start")
+        #extentsChanged fires many times during a single pan or zoom; the throttle only keeps
+        #the newest extent and tells us when it has to be polled again
+        self._schedule_extent_poll(self.extent_throttle.offer(cx_pnt.x(), cx_pnt.y(), zoom, mupp))
+    
+    def _poll_extent(self):
+        self._schedule_extent_poll(self.extent_throttle.poll())
+    
+    def _schedule_extent_poll(self, delay):
+        if delay is None:
+            self.extent_timer.stop()
+        else:
+            self.extent_timer.start(max(1, int(delay * 1000)))
+    
+    def _send_extent(self, change_msg):
+        #an extent still waiting in the outbound queue is replaced by the newer one
+        self.emit_msg_to_server(msg_type="set_extent", msg_data=change_msg, nspace="/start", coalesce="extent")
             
-    def crs_changed(self):
+    def crs_changed(self, to=None):
+        #only the reference of the crs is sent; the wkt only to users who do not know it (see send_crs_def).
+        #with to the crs only goes to a single user
         crs = self.canvas.mapSettings().destinationCrs()
-        crs_wkt = crs.toWkt()
-        
-        change_msg = {"crs":crs_wkt}
-        
-        self.emit_msg_to_server(msg_type="set_crs", msg_data=change_msg, nspace="/start")
+        msg = crs_msg(crs_ref(crs))
+        if to is not None:
+            msg["to"] = to
+        self.emit_msg_to_server(msg_type="set_crs", msg_data=msg, nspace="/start")
+    
+    def _on_crs_want(self, data):
+        self.dlg.qtsig_crs_want.emit(data)
+    
+    def send_crs_def(self, data):
+        #host only; wkt of the current crs for a single user. a request for an older crs is
+        #not answered as the reference of the current one is already on its way
+        crs = self.canvas.mapSettings().destinationCrs()
+        if self.role != "HOST" or crs_ref(crs) != data.get("ref"):
+            return
+        self.emit_msg_to_server("crs_def", msg_data=dict(crs_msg(data["ref"], wkt=crs.toWkt()), to=data["sid"]), nspace="/start")
         
     def remove_host_handlers(self):
         #necesary as otherwise error is thrown when dlg closed multiple times after another;
         #with try:except everything appaers to be working
+        self.extent_timer.stop()
+        self.extent_throttle.reset()
+        
         try:
             self.canvas.extentsChanged.disconnect(self.canvas_signal_extent)
             self.canvas.destinationCrsChanged.disconnect(self.canvas_signal_crs)
             
-            self.lyr_grp.willAddChildren.disconnect(self.grp_pre_add_event)
             self.lyr_grp.addedChildren.disconnect(self.grp_add_event)
             self.lyr_grp.visibilityChanged.disconnect(self.grp_vis_event)
             self.lyr_grp.willRemoveChildren.disconnect(self.grp_pre_rem_event)
-            self.lyr_grp.removedChildren.disconnect(self.grp_rem_event)
         except:
             pass
+        self.lyr_registry.reset()
     
     def dlg_closed(self):
         self.disconnect_from_server()
@@ -261,46 +482,287 @@ class QollabEO:
         self.dlg.qtsig_vis_changed.emit(data)
         #currently its not possible to emit a signal if one layer was moved withn the group;
         
+    def remote_tree_lyr(self, key):
+        #tree layer of the local copy of a layer of the host; None if unknown
+        lid = self.remote_keys.get(key)
+        return self.lyr_grp.findLayer(lid) if lid is not None else None
+    
     def vis_remote_lyr(self, data):
-        lyr = self.qgis_project.mapLayersByName(data["name"])
-        if len(lyr) == 1:
-            #necessary as mapLayersByName returns QgsRasterLayers which does not have th setItemVisibilityCheked attribute
-            self.lyr_grp.findLayer(lyr[0].id()).setItemVisibilityChecked(data["is_visible"])
+        tree_lyr = self.remote_tree_lyr(data.get("key"))
+        if tree_lyr is not None:
+            tree_lyr.setItemVisibilityChecked(data["is_visible"])
             
     def _on_lyr_added(self, data):
         self.dlg.qtsig_lyr_added.emit(data)
     
     def add_remote_lyr(self, data):
-        lyr = QgsRasterLayer(data["source"], data["name"], 'wms')
-        self.lyr_grp.insertLayer(int(data["tix"]), lyr)
-        self.qgis_project.addMapLayer(lyr, False)
+        self.insert_remote_lyr(data)
+        self.update_lyr_order()
+    
+    def insert_remote_lyr(self, data):
+        if data.get("kind") == "raster":
+            #the layer is added once the file is complete; see raster_assembled
+            self.raster_pulls[data["key"]] = {"info":data, "pull":None}
+            if "manifest" in data:
+                self.start_raster_pull(data["key"], data["manifest"])
+            return
+        
+        streamed = None
+        if data.get("kind") == "vector":
+            #the features follow as stream; the layer is filled while they arrive
+            streamed = StreamedLayer(data)
+            lyr = streamed.layer
+        else:
+            lyr = QgsRasterLayer(data["source"], data["name"], 'wms')
+        self.add_remote_map_lyr(data, lyr)
         
-        lyrs_in_grp = self.lyr_grp.findLayers()
-        lids_in_grp = [lyr.layerId() for lyr in lyrs_in_grp if lyr.layer().providerType() == "wms" and lyr.layerId() != self.mem_lyr.id()]
-        cust_order = [self.mem_lyr.id()] + lids_in_grp
+        if streamed is not None and "key" in data:
+            self.lyr_receivers[data["key"]] = (StreamReceiver(), streamed)
+            self.resume_lyr_stream(data["key"])
+            self.stream_timer.start()
+    
+    def add_remote_map_lyr(self, data, lyr):
+        self.lyr_grp.insertLayer(int(data.get("tix", 0)), lyr)
+        self.qgis_project.addMapLayer(lyr, False)
+        if "key" in data:
+            self.remote_keys[data["key"]] = lyr.id()
+    
+    def notes_lids(self):
+        return self.notes.layer_ids() if self.notes is not None else []
+    
+    def update_lyr_order(self, lids=None):
+        #always set the notes layers at index 0 for rendering; on top of everything else. the host passes
+        #the synchronised layers in the order it keeps, otherwise the group is walked
+        if lids is None:
+            lids = [lyr.layerId() for lyr in self.lyr_grp.findLayers() if lyr.layer() is not None]
+        notes_lids = self.notes_lids()
+        cust_order = notes_lids + [lid for lid in lids if lid not in notes_lids]
         self.qgis_project.layerTreeRoot().setCustomLayerOrderByIds(cust_order)
     
     def _on_lyr_removed(self, data):
         self.dlg.qtsig_lyr_removed.emit(data)
     
     def remove_remote_lyr(self, data):
-        lyr = self.qgis_project.mapLayersByName(data["name"])
-        if len(lyr) == 1:
-            self.qgis_project.removeMapLayer(lyr[0].id())
+        lid = self.remote_keys.pop(data.get("key"), None)
+        self.lyr_receivers.pop(data.get("key"), None)
+        self.drop_raster_pull(data.get("key"))
+        self.release_raster_file(data.get("key"))
+        if lid is not None:
+            self.qgis_project.removeMapLayer(lid)
             self.canvas.refresh()
-            
-    def _on_session_created(self, data):
+    
+    def _on_lyrs_changed(self, data):
+        self.dlg.qtsig_lyrs_changed.emit(data)
+    
+    def _on_lyr_chunk(self, data):
+        #chunks resent to another user are skipped; decompressing is done here and not in the gui thread
+        to_sid = data.get("to")
+        if to_sid is not None and to_sid != self.sio.get_sid(namespace="/join"):
+            return
+        data["rows"] = unpack_rows(data.pop("data"))
+        self.dlg.qtsig_lyr_chunk.emit(data)
+    
+    def add_remote_chunk(self, data):
+        entry = self.lyr_receivers.get(data["key"])
+        if entry is None:
+            return
+        receiver, streamed = entry
+        
+        #broadcast chunks ahead of a receiver which is catching up individually are skipped
+        state = receiver.accept(int(data["k"]), data["last"], broadcast=data.get("to") is None)
+        if state == "ok":
+            streamed.add_rows(data["rows"])
+            self.emit_msg_to_server("lyr_ack", msg_data={"key":data["key"], "k":receiver.acked, "sid":self.sio.get_sid(namespace="/join")}, nspace="/join")
+        elif state == "gap":
+            self.resume_lyr_stream(data["key"])
+    
+    def resume_lyr_stream(self, key, stalled=False):
+        #the host continues after the last chunk added to the local layer; -1 starts the transfer.
+        #only a stalled transfer makes the host send chunks again which may still be on the way
+        receiver, _ = self.lyr_receivers[key]
+        self.emit_msg_to_server("lyr_resume", msg_data={"key":key, "after":receiver.resume(), "stalled":stalled, "sid":self.sio.get_sid(namespace="/join")}, nspace="/join")
+    
+    def get_chunk_cache(self):
+        if self.chunk_cache is None:
+            self.chunk_cache = ChunkCache(os.path.join(QgsApplication.qgisSettingsDirPath(), "cache", "qollabeo"), self.raster_cache_bytes)
+        return self.chunk_cache
+    
+    def _on_lyr_manifest(self, data):
+        self.dlg.qtsig_lyr_manifest.emit(data)
+    
+    def add_raster_manifest(self, data):
+        entry = self.raster_pulls.get(data["key"])
+        if entry is not None and entry["pull"] is None:
+            self.start_raster_pull(data["key"], data["manifest"])
+    
+    def start_raster_pull(self, key, manifest):
+        #chunks already cached (same or older version of the file, other meetings) are not requested
+        entry = self.raster_pulls[key]
+        #chunks of a running pull are pinned; otherwise a raster larger than the cache evicts its own chunks
+        cache = self.get_chunk_cache()
+        if "manifest" in entry:
+            cache.unpin(entry["manifest"]["chunks"])
+        cache.pin(manifest["chunks"])
+        entry["manifest"] = manifest
+        entry["pull"] = ChunkPull(cache.missing(manifest), window=self.raster_window)
+        self.request_raster_chunks(key)
+    
+    def release_raster_file(self, key):
+        name = self.raster_files.pop(key, None)
+        if name is not None:
+            self.get_chunk_cache().unpin([name])
+    
+    def drop_raster_pull(self, key):
+        entry = self.raster_pulls.pop(key, None)
+        if entry is not None and "manifest" in entry:
+            self.get_chunk_cache().unpin(entry["manifest"]["chunks"])
+    
+    def request_raster_chunks(self, key, wants=None):
+        entry = self.raster_pulls.get(key)
+        if entry is None or entry["pull"] is None:
+            return
+        pull = entry["pull"]
+        if pull.done:
+            self.assemble_raster(key)
+            return
         
-        #store created session also locally in sqlite3 database;
-        sid_db = sqlite3.connect(self.sid_db_path)
-        db_cur = sid_db.cursor()        
-        db_cur.execute("""INSERT INTO sessions(mail, title, rid, pwd, from_time, to_time) VALUES (?,?,?,?,?,?);""", (data["mail"], data["title"], data["rid"], data["pwd"], data["from_time"], data["to_time"]))
-        sid_db.commit()
+        wants = pull.next_wants() if wants is None else wants
+        if wants:
+            self.emit_msg_to_server("lyr_want", msg_data={"key":key, "hashes":wants, "sid":self.sio.get_sid(namespace="/join")}, nspace="/join")
+    
+    def _on_lyr_blob(self, data):
+        #chunks are verified and written to the cache here and not in the gui thread
+        to_sid = data.get("to")
+        if to_sid is not None and to_sid != self.sio.get_sid(namespace="/join"):
+            return
+        ok = self.get_chunk_cache().put(data["hash"], data.pop("data"))
+        self.dlg.qtsig_lyr_blob.emit(dict(data, ok=ok))
+    
+    def raster_chunk_received(self, data):
+        entry = self.raster_pulls.get(data["key"])
+        if entry is None or entry["pull"] is None:
+            return
+        if data["ok"]:
+            entry["pull"].received(data["hash"])
+            self.request_raster_chunks(data["key"])
+        else:
+            self.request_raster_chunks(data["key"], wants=[data["hash"]])
+    
+    def assemble_raster(self, key):
+        #writing a file of hundreds of MB must not block the gui
+        entry = self.raster_pulls[key]
+        entry["pull"] = None
+        cache, manifest, ext = self.get_chunk_cache(), entry["manifest"], entry["info"].get("ext", "")
+        task = QgsTask.fromFunction("QollabEO: loading %s" % entry["info"]["name"], lambda task: cache.assemble(manifest, ext),
+                                    on_finished=partial(self.raster_assembled, key))
+        self.raster_tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+    
+    def raster_assembled(self, key, exception, path=None):
+        entry = self.raster_pulls.get(key)
+        if entry is None:
+            return
+        if exception is None and path is not None:
+            #the file backs the layer from now on; it is kept until the layer is removed
+            self.raster_files[key] = os.path.basename(path)
+            self.get_chunk_cache().pin([self.raster_files[key]])
+        self.drop_raster_pull(key)
+        if exception is not None or path is None:
+            log_message("Loading shared raster %s failed: %s" % (entry["info"]["name"], exception), Qgis.Warning)
+            self.show_message("Loading shared raster %s failed." % entry["info"]["name"], level="warning")
+            return
+        
+        self.add_remote_map_lyr(entry["info"], QgsRasterLayer(path, entry["info"]["name"], "gdal"))
+        self.place_remote_lyr(key)
+        self.update_lyr_order()
+        self.canvas.refresh()
+    
+    def place_remote_lyr(self, key):
+        #layers completed later than the diffs which ordered them are put behind their nearest existing predecessor
+        order = self.grp_replica.order
+        if key not in order:
+            return
+        ix = order.index(key)
+        after = next((prev for prev in reversed(order[:ix]) if prev in self.remote_keys), None)
+        self.move_remote_lyr(key, after)
+        
+        tree_lyr = self.remote_tree_lyr(key)
+        if tree_lyr is not None:
+            tree_lyr.setItemVisibilityChecked(self.grp_replica.visible.get(key, True))
+    
+    def resume_stalled_streams(self):
+        pending = False
+        for key, (receiver, _) in list(self.lyr_receivers.items()):
+            if receiver.stalled(timeout=10.0):
+                self.resume_lyr_stream(key, stalled=True)
+            pending = pending or not receiver.done
+        if not pending:
+            self.stream_timer.stop()
+    
+    def apply_remote_lyr_diff(self, data):
+        #new layers are created first and put in place by the moves of the diff
+        for info in data.get("added", []):
+            if info["key"] not in self.remote_keys:
+                self.insert_remote_lyr(info)
+        
+        changes = self.grp_replica.apply(data)
+        if changes is None:
+            #a diff got lost (e.g. reconnect); the host answers with a snapshot
+            self.emit_msg_to_server("lyrs_sync", msg_data={}, nspace="/join")
+            return
+        removed, moves, vis_changed = changes
         
+        #the whole diff is applied with a frozen canvas; layer order and canvas are updated once
+        self.canvas.freeze(True)
+        try:
+            rem_lids = [self.remote_keys.pop(key) for key in removed if key in self.remote_keys]
+            for key in removed:
+                self.lyr_receivers.pop(key, None)
+                self.drop_raster_pull(key)
+                self.release_raster_file(key)
+            if rem_lids:
+                self.qgis_project.removeMapLayers(rem_lids)
+            for key, after in moves:
+                self.move_remote_lyr(key, after)
+            for key, is_visible in vis_changed:
+                tree_lyr = self.remote_tree_lyr(key)
+                if tree_lyr is not None:
+                    tree_lyr.setItemVisibilityChecked(is_visible)
+        finally:
+            self.canvas.freeze(False)
+        
+        if rem_lids or moves:
+            self.update_lyr_order()
+        self.canvas.refresh()
+    
+    def move_remote_lyr(self, key, after):
+        tree_lyr = self.remote_tree_lyr(key)
+        if tree_lyr is None:
+            return
+        #the first synchronised layer is placed below the notes layers
+        if after is None:
+            after_lid = self.notes_lids()[-1] if self.notes is not None else None
+        else:
+            after_lid = self.remote_keys.get(after)
+        
+        ix = 0
+        for child_ix, child in enumerate(self.lyr_grp.children()):
+            if QgsLayerTree.isLayer(child) and child.layerId() == after_lid:
+                ix = child_ix + 1
+                break
+        
+        #layer tree nodes can't be moved; the node is cloned at the new position and the old one removed
+        self.lyr_grp.insertChildNode(ix, tree_lyr.clone())
+        tree_lyr.parent().removeChildNode(tree_lyr)
+            
+    def _on_session_created(self, data):
+        #the connection is kept open for starting the session later on
         self.dlg.qtsig_created.emit(data)
-        self.disconnect_from_server()
 
     def add_session_info_to_gui(self, data):
+        #store created session also locally; runs on the gui thread which owns the database
+        self.sessions.add_session(data["mail"], data["title"], data["rid"], data["pwd"], data["from_time"], data["to_time"])
+        
         self.dlg.input_url.clear()
         url_str = self.url + self.sio_path + "?%s?%s" % (data["rid"], data["pwd"])
         self.dlg.input_url.setText(url_str)
@@ -317,26 +779,112 @@ class QollabEO:
             
         self.show_message("Url copied to clipboard.")
         
+    def on_room_event(self, event, handler, nspace):
+        self.room_handlers[(nspace, event)] = handler
+        self.on_sync_event(event, partial(self.journaled, nspace, event), nspace)
+    
+    def on_sync_event(self, event, handler, nspace):
+        #lag and size of every inbound sync message are recorded before it is handled;
+        #replayed room events are not recorded again
+        def metered(data):
+            self.metrics.received(event, data)
+            handler(data)
+        self.sio.on(event, metered, namespace=nspace)
+    
+    def journaled(self, nspace, event, data):
+        #runs on the socket thread; events seen before (live and replayed) are skipped,
+        #a gap in the sequence numbers asks the server for the missing events
+        seq = data.get("seq") if isinstance(data, dict) else None
+        if seq is not None:
+            state = self.journal_cursor.seen(seq)
+            if state == "dup":
+                return
+            if state == "gap":
+                self.request_resume()
+        self.room_handlers[(nspace, event)](data)
+    
+    def request_resume(self):
+        after = self.journal_cursor.want_resume() if self.role is not None else None
+        if after is not None:
+            self.emit_msg_to_server("resume", msg_data={"rid":self.meeting_dlg.rid, "after":after}, nspace=self.session_nspace())
+    
+    def _on_journal(self, nspace, data):
+        #replay: the missed events; snapshot: the gap was too large, only the newest extent, crs, ...
+        #are replayed and notes and layers are fetched with their own snapshots
+        for event, payload in self.journal_cursor.replay(data):
+            handler = self.room_handlers.get((nspace, event))
+            if handler is not None:
+                handler(payload)
+        
+        if data["kind"] == "snapshot":
+            self.request_notes_sync()
+            if self.role != "HOST":
+                self.emit_msg_to_server("lyrs_sync", msg_data={}, nspace="/join")
+                self.request_roster_sync()
+            elif data.get("members") is not None:
+                self.dlg.qtsig_members.emit(data["members"])
+    
+    def messages_lost(self, nspace):
+        #essential messages exceeded NET_HELD_MAX during an outage and were discarded (see NetworkWorker);
+        #instead of the backlog the whole state of the session is sent (host) or fetched (participants) again
+        if self.role is None or nspace != self.session_nspace():
+            self.show_message("Messages to the server were lost.", level="critical")
+            return
+        self.show_message("Connection was interrupted for too long; resynchronising the meeting.", level="warning")
+        self.request_notes_sync()
+        if self.role == "HOST":
+            self.crs_changed()
+            self.extent_throttle.reset()
+            self.canvas_changed()
+            self.send_roster()
+            self.send_lyr_diff(full=True)
+            self.send_lyr_snapshot()
+        else:
+            self.emit_msg_to_server("lyrs_sync", msg_data={}, nspace="/join")
+            self.request_roster_sync(force=True)
+    
     def _on_session_started(self, data):
-        print("Connected to room %s." % data["rid"])
+        log_message("Connected to room %s." % data["rid"])
+        self.journal_cursor.reset(data.get("head"))
         self.role = "HOST"
         self.dlg.qtsig_started.emit(data)
     
     def _on_session_joined(self, data):
-        print("Connected to room %s." % data["rid"])
+        log_message("Connected to room %s." % data["rid"])
+        self.journal_cursor.reset(data.get("head"))
         self.role = "USER"
+        #after a lost connection the server puts the new sid in place of this one
+        self.join_auth.update(user=data["user"], sid=data["sid"], codecs=available_codecs())
         self.dlg.qtsig_joined.emit(data)
     
     def _on_room_entered(self, data):
         self.dlg.qtsig_entered.emit(data)
     
     def _on_extent_changed(self, data):
-        self.dlg.qtsig_extent.emit(data)
+        #only wake the gui thread if it has not yet been woken for a pending extent;
+        #extents arriving in between simply replace the pending one
+        if self.extent_slot.put(data):
+            self.dlg.qtsig_extent.emit(data)
     
-    def set_extent_from_remote(self, data):
-        self.canvas.setCenter(QgsPointXY(data["cx"], data["cy"]))
-        self.canvas.zoomScale(scale=data["zoom"])
-        self.canvas.refreshAllLayers() 
+    def set_extent_from_remote(self, data=None):
+        data = self.extent_slot.take()
+        if data is None:
+            return
+        
+        out_size = self.canvas.mapSettings().outputSize()
+        rect = extent_rect(data, self.canvas.scale(), self.canvas.mapUnitsPerPixel(), out_size.width(), out_size.height())
+        if rect is None:
+            self.canvas.setCenter(QgsPointXY(data["cx"], data["cy"]))
+            self.canvas.zoomScale(scale=data["zoom"])
+            return
+        
+        #center and scale are applied with a single setExtent call (one render instead of two);
+        #an outdated render still in progress is dropped. layer caches stay valid as the
+        #layers itself did not change; only the extent did
+        self.canvas.stopRendering()
+        self.canvas.setExtent(QgsRectangle(*rect))
+        self.canvas.refresh()
+        self.prefetcher.extent_received(data)
                     
     def _on_crs_changed(self, data):
         self.dlg.qtsig_crs.emit(data)
@@ -346,18 +894,20 @@ class QollabEO:
         curr_cntr = self.canvas.center() 
         
         old_crs = self.canvas.mapSettings().destinationCrs()
-        old_crs_wkt = old_crs.toWkt()
-        
-        new_crs_wkt = data["crs"]
-        
-        if old_crs_wkt != new_crs_wkt:
+        ref, wkt = crs_of_msg(data)
+        
+        if not is_crs(old_crs, ref, wkt):
+            new_crs = crs_from_ref(ref, wkt)
+            if new_crs is None:
+                #custom crs not seen before; the host sends its wkt with crs_def
+                self.emit_msg_to_server("crs_want", msg_data=crs_msg(ref), nspace="/join")
+                return
+            
             choice = QMessageBox.question(self.meeting_dlg, 'Change CRS?',
                             "The host asks you to change your CRS.",
                             QMessageBox.Ok)
             
             if choice == QMessageBox.Ok:    
-                new_crs = QgsCoordinateReferenceSystem()
-                new_crs.createFromWkt(new_crs_wkt)
                 self.qgis_project.setCrs(new_crs)
                 
                 #necessary as otherwise the somethings wrong with the new center
@@ -367,62 +917,192 @@ class QollabEO:
                 self.canvas.setCenter(curr_cntr)
         
         #add memory layer for storing "notes" when user is NOT host; this is done after
-        #the user was asked to change his CRS to make sure its the same as the HOST
-        mem_lyr = QgsVectorLayer("Polygon?crs=%s" % (self.qgis_project.crs().toWkt()), "notes", "memory")
-        mem_lyr.loadNamedStyle(os.path.join(self.plugin_dir, "qmls", "notes_lyr_style.qml"))
-        mem_lyr_pro = mem_lyr.dataProvider()
-        mem_lyr_pro.addAttributes([QgsField("user", QVariant.String)])
-        mem_lyr_pro.addAttributes([QgsField("uid", QVariant.String)])
-        mem_lyr.updateFields()
-        self.mem_lyr = mem_lyr
-        
-        self.lyr_grp.insertLayer(0, mem_lyr)
-        self.qgis_project.addMapLayer(mem_lyr, False)
-        
-        # self.lyr_order = self.qgis_project.layerTreeRoot().layerOrder()
-        
-        self.rect_tool.set_lyr(mem_lyr)
-        self.rect_tool.set_dlg(self.meeting_dlg)
+        #the user was asked to change his CRS to make sure its the same as the HOST;
+        #the crs is sent again whenever another user joins, the layer is only created once
+        if self.mem_lyr is None:
+            self.add_notes_lyr()
+            
+            # self.lyr_order = self.qgis_project.layerTreeRoot().layerOrder()
+            
+            self.request_notes_sync()
+            #features which arrived before the layer existed
+            self.add_remote_feats()
      
+    def add_notes_lyr(self):
+        #memory layers (polygons, lines, points) with spatial index and uid lookup; see NotesLayers
+        self.notes = NotesLayers(self.qgis_project.crs().toWkt(), style_path=os.path.join(self.plugin_dir, "qmls", "notes_lyr_style.qml"))
+        self.mem_lyr = self.notes.layer
+        
+        for lyr in reversed(self.notes.layers()):
+            self.lyr_grp.insertLayer(0, lyr)
+            self.qgis_project.addMapLayer(lyr, False)
+        
+        for tool in (self.rect_tool, self.line_tool, self.polygon_tool, self.point_tool, self.move_tool, self.delete_tool):
+            tool.set_notes(self.notes)
+            tool.set_dlg(self.meeting_dlg)
+    
     def add_user(self, data):
-        print("%s entered the room." % (data["user"]))
-        self.meeting_dlg.add_user(name=data["user"], sid=data["sid"])
-        
-        data = {"rid":self.meeting_dlg.rid, 
-                "users":self.meeting_dlg.get_all_users()}
-        
-        self.emit_msg_to_server("user_list", msg_data=data, nspace="/start")
+        log_message("%s entered the room." % data["user"])
+        sid = data["sid"]
+        added = self.meeting_dlg.add_user(name=data["user"], sid=sid)
+        #users of older versions do not send their codecs and only understand wkt
+        self.peer_codecs[sid] = data.get("codecs", ["wkt"])
+        
+        #the full user list only goes to the new user; everyone else gets the change
+        roster = self.meeting_dlg.roster
+        if added:
+            roster.next_ver()
+        self.send_roster(sid)
+        if added:
+            self.emit_msg_to_server("user_joined", msg_data=user_joined_msg(roster.ver, sid, data["user"]), nspace="/start")
         #send the current crs when a new user joins the meeting; hence
         #his/her crs is automatically adjusted to the one of the host
-        #on startup
-        self.crs_changed()
+        #on startup. crs, codec and layers only go to the new user
+        self.crs_changed(to=sid)
+        
+        if not self.update_geom_codec():
+            self.emit_msg_to_server("set_codec", msg_data=dict(codec_msg(*self.geom_wire), to=sid), nspace="/start")
+        self.send_lyr_snapshot(sid)
+    
+    def sync_members(self, members):
+        #host after a journal snapshot; users who entered or left in the gap are added or removed as if
+        #their room_entered / room_left had arrived, the codecs of all others are taken over
+        if self.role != "HOST":
+            return
+        roster = self.meeting_dlg.roster
+        gone = [sid for sid in roster.sids if sid not in members and sid != self.meeting_dlg.sid]
+        for sid in gone:
+            self.remove_user({"sid": sid, "user": roster.names[sid]})
+        for sid in [sid for sid in self.peer_codecs if sid not in members]:
+            self.remove_user({"sid": sid})
+        for sid, member in members.items():
+            if sid in roster:
+                self.peer_codecs[sid] = member["codecs"]
+            else:
+                self.add_user(dict(member, sid=sid))
+        self.update_geom_codec()
+    
+    def update_geom_codec(self):
+        #host only; codec supported by everyone in the room with a resolution matching the session crs.
+        #sent to the room only if it changed; returns True then
+        codec = negotiate([available_codecs()] + list(self.peer_codecs.values()))
+        res = resolution_for_crs(self.qgis_project.crs().isGeographic())
+        if (codec, res) == self.geom_wire:
+            return False
+        
+        self.geom_wire = (codec, res)
+        self.emit_msg_to_server("set_codec", msg_data=codec_msg(codec, res), nspace="/start")
+        return True
+    
+    def _on_codec_changed(self, data):
+        self.geom_wire = (data["codec"], data["res"])
+    
+    def send_roster(self, sid=None):
+        #host only; user list with the roster version to a single user (without sid to the room)
+        roster = self.meeting_dlg.roster
+        data = user_list_msg(self.meeting_dlg.rid, roster.users, ver=roster.ver, to=sid)
+        self.emit_msg_to_server("user_list", msg_data=data, nspace="/start")
+    
+    def _on_roster_sync(self, data):
+        self.dlg.qtsig_roster_sync.emit(data)
+    
+    def send_roster_to(self, data):
+        if self.role == "HOST":
+            self.send_roster(data["sid"])
+    
+    def request_roster_sync(self, force=False):
+        #participants; a missed roster change is repaired with the full user list of the host
+        if self.meeting_dlg.roster.want_sync(force):
+            self.emit_msg_to_server("roster_sync", msg_data={}, nspace="/join")
     
     def add_user_from_list(self, data):
-        self.meeting_dlg.add_user_from_list(data)
+        if "ver" not in data:
+            #hosts of older versions send the full list on every change
+            self.meeting_dlg.add_user_from_list(user_list_users(data))
+            return
+        self.meeting_dlg.reset_users(data["ver"], data["users"])
     
     def _on_user_list(self, data):
         self.dlg.qtsig_user_list.emit(data)
+    
+    def _on_roster_event(self, data):
+        self.dlg.qtsig_roster.emit(data)
+    
+    def apply_roster_event(self, data):
+        #user_joined / user_left of the host; applied in the order of their versions only
+        state = self.meeting_dlg.roster.accept(data)
+        if state == "sync":
+            self.request_roster_sync()
+        elif state == "apply" and "user" in data:
+            self.meeting_dlg.add_user(name=data["user"], sid=data["sid"])
+        elif state == "apply":
+            self.meeting_dlg.remove_user(data)
      
     def launch_dlg_closed(self):
+        #leave the session namespace but keep the connection for the next session
+        self.disconnect_from_server(nspace=self.session_nspace())
+        
         self.role = None
         self.remove_host_handlers()
+        self.extent_slot.take()
+        self.prefetcher.stop()
+        self.local_feats.drain()
+        self.remote_feats.drain()
+        self.notes_replica.reset()
+        self.grp_replica.reset()
+        self.remote_keys = {}
+        self.lyr_streams = {}
+        self.lyr_stream_waiting = {}
+        self.lyr_chunk_tasks = {}
+        self.lyr_receivers = {}
+        self.stream_timer.stop()
+        self.metrics_timer.stop()
+        self.raster_sources = {}
+        #assembled rasters stay pinned in raster_files as their layers remain in the project
+        for key in list(self.raster_pulls):
+            self.drop_raster_pull(key)
+        self.mem_lyr = None
+        self.notes = None
+        self.geom_wire = ("wkt", None)
+        self.stroke_inbox.drain()
+        self.stroke_preview.clear()
+        self.stroke_view = StrokeView()
         
-        self.disconnect_from_server()
         self.dlg.setEnabled(True)
         self.dlg.showNormal()
     
     def launch_room_dlg(self, data):
+        from .qollabeo_meeting_dialog import MeetingDialog
         
         self.meeting_dlg = MeetingDialog()
         self.meeting_dlg.closed.connect(self.launch_dlg_closed)
         self.meeting_dlg.qtsig_local_feat_added.connect(self.local_feat_added)
+        self.meeting_dlg.qtsig_local_stroke.connect(self.send_stroke)
+        self.meeting_dlg.qtsig_local_feat_changed.connect(self.local_feat_changed)
 
         self.meeting_dlg.rid = data["rid"]
         
         self.meeting_dlg.setWindowTitle(data["title"])        
+        #the roster of the host starts at version 0; participants get theirs with the first user list
+        if self.role == "HOST":
+            self.meeting_dlg.roster.reset(0)
         self.meeting_dlg.add_user(name=data["user"], sid=data["sid"])
         
-        self.meeting_dlg.add_rect_button.clicked.connect(self.set_rect_tool)
+        self.note_tools = {self.meeting_dlg.add_rect_button: self.rect_tool,
+                           self.meeting_dlg.add_line_button: self.line_tool,
+                           self.meeting_dlg.add_polygon_button: self.polygon_tool,
+                           self.meeting_dlg.add_point_button: self.point_tool,
+                           self.meeting_dlg.move_note_button: self.move_tool,
+                           self.meeting_dlg.delete_note_button: self.delete_tool}
+        for button in self.note_tools:
+            button.clicked.connect(partial(self.set_note_tool, button))
+        self.meeting_dlg.export_metrics_button.clicked.connect(self.export_metrics)
+        self.meeting_dlg.sid = data["sid"]
+        self.notes_replica.sid = data["sid"]
+        
+        self.metrics.reset()
+        self.metrics_timer.start()
+        self.metrics_tick()
         
         self.meeting_dlg.show()
         
@@ -439,104 +1119,427 @@ class QollabEO:
             self.canvas_signal_extent = self.canvas.extentsChanged.connect(self.canvas_changed)
             self.canvas_signal_crs = self.canvas.destinationCrsChanged.connect(self.crs_changed)
 
-            self.grp_pre_add_event = self.lyr_grp.willAddChildren.connect(self.pre_lyr_added)
-            self.grp_add_event = self.lyr_grp.addedChildren.connect(self.lyr_added)
-            self.grp_vis_event = self.lyr_grp.visibilityChanged.connect(self.lyr_vis_changed)
-            
-            self.grp_pre_rem_event = self.lyr_grp.willRemoveChildren.connect(self.pre_lyr_removed)
-            self.grp_rem_event = self.lyr_grp.removedChildren.connect(self.lyr_removed)
-            
             #add memory layer for storing "notes" when user is host
-            mem_lyr = QgsVectorLayer("Polygon?crs=%s" % (self.qgis_project.crs().toWkt()), "notes", "memory")
-            mem_lyr.loadNamedStyle(os.path.join(self.plugin_dir, "qmls", "notes_lyr_style.qml"))
-            mem_lyr_pro = mem_lyr.dataProvider()
-            mem_lyr_pro.addAttributes([QgsField("user", QVariant.String)])
-            mem_lyr_pro.addAttributes([QgsField("uid", QVariant.String)])
-            mem_lyr.updateFields()
-            self.mem_lyr = mem_lyr
-            # mem_lyr.featureAdded.connect(self.feat_added)
+            self.add_notes_lyr()
+            
+            #layers already in the group are part of the initial state; joining users get it as snapshot
+            grp_lyrs = self.lyr_grp.findLayers()
+            self.lyr_registry.reset((tree_lyr.layerId(), info) for tree_lyr, info in self.synced_lyrs(grp_lyrs))
+            tree_lyrs = {}
+            for tree_lyr in grp_lyrs:
+                if tree_lyr.layerId() in self.lyr_registry:
+                    tree_lyrs.setdefault(self.lyr_registry.key(tree_lyr.layerId()), tree_lyr)
+            self.grp_state.reset(0, tree_lyrs.keys(), [tree_lyr.isVisible() for tree_lyr in tree_lyrs.values()])
+            for info in list(self.lyr_registry.layers.values()):
+                if info.get("kind") == "raster":
+                    self.hash_raster(info["key"])
             
-            self.lyr_grp.insertLayer(0, mem_lyr)
+            #the signals carry the parent node and the range of changed children; descendants of
+            #nested groups are forwarded by the group with their direct parent as node
+            self.grp_add_event = self.lyr_grp.addedChildren.connect(self.lyrs_added)
+            self.grp_vis_event = self.lyr_grp.visibilityChanged.connect(self.lyrs_vis_changed)
+            self.grp_pre_rem_event = self.lyr_grp.willRemoveChildren.connect(self.lyrs_removing)
             # self.lyr_grp_order = self.lyr_grp.layerOrder()
             # self.lyr_order = root.layerOrder()
             
-            self.qgis_project.addMapLayer(mem_lyr, False)
-            self.rect_tool.set_lyr(mem_lyr)
-            self.rect_tool.set_dlg(self.meeting_dlg)
+            self.request_notes_sync()
+            
+            self.peer_codecs = {}
+            self.update_geom_codec()
+        else:
+            self.prefetcher.start()
             
         self.dlg.setEnabled(False)
         self.dlg.showMinimized()
 
     def local_feat_added(self, data):
-        if self.role == "HOST":
-            self.emit_msg_to_server("feat_added", msg_data=data, nspace="/start")
+        self.notes_replica.add_local(data["uid"])
+        if self.local_feats.put(data):
+            QTimer.singleShot(self.feat_batch_ms, self.send_local_feats)
+    
+    def send_local_feats(self):
+        feats = self.local_feats.drain()
+        if len(feats) == 0:
+            return
+        
+        codec, res = self.geom_wire
+        for feat in feats:
+            feat["geom"] = encode_geom(feat["geom"], codec, res, rect=feat.pop("rect", None))
+            self.notes_replica.sent(feat["uid"], "feat_batch", feat_batch_msg([feat], codec, res))
+        
+        nspace = self.session_nspace()
+        self.emit_msg_to_server("feat_batch", msg_data=feat_batch_msg(feats, codec, res), nspace=nspace)
+    
+    def local_feat_changed(self, data):
+        #a note moved (geom) or deleted (geom None) with the edit tools; the layer is already changed
+        uid = data["uid"]
+        deleted = data["geom"] is None
+        clock = self.notes_replica.change_local(uid, deleted=deleted)
+        sid = self.notes_replica.sid
+        if deleted:
+            event, msg = "feat_delete", feat_delete_msg(uid, clock, sid=sid)
         else:
-            self.emit_msg_to_server("feat_added", msg_data=data, nspace="/join")
+            codec, res = self.geom_wire
+            event, msg = "feat_update", feat_update_msg(uid, encode_geom(data["geom"], codec, res), codec, res, clock, sid=sid)
+        self.notes_replica.sent(uid, event, msg)
+        self.emit_msg_to_server(event, msg_data=msg, nspace=self.session_nspace())
+    
+    def send_stroke(self, event, data):
+        self.emit_msg_to_server(event, msg_data=data, nspace=self.session_nspace())
+    
+    #strokes of the other users are collected on the socket thread and drawn once per batch
+    def _on_stroke(self, event, data):
+        if self.stroke_inbox.put((event, data)):
+            self.dlg.qtsig_stroke.emit(None)
     
+    def draw_remote_strokes(self, data=None):
+        for event, data in self.stroke_inbox.drain():
+            uid = data["uid"]
+            if event == "stroke_begin":
+                stroke = self.stroke_view.begin(data)
+                self.stroke_preview.begin(uid, stroke["kind"], stroke["pts"])
+            elif event == "stroke_append":
+                pts = self.stroke_view.append(data)
+                if pts is not None:
+                    self.stroke_preview.append(uid, pts)
+            elif not data.get("kept", True):
+                self.stroke_view.end(uid)
+                self.stroke_preview.remove(uid)
+            else:
+                #a kept stroke stays visible until its note arrives
+                self.stroke_view.kept(uid)
+    
+    #feat_added is still understood for clients which do not send batches yet;
+    #both handlers run on the socket thread and only wake the gui thread once per batch
     def _on_feat_added(self, data):
-        self.dlg.qtsig_feat_added.emit(data)
+        if self.remote_feats.put(data):
+            self.dlg.qtsig_feat_added.emit(None)
+    
+    def _on_feat_batch(self, data):
+        if self.remote_feats.extend(batch_feats(data)):
+            self.dlg.qtsig_feat_added.emit(None)
+    
+    #updates and deletes go through the same inbox, hence, they are merged in the order they arrived
+    def _on_feat_changed(self, data):
+        if self.remote_feats.put(changed_note(data)):
+            self.dlg.qtsig_feat_added.emit(None)
     
-    def add_remote_feat(self, data):
-        feat = QgsFeature(self.mem_lyr.fields())
-        feat.setAttribute('user', data["user"])
-        feat.setAttribute('uid', data["uid"])
-        feat.setGeometry(QgsGeometry.fromWkt(data["geom"]))
-        (res, outFeats) = self.mem_lyr.dataProvider().addFeatures([feat])
-        self.mem_lyr.reload()
+    def add_remote_feat(self, data=None):
+        #wait a short moment to collect features arriving right after the first one
+        QTimer.singleShot(self.feat_batch_ms, self.add_remote_feats)
     
-    def lyr_vis_changed(self, lyr):
+    def add_remote_feats(self):
+        #keep the features in the inbox until the notes layer exists
+        if self.mem_lyr is None:
+            return
         
-        is_visible = lyr.itemVisibilityChecked()
-        lyr = lyr.layer()
-        lyr_prov = lyr.providerType()
-        send_data = {"name":lyr.name(), "is_visible":is_visible}
+        self.apply_notes_changes(self.notes_replica.accept(self.remote_feats.drain()))
+    
+    def apply_notes_changes(self, changes):
+        #changes of the replica as [(kind, note), ...]; only the last one of every note matters
+        added, changed, deleted = squash_changes(changes, self.notes.has)
+        self.notes.delete(deleted)
+        self.notes.change_geoms({uid: decode_geom(note["geom"], note.get("codec"), note.get("res")) for uid, note in changed.items()})
+        self.add_feats_to_notes(added)
+    
+    def add_feats_to_notes(self, feats_data):
+        if len(feats_data) == 0:
+            return
         
-        if lyr_prov == "wms":
-            self.emit_msg_to_server("lyr_vis_changed", msg_data=send_data, nspace="/start")
+        fields = self.notes.fields()
+        feats = []
+        for data in feats_data:
+            #the note replaces the preview of its stroke
+            if data["uid"] in self.stroke_view.strokes:
+                self.stroke_view.end(data["uid"])
+                self.stroke_preview.remove(data["uid"])
+            #notes drawn locally are already in the layer
+            if self.notes.has(data["uid"]):
+                continue
+            feat = QgsFeature(fields)
+            feat.setAttribute('user', data["user"])
+            feat.setAttribute('uid', data["uid"])
+            feat.setGeometry(decode_geom(data["geom"], data.get("codec"), data.get("res")))
+            feats.append(feat)
+        
+        self.notes.add_feats(feats)
+    
+    def request_notes_sync(self, after=None):
+        #ask for everything after the last known sequence number (-1 requests a snapshot) or for the next page
+        nspace = self.session_nspace()
+        self.emit_msg_to_server("notes_sync", msg_data=dict(self.notes_replica.sync_msg(after), rid=self.meeting_dlg.rid), nspace=nspace)
+    
+    def _on_notes_state(self, data):
+        self.dlg.qtsig_notes_state.emit(data)
+    
+    def add_notes_state(self, data):
+        changes, next_seq = self.notes_replica.accept_state(data)
+        
+        #notes from the snapshot/delta are already merged by the replica
+        if self.mem_lyr is not None:
+            self.apply_notes_changes(changes)
+        
+        #large states are sent in pages
+        if next_seq is not None:
+            self.request_notes_sync(next_seq)
+    
+    def lyrs_vis_changed(self, node):
+        #toggling a group or a map theme changes many layers; only the layers below node are visited,
+        #all of them are sent with the next diff
+        tree_lyrs = [node] if QgsLayerTree.isLayer(node) else node.findLayers()
+        for tree_lyr in tree_lyrs:
+            if tree_lyr.layerId() in self.lyr_registry:
+                self.grp_state.set_visible(self.lyr_registry.key(tree_lyr.layerId()), tree_lyr.isVisible())
+        self.schedule_lyr_diff()
 
-    def pre_lyr_added(self, lyr_grp):
-        lyrs_in_grp = lyr_grp.findLayers()
-        lid_in_grp = [lyr.layerId() for lyr in lyrs_in_grp if lyr.layer().providerType() == "wms" and lyr.layerId() != self.mem_lyr.id()]
-        self.pre_lids = lid_in_grp
+    def synced_lyrs(self, tree_lyrs, tix=0):
+        #(tree layer, info) of the wms and vector layers among tree_lyrs; the notes layer is never synchronised as layer
+        for tree_lyr in tree_lyrs:
+            lyr = tree_lyr.layer()
+            if lyr is None or lyr.id() in self.notes_lids():
+                continue
+            if lyr.providerType() == "wms":
+                yield tree_lyr, {"name":lyr.name(), "source":lyr.source(), "tix":tix}
+            elif is_streamable(lyr):
+                yield tree_lyr, dict(layer_info(lyr), tix=tix)
+            elif is_shareable_raster(lyr):
+                yield tree_lyr, dict(raster_info(lyr), tix=tix)
+    
+    def synced_pred(self, node, ix):
+        #key of the last synchronised layer in front of child ix of node (None: there is none); only the
+        #nodes up to this layer are visited, usually just the previous sibling
+        while True:
+            for child in reversed(node.children()[:ix]):
+                tree_lyrs = [child] if QgsLayerTree.isLayer(child) else child.findLayers()
+                for tree_lyr in reversed(tree_lyrs):
+                    if tree_lyr.layerId() in self.lyr_registry:
+                        return self.lyr_registry.key(tree_lyr.layerId())
+            parent = node.parent()
+            if node is self.lyr_grp or parent is None:
+                return None
+            ix = parent.children().index(node)
+            node = parent
+    
+    def changed_tree_lyrs(self, node, ix_from, ix_to):
+        #tree layers of the changed children; only the changed range is visited, not the whole group
+        for ix, child in enumerate(node.children()[ix_from:ix_to + 1], ix_from):
+            if QgsLayerTree.isLayer(child):
+                yield ix, [child]
+            elif QgsLayerTree.isGroup(child):
+                yield ix, child.findLayers()
+    
+    def lyrs_added(self, node, ix_from, ix_to):
+        #the new layers are placed behind the synchronised layer in front of them
+        after = self.synced_pred(node, ix_from)
+        for ix, tree_lyrs in self.changed_tree_lyrs(node, ix_from, ix_to):
+            #the index is only meaningful for direct children of the QollabEO group
+            tix = ix if node is self.lyr_grp else 0
+            for tree_lyr, info in self.synced_lyrs(tree_lyrs, tix):
+                key = self.lyr_registry.add(tree_lyr.layerId(), info)
+                self.grp_state.insert(key, after, tree_lyr.isVisible())
+                after = key
+        self.schedule_lyr_diff()
+    
+    def lyrs_removing(self, node, ix_from, ix_to):
+        for _, tree_lyrs in self.changed_tree_lyrs(node, ix_from, ix_to):
+            for tree_lyr in tree_lyrs:
+                key = self.lyr_registry.remove(tree_lyr.layerId())
+                if key is not None:
+                    self.grp_state.remove(key)
+        self.schedule_lyr_diff()
+    
+    def schedule_lyr_diff(self):
+        #adding or removing many layers (or moving them by drag and drop) fires many tree signals
+        #within one event loop pass; they are sent as a single lyrs_changed message afterwards
+        if not self.lyr_diff_pending:
+            self.lyr_diff_pending = True
+            QTimer.singleShot(0, self.send_lyr_diff)
+    
+    def send_lyr_diff(self, full=False):
+        #the order and visibility are kept up to date by the tree signals (see lyrs_added); only
+        #a full resync compares them with the whole group in a second diff
+        self.lyr_diff_pending = False
+        if self.role != "HOST":
+            return
         
-    def lyr_added(self, lyr_grp):
-        #exclude notes layer from lids_in_grp as we use this list for setting the custom layer order
-        lyrs_in_grp = lyr_grp.findLayers()
-        lids_in_grp = [lyr.layerId() for lyr in lyrs_in_grp if lyr.layer().providerType() == "wms" and lyr.layerId() != self.mem_lyr.id()]
-        added_lid = list(set(lids_in_grp) - set(self.pre_lids))
+        new_lyrs = added = self.lyr_registry.take_diff()["added"]
+        diffs = [self.grp_state.commit()]
+        if full:
+            #effective visibility; layers of hidden sub groups are hidden for followers as well
+            tree_lyrs = {}
+            for tree_lyr in self.lyr_grp.findLayers():
+                if tree_lyr.layerId() in self.lyr_registry:
+                    tree_lyrs.setdefault(self.lyr_registry.key(tree_lyr.layerId()), tree_lyr)
+            diffs.append(self.grp_state.update(tree_lyrs.keys(), [tree_lyr.isVisible() for tree_lyr in tree_lyrs.values()]))
+        
+        for diff in diffs:
+            if diff is None:
+                continue
+            if diff["mv"] or diff["rm"]:
+                self.update_lyr_order([self.lyr_registry.lid(key) for key in self.grp_state.order])
+            for key in diff["rm"]:
+                self.lyr_streams.pop(key, None)
+                self.raster_sources.pop(key, None)
+            diff["added"], added = added, []
+            self.emit_msg_to_server("lyrs_changed", msg_data=diff, nspace="/start")
+        
+        for info in new_lyrs:
+            if info.get("kind") == "raster":
+                self.hash_raster(info["key"])
+    
+    def hash_raster(self, key):
+        #hashing a large raster takes a while; the manifest is sent with lyr_manifest once ready
+        lyr = self.qgis_project.mapLayer(self.lyr_registry.lid(key) or "")
+        if lyr is None:
+            return
+        path, chunk_bytes = raster_path(lyr), self.raster_chunk_bytes
+        task = QgsTask.fromFunction("QollabEO: preparing %s" % lyr.name(), lambda task: file_manifest(path, chunk_bytes),
+                                    on_finished=partial(self.raster_hashed, key, path))
+        self.raster_tasks.append(task)
+        QgsApplication.taskManager().addTask(task)
+    
+    def raster_hashed(self, key, path, exception, manifest=None):
+        lid = self.lyr_registry.lid(key)
+        if exception is not None or manifest is None or lid is None or self.role != "HOST":
+            return
         
-        if len(added_lid) == 1:
+        index = {}
+        for ix, digest in enumerate(manifest["chunks"]):
+            index.setdefault(digest, ix)
+        self.raster_sources[key] = (path, manifest, index)
         
-            lyr_ix = lids_in_grp.index(added_lid[0])
-            added_lyr = lyrs_in_grp[lyr_ix].layer()
-            
-            #always set the notes layer at index 0 for rendering; on top of everything else
-            cust_order = [self.mem_lyr.id()] + lids_in_grp
-            self.qgis_project.layerTreeRoot().setCustomLayerOrderByIds(cust_order)
-            
-            send_data = {"name":added_lyr.name(), "source":added_lyr.source(), "tix":lyr_ix}
-            
-            self.emit_msg_to_server("lyr_added", msg_data=send_data, nspace="/start")
-                    
-    def pre_lyr_removed(self, lyr_grp):
-        lyrs_in_grp = lyr_grp.findLayers()
-        lyr_names_in_grp = [lyr.layer().name() for lyr in lyrs_in_grp if lyr.layer().providerType() == "wms"]
-        self.pre_lyr_names = lyr_names_in_grp
+        #users joining later get the manifest with the snapshot
+        self.lyr_registry.layers[lid]["manifest"] = manifest
+        self.emit_msg_to_server("lyr_manifest", msg_data={"key":key, "manifest":manifest}, nspace="/start")
+    
+    def _on_lyr_want(self, data):
+        self.dlg.qtsig_lyr_stream.emit(dict(data, op="want"))
+    
+    def serve_raster_want(self, data):
+        source = self.raster_sources.get(data["key"])
+        if source is None:
+            return
+        path, manifest, index = source
+        for digest in data["hashes"]:
+            ix = index.get(digest)
+            if ix is not None:
+                blob = {"key":data["key"], "hash":digest, "data":read_chunk(path, manifest, ix), "to":data["sid"]}
+                self.emit_msg_to_server("lyr_blob", msg_data=blob, nspace="/start")
+    
+    def send_lyr_snapshot(self, sid=None):
+        #host only; pending changes are sent to the room first, the snapshot holds the state after them
+        #and only goes to the user which joined or asked for it (without sid to the room)
+        self.send_lyr_diff()
+        snapshot = self.grp_state.snapshot()
+        snapshot["added"] = list(self.lyr_registry.layers.values())
+        if sid is not None:
+            snapshot["to"] = sid
+        self.emit_msg_to_server("lyrs_changed", msg_data=snapshot, nspace="/start")
+    
+    def _on_lyrs_sync(self, data):
+        self.dlg.qtsig_lyrs_sync.emit(data)
+    
+    def send_lyrs_to(self, data):
+        if self.role == "HOST":
+            self.send_lyr_snapshot(data["sid"])
+    
+    def _on_lyr_resume(self, data):
+        self.dlg.qtsig_lyr_stream.emit(dict(data, op="resume"))
+    
+    def _on_lyr_ack(self, data):
+        self.dlg.qtsig_lyr_stream.emit(dict(data, op="ack"))
+    
+    def handle_lyr_stream(self, data):
+        if data["op"] == "want":
+            self.serve_raster_want(data)
+            return
         
-    def lyr_removed(self, lyr_grp):
-        lyrs_in_grp = lyr_grp.findLayers()
-        curr_lyr_names =  [lyr.layer().name() for lyr in lyrs_in_grp if lyr.layer().providerType() == "wms"]
-
-        rem_lyr_name = list(set(self.pre_lyr_names) - set(curr_lyr_names))
-        if len(rem_lyr_name) == 1:
-            send_data =  {"name":rem_lyr_name[0]}
-            self.emit_msg_to_server("lyr_removed", msg_data=send_data, nspace="/start")
+        #the sender of a layer is only created once the first user asks for its features; the
+        #feature ids of a large layer are collected in a task, requests arriving meanwhile wait
+        key = data["key"]
+        sender = self.lyr_streams.get(key)
+        if sender is None:
+            if key in self.lyr_stream_waiting:
+                self.lyr_stream_waiting[key].append(data)
+                return
+            lid = self.lyr_registry.lid(key)
+            lyr = self.qgis_project.mapLayer(lid) if lid is not None else None
+            if lyr is None or not is_streamable(lyr):
+                return
+            self.lyr_stream_waiting[key] = [data]
+            source = feature_source(lyr)
+            task = QgsTask.fromFunction("QollabEO: preparing %s" % lyr.name(), lambda task: sorted_fids(source),
+                                        on_finished=partial(self.lyr_fids_ready, key))
+            self.lyr_tasks.append(task)
+            QgsApplication.taskManager().addTask(task)
+            return
+        
+        self.apply_lyr_stream_op(sender, data)
+    
+    def lyr_fids_ready(self, key, exception, fids=None):
+        waiting = self.lyr_stream_waiting.pop(key, [])
+        lid = self.lyr_registry.lid(key)
+        lyr = self.qgis_project.mapLayer(lid) if lid is not None else None
+        if exception is not None or fids is None or lyr is None or self.role != "HOST":
+            return
+        sender = layer_sender(lyr, fids, self.stream_chunk_bytes, self.stream_window)
+        self.lyr_streams[key] = sender
+        for data in waiting:
+            self.apply_lyr_stream_op(sender, data)
+    
+    def apply_lyr_stream_op(self, sender, data):
+        if data["op"] == "resume":
+            sender.add_receiver(data["sid"], int(data["after"]), stalled=bool(data.get("stalled")))
+        else:
+            sender.ack(data["sid"], int(data["k"]))
+        self.schedule_lyr_pump()
+    
+    def schedule_lyr_pump(self):
+        if not self.stream_pump_pending:
+            self.stream_pump_pending = True
+            QTimer.singleShot(0, self.pump_lyr_streams)
+    
+    def pump_lyr_streams(self):
+        self.stream_pump_pending = False
+        if self.role != "HOST":
+            return
+        #only chunks which are built are sent here, one per stream and event loop pass; reading the
+        #features for the next one takes a while and runs in a task (see build_lyr_chunk)
+        busy = False
+        for key, sender in list(self.lyr_streams.items()):
+            for k, rid in sender.next_sends(limit=1, build=False):
+                payload, last = sender.chunk(k)
+                msg = {"key":key, "k":k, "data":payload, "last":last}
+                #chunks for a single user (resume, late join) are only forwarded to this user
+                if rid is not None:
+                    msg["to"] = rid
+                self.emit_msg_to_server("lyr_chunk", msg_data=msg, nspace="/start")
+                busy = True
+            if sender.wanted is not None and key not in self.lyr_chunk_tasks:
+                self.build_lyr_chunk(key, sender, sender.wanted)
+        
+        if busy:
+            self.schedule_lyr_pump()
+    
+    def build_lyr_chunk(self, key, sender, k):
+        job = sender.job(k)
+        task = QgsTask.fromFunction("QollabEO: sending layer", lambda task: sender.build(*job),
+                                    on_finished=partial(self.lyr_chunk_built, key, sender, k))
+        self.lyr_chunk_tasks[key] = task
+        QgsApplication.taskManager().addTask(task)
+    
+    def lyr_chunk_built(self, key, sender, k, exception, result=None):
+        self.lyr_chunk_tasks.pop(key, None)
+        if exception is not None or result is None or self.role != "HOST" or self.lyr_streams.get(key) is not sender:
+            return
+        sender.store(k, *result)
+        self.schedule_lyr_pump()
         
     def _on_start_failed(self):
-        self.disconnect_from_server()
+        self.disconnect_from_server(nspace="/start")
     
     def _on_join_failed(self):
-        self.disconnect_from_server()
+        self.disconnect_from_server(nspace="/join")
     
     def _on_room_left(self, data):
         self.dlg.qtsig_room_left.emit(data)
@@ -545,7 +1548,18 @@ class QollabEO:
         self.dlg.qtsig_room_closed.emit()
     
     def remove_user(self, data):
-        self.meeting_dlg.remove_user(data)
+        removed = self.meeting_dlg.remove_user(data)
+        self.metrics.forget_peer(data["sid"])
+        for uid in self.stroke_view.end_of(data["sid"]):
+            self.stroke_preview.remove(uid)
+        if self.role == "HOST" and removed:
+            ver = self.meeting_dlg.roster.next_ver()
+            self.emit_msg_to_server("user_left", msg_data=user_left_msg(ver, data["sid"]), nspace="/start")
+        if self.role == "HOST" and self.peer_codecs.pop(data["sid"], None) is not None:
+            self.update_geom_codec()
+        if self.role == "HOST":
+            for sender in self.lyr_streams.values():
+                sender.remove_receiver(data["sid"])
     
     def leave_session(self):
         self.meeting_dlg.setEnabled(False)
@@ -558,29 +1572,108 @@ class QollabEO:
             self.launch_dlg_closed()       
         
     def _on_connect(self):
-        print("connected to server")
+        log_message("Connected to server.")
+        self.net.report_state("connected")
+        #after a reconnect within a meeting only the notes missed in between are requested
+        if self.role == "USER" and self.sio.get_sid(namespace="/join") is not None:
+            #the roster lists this user under the new sid from now on
+            self.join_auth["sid"] = self.meeting_dlg.sid = self.sio.get_sid(namespace="/join")
+        if self.role is not None:
+            #messages held back during the outage are sent first
+            self.net.flush(self.session_nspace())
+        if self.role is not None and self.mem_lyr is not None:
+            #a resume request lost with the old connection is sent again
+            self.journal_cursor.resume_pending = False
+            self.meeting_dlg.roster.sync_pending = False
+            self.request_resume()
+            self.request_notes_sync()
+            #layer transfers continue after the last received chunk
+            for key in list(self.lyr_receivers):
+                self.resume_lyr_stream(key, stalled=True)
+            for key, entry in list(self.raster_pulls.items()):
+                if entry["pull"] is not None:
+                    self.request_raster_chunks(key, wants=entry["pull"].retry())
 
+    def metrics_tick(self):
+        #runs on the gui thread; the pong and the stats of the others arrive on the socket thread
+        if self.role is None:
+            return
+        nspace = self.session_nspace()
+        self.net.emit_msg("clock_ping", {"t0":now_ms()}, nspace)
+        self.emit_msg_to_server("peer_stats", msg_data=dict(self.metrics.summary(), user=self.name), nspace=nspace)
+        #the stats of all members only go to the host; participants fetch them while they look at them
+        if self.role == "USER" and self.meeting_dlg.isActiveWindow():
+            self.net.emit_msg("peer_table", {}, nspace)
+        #previews of strokes whose end or note got lost (stroke messages are not journaled)
+        for uid in self.stroke_view.expire():
+            self.stroke_preview.remove(uid)
+        #own notes and changes whose echo is overdue are sent again; the ack waits for them
+        if self.sio.connected:
+            for event, msg in self.notes_replica.resend(timeout=self.resend_s):
+                self.emit_msg_to_server(event, msg_data=msg, nspace=nspace)
+        #the server drops tombstones of deleted notes once everyone acknowledged them; not while events are missing
+        ack = None if self.journal_cursor.resume_pending else self.notes_replica.take_ack()
+        if ack is not None:
+            self.emit_msg_to_server("notes_ack", msg_data={"seq":ack}, nspace=nspace)
+        self.meeting_dlg.show_metrics(self.metrics.summary(), self.metrics.to_dict()["peers"])
+    
+    def _on_clock_pong(self, data):
+        self.metrics.pong(data["t0"], data["ts"])
+    
+    def _on_peer_stats(self, data):
+        self.metrics.peer(data["sid"], data)
+    
+    def _on_peer_table(self, data):
+        for stats in data["peers"]:
+            self.metrics.peer(stats["sid"], stats)
+    
+    def export_metrics(self):
+        path, _ = QFileDialog.getSaveFileName(self.meeting_dlg, "Export sync metrics", "qollabeo_metrics.json", "JSON (*.json)")
+        if not path:
+            return
+        export = self.metrics.to_dict()
+        export.update({"rid":self.meeting_dlg.rid, "role":self.role, "user":self.name, "users":self.meeting_dlg.get_all_users()})
+        with open(path, "w") as fobj:
+            json.dump(export, fobj, indent=2)
+        self.show_message("Sync metrics exported.", level="success")
+    
     def _on_disconnect(self):
-        print('disconnected from server')
+        log_message("Disconnected from server.", Qgis.Warning)
+        if not self.sio.connected:
+            self.net.report_state("disconnected")
     
     def _on_connect_error(self, data):
-        print(data)
-        self.disconnect_from_server()
+        #a refused namespace (e.g. wrong password) must not close the shared connection;
+        #connect_to_server reports the failed attach
+        log_message("Connection refused: %s" % (data,), Qgis.Warning)
+    
+    def session_nspace(self):
+        return "/start" if self.role == "HOST" else "/join"
     
-    def disconnect_from_server(self):
-        self.sio.disconnect()
-        self.sio.eio.disconnect(abort=True)
+    def disconnect_from_server(self, nspace=None):
+        #without namespace the whole connection is closed
+        if nspace is None:
+            self.net.close()
+        else:
+            self.net.detach(nspace)
     
     def connect_to_server(self, url=None, sio_path=None, nspaces=None, auth=None, headers=None):
+        #returns immediately; messages emitted afterwards are sent once the namespace
+        #is attached or dropped if attaching fails (see nspace_attached)
         if url is None:
             url = self.url
         if sio_path is None:
             sio_path = self.sio_path
-            
-        try:
-            self.sio.connect(url, socketio_path=sio_path, wait=True, auth=auth, headers=headers, namespaces=nspaces)
-        except:
+        
+        self.net.attach(nspaces, url, sio_path, auth=auth, headers=headers)
+    
+    def nspace_attached(self, nspace, ok):
+        if not ok:
             self.show_message("No connection to server.", level="critical")
+    
+    def connection_state_changed(self, state):
+        if state == "disconnected" and self.role is not None:
+            self.show_message("Connection to server lost.", level="warning")
 
     def schedule_session(self):
         
@@ -615,11 +1708,9 @@ class QollabEO:
             return
         
         self.connect_to_server(nspaces="/schedule")
-        
-        if self.sio.connected:
-            self.emit_msg_to_server(msg_type="schedule_session", 
-                                    msg_data={"mail":curr_email, "from":from_time.strftime("%Y-%m-%d %H:%M:%S"), "to":to_time.strftime("%Y-%m-%d %H:%M:%S"), "title":curr_title},
-                                    nspace="/schedule")
+        self.emit_msg_to_server(msg_type="schedule_session", 
+                                msg_data={"mail":curr_email, "from":from_time.strftime("%Y-%m-%d %H:%M:%S"), "to":to_time.strftime("%Y-%m-%d %H:%M:%S"), "title":curr_title},
+                                nspace="/schedule")
     
     def show_message(self, msg=None, level="info", seconds=3):
         if level == "info":
@@ -638,12 +1729,8 @@ class QollabEO:
     def fill_table_session(self):
         self.dlg.table_session.setRowCount(0)
                         
-        sid_db = sqlite3.connect(self.sid_db_path)
-        db_cur = sid_db.cursor()
-        
-        #only add items to the table which have a to_time less than the current hour;
-        db_cur.execute("SELECT * FROM sessions WHERE to_time >= strftime('%Y-%m-%d %H', 'now', '-1 hour')")
-        rows = db_cur.fetchall()
+        #only add items to the table which ended less than an hour ago;
+        rows = self.sessions.upcoming_sessions()
         #0:mail;1:title;2:rid;3:pwd;4:from;5:to
         
         for ix, row in enumerate(rows):
@@ -661,6 +1748,14 @@ class QollabEO:
             self.btn_copy.clicked.connect(self.get_clicked_tix)
             
             self.dlg.table_session.setCellWidget(ix,6,self.btn_copy)
+        
+        #move expired sessions to the archive once the table is shown
+        QTimer.singleShot(0, self.prune_sessions)
+    
+    def prune_sessions(self):
+        #small batches; the gui stays responsive even with a long history
+        if self.sessions.prune() > 0:
+            QTimer.singleShot(50, self.prune_sessions)
     
     def get_clicked_tix(self):
         button = QApplication.focusWidget()
@@ -668,7 +1763,6 @@ class QollabEO:
         if index.isValid():
             
             self.get_row_vals(index.row())
-            # print(index.row(), index.column())
     
     def get_row_vals(self, tix):
         # sel_title = self.dlg.table_session.item(tix, 0).text()
@@ -710,9 +1804,7 @@ class QollabEO:
             sel_pwd = self.dlg.table_session.item(tix, 5).text()
             
             self.connect_to_server(nspaces="/start")
-            
-            if self.sio.connected:
-                self.emit_msg_to_server("start_session", msg_data={"mail":sel_mail, "title":sel_title, "user":curr_name, "rid":sel_rid, "pwd":sel_pwd}, nspace="/start")
+            self.emit_msg_to_server("start_session", msg_data={"mail":sel_mail, "title":sel_title, "user":curr_name, "rid":sel_rid, "pwd":sel_pwd, "codecs":available_codecs()}, nspace="/start")
         else:
             self.show_message("No session selected.")
     
@@ -741,15 +1833,20 @@ class QollabEO:
         curr_rid = url_parts[1]
         curr_pwd = url_parts[2]
         
-        self.connect_to_server(url=curr_url, sio_path=curr_sio_path, auth={"rid":curr_rid, "pwd":curr_pwd},  nspaces="/join")
-        
-        if self.sio.connected:
-            self.emit_msg_to_server("join_session", msg_data={"user":curr_name, "rid":curr_rid, "pwd":curr_pwd}, nspace="/join")
+        #the auth dict is sent again on every reconnect; see _on_session_joined
+        self.join_auth = {"rid":curr_rid, "pwd":curr_pwd}
+        self.connect_to_server(url=curr_url, sio_path=curr_sio_path, auth=self.join_auth,  nspaces="/join")
+        self.emit_msg_to_server("join_session", msg_data={"user":curr_name, "rid":curr_rid, "pwd":curr_pwd, "codecs":available_codecs()}, nspace="/join")
     
-    def set_rect_tool(self):
-        if self.meeting_dlg.add_rect_button.isChecked():
-            self.canvas.setMapTool(self.rect_tool)
-            self.rect_tool.set_user(self.name)
+    def set_note_tool(self, button, checked=False):
+        #one note tool at a time; unchecking the active one returns to panning
+        if button.isChecked():
+            for other in self.note_tools:
+                if other is not button:
+                    other.setChecked(False)
+            tool = self.note_tools[button]
+            self.canvas.setMapTool(tool)
+            tool.set_user(self.name)
         else:
             self.canvas.setMapTool(self.pan_tool)
 
@@ -759,8 +1856,16 @@ class QollabEO:
         # Create the dialog with elements (after translation) and keep reference
         # Only create GUI ONCE in callback, so that it will only load when the plugin is started
         if self.first_start == True:
+            if not self.initialized:
+                try:
+                    self._lazy_init()
+                except ImportError as err:
+                    self.show_message(str(err), level="critical", seconds=10)
+                    return
+            
             self.first_start = False
             
+            from .qollabeo_dialog import QollabEODialog
             self.dlg = QollabEODialog()
             self.dlg.setWindowTitle("QollabEO")
             self.dlg.closed.connect(self.dlg_closed)  #use lambda: self.dlg_closed() to pass parameters;
@@ -778,14 +1883,26 @@ class QollabEO:
             self.dlg.qtsig_joined.connect(self.launch_room_dlg)
             self.dlg.qtsig_entered.connect(self.add_user)
             self.dlg.qtsig_user_list.connect(self.add_user_from_list)
+            self.dlg.qtsig_roster.connect(self.apply_roster_event)
+            self.dlg.qtsig_roster_sync.connect(self.send_roster_to)
             self.dlg.qtsig_room_left.connect(self.remove_user)
+            self.dlg.qtsig_members.connect(self.sync_members)
             self.dlg.qtsig_room_closed.connect(self.leave_session)
             self.dlg.qtsig_extent.connect(self.set_extent_from_remote)
             self.dlg.qtsig_crs.connect(self.set_crs_from_remote)
+            self.dlg.qtsig_crs_want.connect(self.send_crs_def)
             self.dlg.qtsig_vis_changed.connect(self.vis_remote_lyr)
             self.dlg.qtsig_lyr_added.connect(self.add_remote_lyr)
             self.dlg.qtsig_lyr_removed.connect(self.remove_remote_lyr)
+            self.dlg.qtsig_lyrs_changed.connect(self.apply_remote_lyr_diff)
+            self.dlg.qtsig_lyrs_sync.connect(self.send_lyrs_to)
+            self.dlg.qtsig_lyr_stream.connect(self.handle_lyr_stream)
+            self.dlg.qtsig_lyr_chunk.connect(self.add_remote_chunk)
+            self.dlg.qtsig_lyr_manifest.connect(self.add_raster_manifest)
+            self.dlg.qtsig_lyr_blob.connect(self.raster_chunk_received)
             self.dlg.qtsig_feat_added.connect(self.add_remote_feat)
+            self.dlg.qtsig_stroke.connect(self.draw_remote_strokes)
+            self.dlg.qtsig_notes_state.connect(self.add_notes_state)
             
             #QComboBox maxitemsVisible only used when QQomboBox is editable;
             #to disable editing the underlying linedit is changed; flound here: https://forum.qt.io/topic/125735/set-maxvisibleitems-property-in-fusion-style-for-qtcombobox-dropdown-box/2
@@ -829,6 +1946,9 @@ class QollabEO:
         self.fill_table_session()
         
         self.canvas = self.iface.mapCanvas()
+        
+        #open the connection in the background while the user fills in the dialog
+        self.net.prewarm(self.url, self.sio_path)
                         
         # show the dialog
         self.dlg.show()
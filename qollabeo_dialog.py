@@ -24,12 +24,14 @@
 
 import os
 
-from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 from qgis.PyQt import QtCore
 
-# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
+from .ui_cache import load_form_class
+
+# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer;
+# the form is taken from a precompiled/cached module instead of parsing the .ui on every start
+FORM_CLASS = load_form_class(os.path.join(
     os.path.dirname(__file__), 'qollabeo_dialog_base.ui'))
 
 
@@ -47,16 +49,28 @@ class QollabEODialog(QtWidgets.QDialog, FORM_CLASS):
     qtsig_entered = QtCore.pyqtSignal(object)
     
     qtsig_user_list = QtCore.pyqtSignal(object)
+    qtsig_roster = QtCore.pyqtSignal(object)
+    qtsig_roster_sync = QtCore.pyqtSignal(object)
     qtsig_room_left = QtCore.pyqtSignal(object)
+    qtsig_members = QtCore.pyqtSignal(object)
     qtsig_room_closed = QtCore.pyqtSignal()
     
     qtsig_extent = QtCore.pyqtSignal(object)
     qtsig_crs = QtCore.pyqtSignal(object)
+    qtsig_crs_want = QtCore.pyqtSignal(object)
     qtsig_vis_changed = QtCore.pyqtSignal(object)
     qtsig_lyr_added = QtCore.pyqtSignal(object)
     qtsig_lyr_removed = QtCore.pyqtSignal(object)
+    qtsig_lyrs_changed = QtCore.pyqtSignal(object)
+    qtsig_lyrs_sync = QtCore.pyqtSignal(object)
+    qtsig_lyr_stream = QtCore.pyqtSignal(object)
+    qtsig_lyr_chunk = QtCore.pyqtSignal(object)
+    qtsig_lyr_manifest = QtCore.pyqtSignal(object)
+    qtsig_lyr_blob = QtCore.pyqtSignal(object)
     
     qtsig_feat_added = QtCore.pyqtSignal(object)
+    qtsig_stroke = QtCore.pyqtSignal(object)
+    qtsig_notes_state = QtCore.pyqtSignal(object)
         
     def __init__(self, parent=None):
         """Constructor."""
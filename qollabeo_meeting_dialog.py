@@ -24,21 +24,83 @@
 
 import os
 
-from qgis.PyQt import uic
 from qgis.PyQt import QtWidgets
 from qgis.PyQt import QtCore
 
+from .ui_cache import load_form_class
+from .core.roster import Roster
+
 from collections import OrderedDict
 
-# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer
-FORM_CLASS, _ = uic.loadUiType(os.path.join(
+# This loads your .ui file so that PyQt can populate your plugin with the elements from Qt Designer;
+# the form is taken from a precompiled/cached module instead of parsing the .ui on every start
+FORM_CLASS = load_form_class(os.path.join(
     os.path.dirname(__file__), 'qollabeo_dialog_meeting.ui'))
 
+class RosterModel(QtCore.QAbstractListModel):
+    """List model of the user list on top of a Roster.
+
+    A user is appended as last row; a removed user is replaced by the last
+    one (see Roster.remove), hence, inserting and removing only touch one or
+    two rows instead of rebuilding the list.
+    """
+    
+    SidRole = QtCore.Qt.UserRole
+    
+    def __init__(self, roster, parent=None):
+        super(RosterModel, self).__init__(parent)
+        self.roster = roster
+    
+    def rowCount(self, parent=QtCore.QModelIndex()):
+        return 0 if parent.isValid() else len(self.roster)
+    
+    def data(self, index, role=QtCore.Qt.DisplayRole):
+        if not index.isValid() or index.row() >= len(self.roster):
+            return None
+        sid = self.roster.sids[index.row()]
+        if role == QtCore.Qt.DisplayRole:
+            return self.roster.names[sid]
+        if role == self.SidRole:
+            return sid
+        if role == QtCore.Qt.SizeHintRole:
+            return QtCore.QSize(10,30)
+        return None
+    
+    def add_user(self, sid, name):
+        if sid in self.roster:
+            return False
+        row = len(self.roster)
+        self.beginInsertRows(QtCore.QModelIndex(), row, row)
+        self.roster.add(sid, name)
+        self.endInsertRows()
+        return True
+    
+    def remove_user(self, sid):
+        if sid not in self.roster:
+            return False
+        last = len(self.roster) - 1
+        self.beginRemoveRows(QtCore.QModelIndex(), last, last)
+        row, moved = self.roster.remove(sid)
+        self.endRemoveRows()
+        if moved is not None:
+            ix = self.index(row)
+            self.dataChanged.emit(ix, ix)
+        return True
+    
+    def reset_users(self, ver, users):
+        self.beginResetModel()
+        self.roster.reset(ver)
+        for sid, name in users.items():
+            self.roster.add(sid, name)
+        self.endResetModel()
+
 class MeetingDialog(QtWidgets.QDialog, FORM_CLASS):
     
     #added to send custon closed signal when X button in dialog pressed
     closed = QtCore.pyqtSignal()
     qtsig_local_feat_added = QtCore.pyqtSignal(object)
+    qtsig_local_stroke = QtCore.pyqtSignal(str, object)
+    qtsig_local_feat_changed = QtCore.pyqtSignal(object)
 
     def __init__(self, parent=None):
         """Constructor."""
@@ -50,35 +112,40 @@ class MeetingDialog(QtWidgets.QDialog, FORM_CLASS):
         # #widgets-and-dialogs-with-auto-connect
         self.setupUi(self)
         self.rid = None
+        self.sid = None
+        self.roster = Roster()
+        self.user_model = RosterModel(self.roster, self)
+        self.list_user.setModel(self.user_model)
     
     def add_user(self, name=None, sid=None):
-        item = QtWidgets.QListWidgetItem(name)
-        item.setSizeHint(QtCore.QSize(10,30))
-        item.value = sid
-        self.list_user.addItem(item)
-
+        return self.user_model.add_user(sid, name)
+    
     def remove_user(self, data):
-        sid = data["sid"]
-        all_sids = list(self.get_all_users().keys())
-        sid_ix = all_sids.index(sid)
-        self.list_user.takeItem(sid_ix)
+        return self.user_model.remove_user(data["sid"])
     
     def add_user_from_list(self, user_list):
-        
-        old_users = [self.list_user.item(i).value for i in range(self.list_user.count())]
-        pot_users = user_list.keys()
-        
-        new_users = (set(pot_users) - set(old_users))
+        #user list of hosts without roster versions
+        for sid, name in user_list.items():
+            self.user_model.add_user(sid, name)
     
-        for sid in new_users:
-            self.add_user(name=user_list[sid], sid=sid)
+    def reset_users(self, ver, users):
+        self.user_model.reset_users(ver, users)
         
     def get_all_users(self):
-        user_list = OrderedDict()
-        for i in range(self.list_user.count()):
-            list_item = self.list_user.item(i)
-            user_list[list_item.value] = list_item.text()
-        return user_list
+        return OrderedDict(self.roster.users)
+    
+    def show_metrics(self, own, peers):
+        #one row per user; the own stats for this client, the reported ones for all others
+        fmt = lambda value: "-" if value is None else "%.0f" % value
+        users = self.get_all_users()
+        self.table_metrics.setRowCount(len(users))
+        for row, (sid, name) in enumerate(users.items()):
+            stats = own if sid == self.sid else peers.get(sid, {})
+            for col, text in enumerate((name, fmt(stats.get("rtt")), fmt(stats.get("lag")))):
+                self.table_metrics.setItem(row, col, QtWidgets.QTableWidgetItem(text))
+        
+        self.label_metrics.setText("in: %.1f msg/s, %.1f kB/s  out: %.1f msg/s, %.1f kB/s" % (
+            own["in_rate"], own["in_bps"] / 1024.0, own["out_rate"], own["out_bps"] / 1024.0))
     
     #overriding dialogs close event to catch the signal in the plugin itself;
     def closeEvent(self, event):
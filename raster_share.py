@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+import os
+
+from qgis.core import QgsProviderRegistry, QgsRasterLayer
+
+
+def raster_path(lyr):
+    return QgsProviderRegistry.instance().decodeUri("gdal", lyr.source()).get("path") or lyr.source()
+
+
+def is_shareable_raster(lyr):
+    """Local single file rasters (GeoTIFF, ...) are shared as files."""
+    return isinstance(lyr, QgsRasterLayer) and lyr.providerType() == "gdal" and os.path.isfile(raster_path(lyr))
+
+
+def raster_info(lyr):
+    """Description of a local raster for lyrs_changed; the manifest follows once the file is hashed."""
+    return {"name":lyr.name(),
+            "kind":"raster",
+            "ext":os.path.splitext(raster_path(lyr))[1].lower()}
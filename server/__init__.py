@@ -0,0 +1,3 @@
+# -*- coding: utf-8 -*-
+#reference room server of the QollabEO protocol (python -m server); not part of the QGIS plugin.
+#it uses the pure core package of the plugin for the room state
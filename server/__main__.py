@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+"""Run the reference room server: python -m server [--port 5000] [--path /qollab]
+
+Point URL and SIO_PATH in config.txt of the plugin to it, e.g.
+URL=http://127.0.0.1:5000 and SIO_PATH=/qollab.
+"""
+import argparse
+import os
+import sys
+
+#the room state is built on the pure core package of the plugin
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from aiohttp import web
+
+from server.app import create_server, message_queue
+from server.rooms import RoomStore
+
+
+def main():
+    parser = argparse.ArgumentParser(description="QollabEO room server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=5000)
+    parser.add_argument("--path", default="/qollab", help="socket.io path; SIO_PATH of the plugin")
+    parser.add_argument("--journal", type=int, default=1000, help="room events kept for resuming clients")
+    parser.add_argument("--host-grace", type=float, default=30.0, help="seconds a room waits for its disconnected host")
+    parser.add_argument("--user-grace", type=float, default=30.0, help="seconds a disconnected user stays in the room")
+    parser.add_argument("--message-queue", default=None,
+                        help="redis:// or amqp:// url of a pub/sub backend shared by several server processes")
+    parser.add_argument("--cors", default="*", help="allowed origins")
+    args = parser.parse_args()
+
+    client_manager = message_queue(args.message_queue) if args.message_queue else None
+    sio = create_server(RoomStore(journal_size=args.journal), client_manager=client_manager,
+                        host_grace=args.host_grace, user_grace=args.user_grace,
+                        async_mode="aiohttp", cors_allowed_origins=args.cors)
+    app = web.Application()
+    sio.attach(app, socketio_path=args.path.strip("/"))
+    web.run_app(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,403 @@
+# -*- coding: utf-8 -*-
+import asyncio
+import time
+
+import socketio
+
+from core.journal import COMPACT_KEYS
+from .rooms import RoomStore
+
+#events of the host relayed to all participants under a new name; all others keep their name
+HOST_RENAMES = {"set_extent": "extent_changed",
+                "set_crs": "crs_changed",
+                "set_codec": "codec_changed",
+                "lyr_vis_changed": "vis_changed"}
+HOST_RELAYED = ("set_extent", "set_crs", "set_codec", "lyr_vis_changed", "lyr_added", "lyr_removed",
+                "lyrs_changed", "lyr_manifest", "user_joined", "user_left")
+#stream control and roster / crs requests of the participants; only the host serves layers, user list and crs
+USER_FORWARDED = ("lyrs_sync", "lyr_ack", "lyr_resume", "lyr_want", "roster_sync", "crs_want")
+#strokes being drawn by any member; passed on to everyone else in the room
+STROKE_EVENTS = ("stroke_begin", "stroke_append", "stroke_end")
+
+
+class RoomNamespace(socketio.AsyncNamespace):
+    """Shared helpers of the /start and /join namespaces."""
+
+    def __init__(self, namespace, store):
+        super().__init__(namespace)
+        self.store = store
+        for event in STROKE_EVENTS:
+            setattr(self, "on_" + event, self._pass_on(event))
+
+    async def publish(self, room, audience, event, data):
+        """Journal an event and deliver it to all members of the audience."""
+        data = dict(data)
+        seq = room.journals[audience].append(event, data, key=COMPACT_KEYS.get(event))
+        if audience == "host":
+            await self.emit(event, dict(data, seq=seq), to=room.host_sid, namespace="/start")
+        else:
+            await self.emit(event, dict(data, seq=seq), to=room.rid, namespace="/join")
+
+    async def add_notes(self, room, event, data):
+        #notes are stamped with their sequence number before anyone sees them
+        if event == "feat_batch":
+            feats = [dict(feat, codec=data.get("codec", "wkt"), res=data.get("res")) for feat in data["feats"]]
+            stamped = room.notes.add(feats)
+            if not stamped:
+                return
+            data = dict(data, feats=[{key: value for key, value in feat.items() if key not in ("codec", "res")}
+                                     for feat in stamped])
+        else:
+            stamped = room.notes.add([data])
+            if not stamped:
+                return
+            data = stamped[0]
+        await self.publish(room, "host", event, data)
+        await self.publish(room, "users", event, data)
+
+    async def on_feat_added(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            await self.add_notes(room, "feat_added", data)
+
+    async def on_feat_batch(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            await self.add_notes(room, "feat_batch", data)
+
+    async def change_note(self, room, sid, event, data):
+        #updates and deletes are merged last-writer-wins; only applied changes are sent on, nested
+        #in "note" as the journal stamps its own seq. the version carries the sid a member had when
+        #it joined, it does not change with a reconnect. any other sid (older clients send none)
+        #is replaced with the current one so no member can write versions in the name of another
+        joined = room.join_sids.get(sid)
+        ver_sid = data.get("sid") if joined is not None and data.get("sid") == joined[0] else sid
+        note = room.notes.change(dict(data, sid=ver_sid, deleted=event == "feat_delete"))
+        if note is None:
+            return
+        await self.publish(room, "host", event, {"note": note})
+        await self.publish(room, "users", event, {"note": note})
+
+    async def on_feat_update(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            await self.change_note(room, sid, "feat_update", data)
+
+    async def on_feat_delete(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            await self.change_note(room, sid, "feat_delete", data)
+
+    async def on_notes_sync(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None:
+            await self.emit("notes_state", room.notes.sync(int(data.get("seq", -1)), bool(data.get("snapshot"))),
+                            to=sid)
+
+    async def on_notes_ack(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            room.notes_acks[sid] = int(data.get("seq", -1))
+            compact_notes(room)
+
+    async def on_clock_ping(self, sid, data):
+        #server time for the clock offset estimation of the clients
+        await self.emit("clock_pong", {"t0": data.get("t0"), "ts": time.time() * 1000.0}, to=sid)
+
+    async def pass_on(self, sid, event, data):
+        """Deliver an event of a member to everyone else in the room with the sid of the sender; not journaled."""
+        room = self.store.room_of(self.namespace, sid)
+        if room is None or not room.active:
+            return
+        data = dict(data, sid=sid)
+        if room.host_sid != sid:
+            await self.emit(event, data, to=room.host_sid, namespace="/start")
+        await self.emit(event, data, to=room.rid, skip_sid=sid, namespace="/join")
+
+    def _pass_on(self, event):
+        async def pass_on(sid, data):
+            await self.pass_on(sid, event, data)
+        return pass_on
+
+    async def on_peer_stats(self, sid, data):
+        #rtt and lag reported by a member; kept for peer_table and only passed on to the host
+        room = self.store.room_of(self.namespace, sid)
+        if room is None or not room.active:
+            return
+        data = dict(data, sid=sid)
+        room.peer_stats[sid] = data
+        if room.host_sid != sid:
+            await self.emit("peer_stats", data, to=room.host_sid, namespace="/start")
+
+    async def on_peer_table(self, sid, data):
+        #latest stats of all other members for a single member asking for them
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.active:
+            peers = [stats for member, stats in room.peer_stats.items() if member != sid]
+            await self.emit("peer_table", {"peers": peers}, to=sid)
+
+
+def compact_notes(room):
+    #tombstones are dropped once the host and every participant acknowledged them
+    members = [room.host_sid] + list(room.users)
+    if all(member in room.notes_acks for member in members):
+        room.notes.compact(min(room.notes_acks[member] for member in members))
+
+
+class ScheduleNamespace(socketio.AsyncNamespace):
+
+    def __init__(self, store):
+        super().__init__("/schedule")
+        self.store = store
+
+    async def on_schedule_session(self, sid, data):
+        room = self.store.schedule(data["mail"], data["title"], data["from"], data["to"])
+        await self.emit("session_created", {"mail": room.mail, "title": room.title, "rid": room.rid, "pwd": room.pwd,
+                                            "from_time": room.from_time, "to_time": room.to_time}, to=sid)
+
+
+class StartNamespace(RoomNamespace):
+    """The host of a room."""
+
+    def __init__(self, store, host_grace=30.0):
+        super().__init__("/start", store)
+        self.host_grace = host_grace
+        for event in HOST_RELAYED:
+            setattr(self, "on_" + event, self._relay(HOST_RENAMES.get(event, event)))
+
+    def _relay(self, event):
+        async def relay(sid, data):
+            room = self.host_room(sid)
+            if room is None:
+                return
+            if data.get("to") is not None:
+                #state for a single user (e.g. a new one); not journaled as it is no change of the room
+                if self.store.room_of("/join", data["to"]) is room:
+                    await self.emit(event, data, to=data["to"], namespace="/join")
+                return
+            await self.publish(room, "users", event, data)
+        return relay
+
+    def host_room(self, sid):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None and room.host_sid == sid:
+            return room
+        return None
+
+    async def on_start_session(self, sid, data):
+        room = self.store.get(data.get("rid"), data.get("pwd"))
+        if room is None or room.mail != data.get("mail"):
+            await self.emit("start_failed", to=sid)
+            return
+
+        if room.close_task is not None:
+            room.close_task.cancel()
+            room.close_task = None
+        if room.active and room.host_sid != sid:
+            #the host started the session again (e.g. from another instance); the old one loses the room
+            self.store.unbind(self.namespace, room.host_sid)
+        room.peer_stats.pop(room.host_sid, None)
+        room.host_sid = sid
+        room.host_user = data.get("user")
+        room.join_sids[sid] = (sid, room.host_user)
+        self.store.bind(self.namespace, sid, room)
+        await self.emit("session_started", {"rid": room.rid, "title": room.title, "user": room.host_user, "sid": sid,
+                                            "head": room.journals["host"].head}, to=sid)
+
+    async def on_user_list(self, sid, data):
+        room = self.host_room(sid)
+        if room is None:
+            return
+        if data.get("to") is not None:
+            if self.store.room_of("/join", data["to"]) is not room:
+                return
+            #full user list with the roster version for a single user; the changes are journaled
+            await self.emit("user_list", {"ver": data.get("ver"), "users": data.get("users", {})},
+                            to=data["to"], namespace="/join")
+            return
+        msg = {"users": data.get("users", {})}
+        if data.get("ver") is not None:
+            msg["ver"] = data["ver"]
+        await self.publish(room, "users", "user_list", msg)
+
+    def reattach_host(self, sid, rid):
+        """Room of the host sid; a host reconnected with a new sid takes over its room again if it still waits for it."""
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None:
+            return room
+        room = self.store.get(rid)
+        if room is None or room.close_task is None:
+            return None
+        room.close_task.cancel()
+        room.close_task = None
+        room.peer_stats.pop(room.host_sid, None)
+        room.rejoin(sid, room.host_sid, room.host_user)
+        room.host_sid = sid
+        self.store.bind(self.namespace, sid, room)
+        return room
+
+    async def on_resume(self, sid, data):
+        room = self.reattach_host(sid, data.get("rid"))
+        if room is None:
+            return
+        answer = room.journals["host"].resume(int(data.get("after", 0)))
+        if answer["kind"] == "snapshot":
+            #room_entered / room_left of the gap are lost; the host gets the current members instead
+            answer["members"] = {member: {"user": user, "codecs": room.codecs.get(member, ["wkt"])}
+                                 for member, user in room.users.items()}
+        await self.emit("journal", answer, to=sid)
+
+    async def on_notes_sync(self, sid, data):
+        self.reattach_host(sid, data.get("rid"))
+        await super().on_notes_sync(sid, data)
+
+    async def on_lyr_chunk(self, sid, data):
+        room = self.host_room(sid)
+        if room is None:
+            return
+        #chunks of a resume or late join only go to this participant; they are not journaled
+        #as every stream has its own sequence numbers
+        if data.get("to") is not None:
+            if self.store.room_of("/join", data["to"]) is room:
+                await self.emit("lyr_chunk", data, to=data["to"], namespace="/join")
+        else:
+            await self.emit("lyr_chunk", data, to=room.rid, namespace="/join")
+
+    async def on_lyr_blob(self, sid, data):
+        room = self.host_room(sid)
+        if room is not None and data.get("to") is not None and self.store.room_of("/join", data["to"]) is room:
+            await self.emit("lyr_blob", data, to=data["to"], namespace="/join")
+
+    async def on_crs_def(self, sid, data):
+        #wkt of a crs unknown to a single participant
+        room = self.host_room(sid)
+        if room is not None and data.get("to") is not None and self.store.room_of("/join", data["to"]) is room:
+            await self.emit("crs_def", data, to=data["to"], namespace="/join")
+
+    async def on_disconnect(self, sid, reason=None):
+        room = self.store.unbind(self.namespace, sid)
+        if room is None or room.host_sid != sid:
+            return
+        #a short network outage of the host does not end the meeting
+        room.close_task = asyncio.ensure_future(self.close_room(room, sid))
+
+    async def close_room(self, room, sid):
+        await asyncio.sleep(self.host_grace)
+        if room.host_sid != sid:
+            return
+        room.close_task = None
+        for task in room.leave_tasks.values():
+            task.cancel()
+        await self.emit("room_closed", to=room.rid, namespace="/join")
+        await self.server.close_room(room.rid, namespace="/join")
+        room.reset()
+
+
+class JoinNamespace(RoomNamespace):
+    """The participants of a room."""
+
+    def __init__(self, store, user_grace=30.0):
+        super().__init__("/join", store)
+        self.user_grace = user_grace
+        for event in USER_FORWARDED:
+            setattr(self, "on_" + event, self._forward(event))
+
+    def _forward(self, event):
+        async def forward(sid, data):
+            room = self.store.room_of(self.namespace, sid)
+            if room is not None and room.active:
+                await self.emit(event, dict(data, sid=sid), to=room.host_sid, namespace="/start")
+        return forward
+
+    async def on_connect(self, sid, environ, auth=None):
+        auth = auth or {}
+        room = self.store.get(auth.get("rid"), auth.get("pwd"))
+        if room is None:
+            raise socketio.exceptions.ConnectionRefusedError("unknown session")
+        #a reconnecting participant receives the room events again right away; it announces
+        #itself with join_session only on the first connect, afterwards its user and previous sid
+        #come with auth and the new sid takes the place of the old one
+        self.store.bind(self.namespace, sid, room)
+        if room.active:
+            await self.enter_room(sid, room.rid)
+            if auth.get("user") is not None:
+                if room.users.get(auth.get("sid")) == auth["user"]:
+                    await self.leave(room, auth["sid"])
+                room.rejoin(sid, auth.get("sid"), auth["user"])
+                await self.enter(room, sid, auth["user"], auth.get("codecs", ["wkt"]))
+
+    async def on_join_session(self, sid, data):
+        room = self.store.get(data.get("rid"), data.get("pwd"))
+        if room is None or not room.active:
+            await self.emit("join_failed", to=sid)
+            return
+
+        self.store.bind(self.namespace, sid, room)
+        await self.enter_room(sid, room.rid)
+        await self.emit("session_joined", {"rid": room.rid, "title": room.title, "user": data.get("user"), "sid": sid,
+                                           "head": room.journals["users"].head}, to=sid)
+        room.join_sids[sid] = (sid, data.get("user"))
+        await self.enter(room, sid, data.get("user"), data.get("codecs", ["wkt"]))
+
+    async def enter(self, room, sid, user, codecs):
+        room.users[sid] = user
+        room.codecs[sid] = codecs
+        await self.publish(room, "host", "room_entered", {"user": user, "sid": sid, "codecs": codecs})
+
+    async def on_resume(self, sid, data):
+        room = self.store.room_of(self.namespace, sid)
+        if room is not None:
+            await self.emit("journal", room.journals["users"].resume(int(data.get("after", 0))), to=sid)
+
+    async def on_disconnect(self, sid, reason=None):
+        room = self.store.unbind(self.namespace, sid)
+        if room is None or sid not in room.users:
+            return
+        #like the host, a participant gets user_grace seconds to reconnect before it leaves the room
+        room.leave_tasks[sid] = asyncio.ensure_future(self.leave_later(room, sid))
+
+    async def leave_later(self, room, sid):
+        await asyncio.sleep(self.user_grace)
+        if room.leave_tasks.get(sid) is asyncio.current_task():
+            await self.leave(room, sid)
+
+    async def leave(self, room, sid):
+        task = room.leave_tasks.pop(sid, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        #the old socket of a reconnected participant may not have timed out yet
+        self.store.unbind(self.namespace, sid)
+        if sid not in room.users:
+            return
+        left = {"sid": sid, "user": room.users.pop(sid)}
+        room.codecs.pop(sid, None)
+        room.notes_acks.pop(sid, None)
+        room.peer_stats.pop(sid, None)
+        if room.active:
+            compact_notes(room)
+            await self.publish(room, "host", "room_left", left)
+            await self.publish(room, "users", "room_left", left)
+
+
+def create_server(store=None, client_manager=None, host_grace=30.0, user_grace=30.0, **kwargs):
+    """AsyncServer with the QollabEO namespaces; kwargs are passed on to socketio.AsyncServer.
+
+    client_manager is the pub/sub backend of python-socketio (e.g. socketio.AsyncRedisManager);
+    the room state itself stays in store.
+    """
+    store = store if store is not None else RoomStore()
+    kwargs.setdefault("max_http_buffer_size", 16 * 1024 * 1024)
+    if client_manager is not None:
+        kwargs["client_manager"] = client_manager
+    sio = socketio.AsyncServer(**kwargs)
+    sio.register_namespace(ScheduleNamespace(store))
+    sio.register_namespace(StartNamespace(store, host_grace=host_grace))
+    sio.register_namespace(JoinNamespace(store, user_grace=user_grace))
+    return sio
+
+
+def message_queue(url):
+    """python-socketio pub/sub manager for a redis:// or amqp:// url."""
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return socketio.AsyncRedisManager(url)
+    return socketio.AsyncAioPikaManager(url)
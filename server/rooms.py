@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+import secrets
+
+from core.journal import EventJournal
+from core.notes_state import NotesRoomState
+
+
+class Room:
+    """A scheduled session and, while it runs, the state of the meeting.
+
+    Room events are journaled per audience: "users" are the events sent to
+    all participants (/join), "host" the events sent to the host (/start).
+    """
+
+    def __init__(self, rid, pwd, mail, title, from_time, to_time, journal_size=1000, notes_page=5000):
+        self.rid = rid
+        self.pwd = pwd
+        self.mail = mail
+        self.title = title
+        self.from_time = from_time
+        self.to_time = to_time
+        self.journal_size = journal_size
+        self.notes_page = notes_page
+        self.close_task = None
+        self.reset()
+
+    def reset(self):
+        self.host_sid = None
+        self.host_user = None
+        self.users = {}
+        self.codecs = {}        #sid: geometry codecs of a member
+        self.join_sids = {}     #sid: (sid the member started or joined with, user), kept over reconnects
+        self.leave_tasks = {}   #sid: removal of a disconnected participant once its grace is over
+        self.notes = NotesRoomState(page_size=self.notes_page)
+        self.notes_acks = {}    #sid: highest notes seq acknowledged by a member
+        self.peer_stats = {}    #sid: latest rtt and lag reported by a member
+        self.journals = {"host": EventJournal(self.journal_size), "users": EventJournal(self.journal_size)}
+
+    @property
+    def active(self):
+        return self.host_sid is not None
+
+    def rejoin(self, sid, prev, user):
+        """Record sid as a reconnect of prev; it keeps the join sid of prev if prev was user's."""
+        joined = self.join_sids.pop(prev, None)
+        if joined is None or joined[1] != user:
+            joined = (sid, user)
+        self.join_sids[sid] = joined
+
+
+class RoomStore:
+    """In-memory rooms of one server process and the sockets bound to them."""
+
+    def __init__(self, journal_size=1000, notes_page=5000):
+        self.journal_size = journal_size
+        self.notes_page = notes_page
+        self.rooms = {}
+        self._bound = {}
+
+    def schedule(self, mail, title, from_time, to_time):
+        rid = secrets.token_hex(8)
+        while rid in self.rooms:
+            rid = secrets.token_hex(8)
+        room = Room(rid, secrets.token_hex(6), mail, title, from_time, to_time,
+                    journal_size=self.journal_size, notes_page=self.notes_page)
+        self.rooms[rid] = room
+        return room
+
+    def get(self, rid, pwd=None):
+        """The room rid; None if it does not exist or pwd is given and wrong."""
+        room = self.rooms.get(rid)
+        if room is None or (pwd is not None and not secrets.compare_digest(room.pwd, pwd)):
+            return None
+        return room
+
+    def bind(self, nspace, sid, room):
+        self._bound[(nspace, sid)] = room.rid
+
+    def unbind(self, nspace, sid):
+        return self.rooms.get(self._bound.pop((nspace, sid), None))
+
+    def room_of(self, nspace, sid):
+        return self.rooms.get(self._bound.get((nspace, sid)))
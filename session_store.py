@@ -0,0 +1,125 @@
+# -*- coding: utf-8 -*-
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+#all statements are constant strings with parameters; sqlite3 keeps them prepared in its statement cache
+_CREATE = ("CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, mail TEXT NOT NULL, title TEXT NOT NULL, rid TEXT NOT NULL, pwd TEXT NOT NULL, from_time INTEGER NOT NULL, to_time INTEGER NOT NULL);",
+           "CREATE INDEX IF NOT EXISTS sessions_to_time ON sessions (to_time);",
+           "CREATE TABLE IF NOT EXISTS sessions_archive (id INTEGER PRIMARY KEY, mail TEXT NOT NULL, title TEXT NOT NULL, rid TEXT NOT NULL, pwd TEXT NOT NULL, from_time INTEGER NOT NULL, to_time INTEGER NOT NULL);")
+
+_INSERT = "INSERT INTO sessions (mail, title, rid, pwd, from_time, to_time) VALUES (?, ?, ?, ?, ?, ?);"
+_UPCOMING = "SELECT mail, title, rid, pwd, from_time, to_time FROM sessions WHERE to_time >= ? ORDER BY from_time;"
+_EXPIRED = "SELECT id FROM sessions WHERE to_time < ? ORDER BY to_time LIMIT ?;"
+_ARCHIVE = "INSERT OR REPLACE INTO sessions_archive SELECT * FROM sessions WHERE id = ?;"
+_DELETE = "DELETE FROM sessions WHERE id = ?;"
+
+#version 0: sessions with from_time/to_time stored as text
+_SCHEMA_VERSION = 1
+
+TIME_FMT = "%Y-%m-%d %H:%M:%S"
+
+
+def to_epoch(value):
+    """Seconds since epoch for a datetime or a "YYYY-MM-DD HH:MM:SS" string (local time)."""
+    if isinstance(value, (int, float)):
+        return int(value)
+    if not isinstance(value, datetime):
+        value = datetime.strptime(value[:19], TIME_FMT)
+    return int(value.timestamp())
+
+
+def from_epoch(value):
+    return datetime.fromtimestamp(value).strftime(TIME_FMT)
+
+
+class SessionStore:
+    """Local store of the scheduled sessions (sid.db).
+
+    The store holds a single connection which is confined to the thread that
+    created the store (the QGIS GUI thread); calls from other threads raise a
+    RuntimeError. Times are stored as integer seconds since epoch, sessions
+    are looked up by the indexed to_time and sessions which ended more than
+    retention_days ago are moved to the sessions_archive table by prune().
+    """
+
+    def __init__(self, path, retention_days=30):
+        self.path = path
+        self.retention = retention_days * 86400
+        self._owner = threading.get_ident()
+        self._db = None
+
+    def _conn(self):
+        if threading.get_ident() != self._owner:
+            raise RuntimeError("SessionStore used from a different thread.")
+
+        if self._db is None:
+            db = sqlite3.connect(self.path, cached_statements=32)
+            db.execute("PRAGMA journal_mode=WAL;")
+            db.execute("PRAGMA synchronous=NORMAL;")
+            self._migrate(db)
+            self._db = db
+        return self._db
+
+    def _migrate(self, db):
+        version = db.execute("PRAGMA user_version;").fetchone()[0]
+        if version >= _SCHEMA_VERSION:
+            return
+
+        #sqlite3 does not open a transaction before DDL by itself; without the explicit BEGIN the
+        #statements below would commit one by one. the old table is kept as backup and dropped last
+        db.execute("BEGIN;")
+        with db:
+            old_exists = db.execute("SELECT count(*) FROM sqlite_master WHERE type='table' AND name='sessions';").fetchone()[0]
+            rows = []
+            if old_exists:
+                db.execute("ALTER TABLE sessions RENAME TO sessions_v0;")
+                rows = db.execute("SELECT mail, title, rid, pwd, from_time, to_time FROM sessions_v0;").fetchall()
+
+            for stmt in _CREATE:
+                db.execute(stmt)
+
+            for mail, title, rid, pwd, from_time, to_time in rows:
+                try:
+                    db.execute(_INSERT, (mail, title, rid, pwd, to_epoch(from_time), to_epoch(to_time)))
+                except (TypeError, ValueError):
+                    #sessions with unreadable times can't be shown anyway
+                    continue
+            if old_exists:
+                db.execute("DROP TABLE sessions_v0;")
+            db.execute("PRAGMA user_version = %d;" % _SCHEMA_VERSION)
+
+    def add_session(self, mail, title, rid, pwd, from_time, to_time):
+        db = self._conn()
+        with db:
+            db.execute(_INSERT, (mail, title, rid, pwd, to_epoch(from_time), to_epoch(to_time)))
+
+    def upcoming_sessions(self, now=None, grace=3600):
+        """Sessions which did not end more than grace seconds ago.
+
+        Rows are (mail, title, rid, pwd, from, to) with times formatted as TIME_FMT.
+        """
+        if now is None:
+            now = time.time()
+        rows = self._conn().execute(_UPCOMING, (int(now - grace),)).fetchall()
+        return [(mail, title, rid, pwd, from_epoch(t_from), from_epoch(t_to)) for mail, title, rid, pwd, t_from, t_to in rows]
+
+    def prune(self, now=None, batch=200):
+        """Archive up to batch expired sessions; returns the number of archived sessions.
+
+        Call repeatedly (e.g. from a timer) until it returns 0 to keep every step short.
+        """
+        if now is None:
+            now = time.time()
+        db = self._conn()
+        with db:
+            ids = db.execute(_EXPIRED, (int(now - self.retention), batch)).fetchall()
+            db.executemany(_ARCHIVE, ids)
+            db.executemany(_DELETE, ids)
+        return len(ids)
+
+    def close(self):
+        if self._db is not None and threading.get_ident() == self._owner:
+            self._db.close()
+            self._db = None
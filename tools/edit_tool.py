@@ -0,0 +1,94 @@
+from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
+from qgis.core import QgsGeometry
+from qgis.PyQt.QtCore import Qt
+from qgis.PyQt.QtGui import QColor
+
+class NoteEditTool(QgsMapToolEmitPoint):
+    """Base of the tools changing existing notes; the note under the cursor is hit within tol_px screen pixels.
+
+    Changes are applied to the notes layer at once and sent by uid (see core.notes_state); a note
+    keeps its uid and geometry type.
+    """
+
+    def __init__(self, canvas, user, tol_px=4.0):
+        self.canvas = canvas
+        QgsMapToolEmitPoint.__init__(self, self.canvas)
+        self.user = user
+        self.tol_px = tol_px
+        self.notes = None
+        self.dlg = None
+
+    def set_notes(self, notes):
+        self.notes = notes
+
+    def set_dlg(self, dlg):
+        self.dlg = dlg
+
+    def set_user(self, name):
+        self.user = name
+
+    def note_at(self, pnt):
+        feats = self.notes.feats_at(pnt, self.tol_px * self.canvas.mapUnitsPerPixel())
+        return feats[0] if len(feats) > 0 else None
+
+class MoveNoteMapTool(NoteEditTool):
+    """Drag a note to a new position."""
+
+    def __init__(self, canvas, user, tol_px=4.0):
+        super(MoveNoteMapTool, self).__init__(canvas, user, tol_px)
+        self.rubberBand = QgsRubberBand(self.canvas)
+        self.rubberBand.setColor(Qt.red)
+        self.rubberBand.setWidth(1)
+        self.rubberBand.setFillColor(QColor(0,0,0,0))
+        self.reset()
+
+    def reset(self):
+        self.uid = self.geom = self.startPoint = None
+        self.rubberBand.reset()
+
+    def moved_geom(self, pnt):
+        geom = QgsGeometry(self.geom)
+        geom.translate(pnt.x() - self.startPoint.x(), pnt.y() - self.startPoint.y())
+        return geom
+
+    def canvasPressEvent(self, e):
+        self.reset()
+        pnt = self.toMapCoordinates(e.pos())
+        feat = self.note_at(pnt)
+        if feat is None:
+            return
+        self.uid = feat["uid"]
+        self.geom = feat.geometry()
+        self.startPoint = pnt
+
+    def canvasMoveEvent(self, e):
+        if self.uid is None:
+            return
+        self.rubberBand.setToGeometry(self.moved_geom(self.toMapCoordinates(e.pos())), None)
+        self.rubberBand.show()
+
+    def canvasReleaseEvent(self, e):
+        if self.uid is None:
+            return
+        pnt = self.toMapCoordinates(e.pos())
+        uid, geom = self.uid, self.moved_geom(pnt)
+        moved = pnt != self.startPoint
+        self.reset()
+        if not moved:
+            return
+        self.notes.change_geoms({uid: geom})
+        self.dlg.qtsig_local_feat_changed.emit({"uid":uid, "geom":geom})
+
+    def deactivate(self):
+        self.reset()
+        self.deactivated.emit()
+
+class DeleteNoteMapTool(NoteEditTool):
+    """Delete the note under a click."""
+
+    def canvasReleaseEvent(self, e):
+        feat = self.note_at(self.toMapCoordinates(e.pos()))
+        if feat is None:
+            return
+        self.notes.delete([feat["uid"]])
+        self.dlg.qtsig_local_feat_changed.emit({"uid":feat["uid"], "geom":None})
@@ -15,8 +15,8 @@ class RectangleMapTool(QgsMapToolEmitPoint):
         self.user = user
         self.reset()
 
-    def set_lyr(self, lyr):
-        self.lyr = lyr
+    def set_notes(self, notes):
+        self.notes = notes
     
     def set_dlg(self, dlg):
         self.dlg = dlg
@@ -40,19 +40,19 @@ class RectangleMapTool(QgsMapToolEmitPoint):
         r = self.rectangle()
         if r is not None:
                 
-            feat = QgsFeature(self.lyr.fields())
+            feat = QgsFeature(self.notes.fields())
             feat_uid = str(uuid.uuid4())
             
             feat.setAttribute('user', self.user)
             feat.setAttribute('uid', feat_uid)
             
-            feat.setGeometry(QgsGeometry.fromRect(self.rectangle()))
+            feat_geom = QgsGeometry.fromRect(r)
+            feat.setGeometry(feat_geom)
             
-            (res, outFeats) = self.lyr.dataProvider().addFeatures([feat])
+            self.notes.add_feats([feat])
             
-            self.lyr.reload()
-            
-            self.dlg.qtsig_local_feat_added.emit({"user":self.user, "geom":self.rectangle().asWktPolygon(), "uid":feat_uid})
+            #geometry is encoded when sending with the codec negotiated for the session
+            self.dlg.qtsig_local_feat_added.emit({"user":self.user, "geom":feat_geom, "rect":r, "uid":feat_uid})
             
         self.rubberBand.reset(QgsWkbTypes.PolygonGeometry)
         
@@ -0,0 +1,202 @@
+from qgis.gui import QgsMapToolEmitPoint, QgsRubberBand
+from qgis.core import QgsWkbTypes, QgsPointXY, QgsFeature, QgsGeometry
+from qgis.PyQt.QtCore import Qt, QTimer
+from qgis.PyQt.QtGui import QColor
+import math
+import uuid
+
+from ..core.sketch import StrokeSender
+
+def stroke_band(canvas, geom_type):
+    band = QgsRubberBand(canvas, geom_type)
+    band.setColor(Qt.red)
+    band.setWidth(1)
+    band.setFillColor(QColor(0,0,0,0))
+    return band
+
+class StrokePreview:
+    """Rubber bands of the strokes the other users are drawing, by uid."""
+
+    def __init__(self, canvas):
+        self.canvas = canvas
+        self.bands = {}
+
+    def begin(self, uid, kind, pts):
+        self.remove(uid)
+        geom_type = QgsWkbTypes.PolygonGeometry if kind == "Polygon" else QgsWkbTypes.LineGeometry
+        self.bands[uid] = stroke_band(self.canvas, geom_type)
+        self.append(uid, pts)
+
+    def append(self, uid, pts):
+        band = self.bands.get(uid)
+        if band is None or len(pts) == 0:
+            return
+        for x, y in pts[:-1]:
+            band.addPoint(QgsPointXY(x, y), False)
+        band.addPoint(QgsPointXY(*pts[-1]), True)
+        band.show()
+
+    def remove(self, uid):
+        band = self.bands.pop(uid, None)
+        if band is not None:
+            band.reset()
+            self.canvas.scene().removeItem(band)
+
+    def clear(self):
+        for uid in list(self.bands):
+            self.remove(uid)
+
+class SketchMapTool(QgsMapToolEmitPoint):
+    """Base of the sketch tools; the stroke being drawn is streamed to the other users (see core.sketch).
+
+    Strokes are simplified with a tolerance of tol_px screen pixels at the current scale and sent at
+    most max_hz times per second; the finished stroke is added as note like the rectangles.
+    """
+
+    geom_type = QgsWkbTypes.LineGeometry
+    kind = "LineString"
+
+    def __init__(self, canvas, user, max_hz=10.0, tol_px=2.0):
+        self.canvas = canvas
+        QgsMapToolEmitPoint.__init__(self, self.canvas)
+        self.rubberBand = stroke_band(self.canvas, self.geom_type)
+        self.user = user
+        self.tol_px = tol_px
+        self.notes = None
+        self.dlg = None
+
+        self.stream = StrokeSender(self.send_stroke, max_hz=max_hz)
+        #sends the vertices held back by the rate limit once the mouse stops
+        self.stream_timer = QTimer()
+        self.stream_timer.setSingleShot(True)
+        self.stream_timer.timeout.connect(self.poll_stream)
+
+    def set_notes(self, notes):
+        self.notes = notes
+
+    def set_dlg(self, dlg):
+        self.dlg = dlg
+
+    def set_user(self, name):
+        self.user = name
+
+    def send_stroke(self, event, data):
+        self.dlg.qtsig_local_stroke.emit(event, data)
+
+    def begin_stroke(self, pnt):
+        #coordinates are sent with about a tenth of a pixel precision
+        mupp = self.canvas.mapUnitsPerPixel()
+        self.stream.digits = max(0, int(math.ceil(-math.log10(mupp * 0.1)))) if mupp > 0 else None
+        self.stream.begin(str(uuid.uuid4()), self.user, self.kind, pnt.x(), pnt.y())
+        self.rubberBand.reset(self.geom_type)
+        self.rubberBand.addPoint(pnt, True)
+        self.rubberBand.show()
+
+    def add_vertex(self, pnt, tolerance):
+        self.rubberBand.addPoint(pnt, True)
+        self.schedule_poll(self.stream.add(pnt.x(), pnt.y(), tolerance))
+
+    def schedule_poll(self, delay):
+        if delay is not None and not self.stream_timer.isActive():
+            self.stream_timer.start(max(1, int(delay * 1000)))
+
+    def poll_stream(self):
+        self.schedule_poll(self.stream.poll())
+
+    def end_stroke(self, min_vertices):
+        """Finish the stroke; it is added as note if it has at least min_vertices vertices."""
+        self.stream_timer.stop()
+        uid = self.stream.uid
+        vertices = self.stream.end(min_vertices)
+        self.rubberBand.reset(self.geom_type)
+        if len(vertices) == 0:
+            return
+        pnts = [QgsPointXY(x, y) for x, y in vertices]
+        self.add_note(uid, self.stroke_geom(pnts))
+
+    def stroke_geom(self, pnts):
+        return QgsGeometry.fromPolylineXY(pnts)
+
+    def add_note(self, uid, feat_geom):
+        feat = QgsFeature(self.notes.fields())
+        feat.setAttribute('user', self.user)
+        feat.setAttribute('uid', uid)
+        feat.setGeometry(feat_geom)
+
+        self.notes.add_feats([feat])
+
+        #geometry is encoded when sending with the codec negotiated for the session
+        self.dlg.qtsig_local_feat_added.emit({"user":self.user, "geom":feat_geom, "uid":uid})
+
+    def cancel_stroke(self):
+        #a stroke left unfinished is dropped by everyone
+        self.stream_timer.stop()
+        self.stream.cancel()
+        self.rubberBand.reset(self.geom_type)
+
+    def deactivate(self):
+        if self.stream.active:
+            self.cancel_stroke()
+        self.deactivated.emit()
+
+class FreehandMapTool(SketchMapTool):
+    """Freehand line drawn while the mouse button is pressed."""
+
+    def canvasPressEvent(self, e):
+        self.begin_stroke(self.toMapCoordinates(e.pos()))
+
+    def canvasMoveEvent(self, e):
+        if not self.stream.active:
+            return
+        self.add_vertex(self.toMapCoordinates(e.pos()), self.tol_px * self.canvas.mapUnitsPerPixel())
+
+    def canvasReleaseEvent(self, e):
+        if not self.stream.active:
+            return
+        self.add_vertex(self.toMapCoordinates(e.pos()), self.tol_px * self.canvas.mapUnitsPerPixel())
+        self.end_stroke(min_vertices=2)
+
+class PolygonMapTool(SketchMapTool):
+    """Polygon with a vertex per left click; a right click finishes it."""
+
+    geom_type = QgsWkbTypes.PolygonGeometry
+    kind = "Polygon"
+
+    def canvasReleaseEvent(self, e):
+        if e.button() == Qt.RightButton:
+            self.end_stroke(min_vertices=3)
+            return
+        pnt = self.toMapCoordinates(e.pos())
+        if not self.stream.active:
+            self.begin_stroke(pnt)
+        else:
+            #clicked vertices are kept as they are
+            self.add_vertex(pnt, 0.0)
+
+    def canvasMoveEvent(self, e):
+        #floating vertex under the cursor; only shown locally
+        if not self.stream.active:
+            return
+        self.rubberBand.movePoint(self.toMapCoordinates(e.pos()))
+
+    def add_vertex(self, pnt, tolerance):
+        #the floating vertex becomes the clicked one; a new floating vertex follows the cursor
+        self.rubberBand.movePoint(pnt)
+        super(PolygonMapTool, self).add_vertex(pnt, tolerance)
+
+    def begin_stroke(self, pnt):
+        super(PolygonMapTool, self).begin_stroke(pnt)
+        self.rubberBand.addPoint(pnt, True)
+
+    def stroke_geom(self, pnts):
+        return QgsGeometry.fromPolygonXY([pnts + [pnts[0]]])
+
+class PointMapTool(SketchMapTool):
+    """Point marker per click; added at once, nothing to stream."""
+
+    geom_type = QgsWkbTypes.PointGeometry
+    kind = "Point"
+
+    def canvasReleaseEvent(self, e):
+        pnt = self.toMapCoordinates(e.pos())
+        self.add_note(str(uuid.uuid4()), QgsGeometry.fromPointXY(pnt))
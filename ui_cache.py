@@ -0,0 +1,58 @@
+# -*- coding: utf-8 -*-
+import importlib
+import importlib.util
+import os
+import zlib
+
+from qgis.PyQt import uic
+
+
+def _form_class(module):
+    for name in dir(module):
+        if name.startswith("Ui_"):
+            return getattr(module, name)
+    raise ImportError("No form class in %s" % module.__name__)
+
+
+def load_form_class(ui_path):
+    """Return the form class for a Qt Designer .ui file.
+
+    uic.loadUiType parses the .ui XML and generates the python code on every
+    start. Instead a precompiled module ui_<name>.py next to the .ui file
+    (pyuic5 <name>.ui -o ui_<name>.py) is used if it is up to date. Otherwise
+    the .ui file is compiled once into __pycache__ and the compiled module is
+    reused until the .ui file changes. loadUiType is only used as fallback,
+    e.g. if the plugin directory is read-only.
+    """
+    ui_dir, ui_file = os.path.split(ui_path)
+    base = os.path.splitext(ui_file)[0]
+    ui_mtime = os.path.getmtime(ui_path)
+
+    #precompiled module shipped with the plugin
+    pre_path = os.path.join(ui_dir, "ui_%s.py" % base)
+    if os.path.exists(pre_path) and os.path.getmtime(pre_path) >= ui_mtime:
+        try:
+            return _form_class(importlib.import_module(".ui_%s" % base, __package__))
+        except ImportError:
+            pass
+
+    try:
+        with open(ui_path, "rb") as ui_fobj:
+            ui_hash = zlib.crc32(ui_fobj.read())
+
+        cache_dir = os.path.join(ui_dir, "__pycache__")
+        cache_path = os.path.join(cache_dir, "ui_%s_%08x.py" % (base, ui_hash))
+        if not os.path.exists(cache_path):
+            os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = cache_path + ".tmp"
+            with open(ui_path, "r", encoding="utf-8") as ui_fobj, open(tmp_path, "w", encoding="utf-8") as py_fobj:
+                uic.compileUi(ui_fobj, py_fobj)
+            os.replace(tmp_path, cache_path)
+
+        spec = importlib.util.spec_from_file_location("qollabeo_ui_%s" % base, cache_path)
+        module = importlib.util.module_from_spec(spec)
+        spec.loader.exec_module(module)
+        return _form_class(module)
+    except (OSError, ImportError, SyntaxError):
+        form_class, _ = uic.loadUiType(ui_path)
+        return form_class